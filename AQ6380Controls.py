@@ -1,11 +1,20 @@
 """AQ6380Controls Library
-Depends on pyvisa, pyvisa-py as visa interface
+Depends on pyvisa, pyvisa-py as visa interface, or a plain socket, see OSATransport
+Depends on numpy for trace data
+Optional per command latency instrumentation, see OSAInstrumentation
 To get dependencies,
 pip install pyvisa
 pip install pyvisa-py
+pip install numpy
+pyvisa and its ResourceManager are loaded when the first OSA is opened, so importing
+this library and creating AQ6380Controls objects stays fast
 """
-import pyvisa
 import re
+import time
+import threading
+import numpy as np
+from OSAInstrumentation import Instrumentation
+from OSATransport import transports, createTransport, loadPyvisa
 #Constants
 sensitivities=['NHLD', 'NAUT',  'MID', 'HIGH1', 'HIGH2', 'HIGH3', 'NORM', 'RAPID1', 'RAPID2','RAPID3',
                'RAPID4', 'RAPID5', 'RAPID6']#Sensitivities indexed by code
@@ -16,6 +25,18 @@ tradSensitivities=['NORM', 'MID', 'HIGH1', 'HIGH2', 'HIGH3']
 rapidSensitivities=['RAPID1', 'RAPID2', 'RAPID3', 'RAPID4', 'RAPID5', 'RAPID6']
 resolutions=['0.005', '0.01', '0.02', '0.05', '0.1', '0.2', '0.5', '1', '2']
 sweepSpeeds=['1x', '2x']
+traceNames=['TRA', 'TRB', 'TRC', 'TRD', 'TRE', 'TRF', 'TRG']#Traces of the OSA, see AQ6380Controls.getTraces
+traceAttributes=['WRIT', 'FIX', 'MAX', 'MIN', 'RAVG', 'CALC']#Trace attributes in the order of their numbers
+traceFormats=['ASCII', 'REAL64', 'REAL32']#Trace transfer formats
+traceFormatCommands={'ASCII':':form:data ascii', 'REAL64':':form:data real,64', 'REAL32':':form:data real,32'}
+traceFormatTypes={'REAL64':'<f8', 'REAL32':'<f4'}#Little endian IEEE floating point
+completionModes=['poll', 'opc']#Sweep completion modes, see AQ6380Controls.waitForSweep
+analysisCategories={'peak':'filp', 'width':'swth', 'power':'pow', 'smsr':'smsr'}#:calc:cat of each analysis, see AQ6380Controls.analyze
+analysisFields={'peak':[('peakWavelength', 1e9), ('peakPower', 1)],
+                'width':[('widthCenter', 1e9), ('width', 1e9)],
+                'power':[('power', 1)],
+                'smsr':[('peakWavelength', 1e9), ('peakPower', 1), ('modeWavelength', 1e9), ('modePower', 1),
+                        ('smsr', 1), ('modeOffset', 1e9)]}#(field, scale) of each :calc:data? value; wavelengths in nm
 
 def dBmFromSensitivity(sens, speed=None):
     """dBmFromSensitivity:
@@ -89,6 +110,59 @@ def sensitivityFromCode(code):
     The sensitivity name as a string"""
     return sensitivities[int(code)]
 
+def checkResolution(resolution):
+    """checkResolution:
+    Checks a resolution against the resolutions of the OSA
+    INPUTS:
+    resolution (str or float): The resolution in nm, i.e. '0.02' or 0.02
+    Throws exception if resolution is invalid"""
+    try:
+        valid=f'{float(resolution):g}' in resolutions
+    except ValueError:
+        valid=False
+    if not valid:#Invalid resolution
+        print(f'Resolution of {resolution} invalid')
+        raise ValueError(f'Resolution of {resolution} is invalid')
+
+def parseBlockHeader(data):
+    """parseBlockHeader:
+    Parses an IEEE 488.2 definite length block header (#NLLLL...)
+    INPUTS:
+    data (bytes): The start of the block, at least 2+N bytes long
+    RETURNS:
+    (offset, length) where offset is the index of the first data byte
+    and length is the number of data bytes
+    Throws exception if the header is invalid"""
+    if len(data)<2 or data[0:1]!=b'#':
+        raise ValueError('Invalid block header: missing #')
+    ndigits=int(data[1:2])#Number of length digits
+    if ndigits==0:
+        raise ValueError('Indefinite length blocks are not supported')
+    if len(data)<2+ndigits:
+        raise ValueError('Invalid block header: truncated length')
+    return (2+ndigits, int(data[2:2+ndigits]))
+
+def parseAsciiTrace(text):
+    """parseAsciiTrace:
+    Vectorized parse of a comma separated trace response
+    INPUTS:
+    text (str or bytes): The trace response, i.e. '1.603E-06,1.603001E-06,...'
+    RETURNS:
+    A numpy float64 array of the values"""
+    if isinstance(text, bytes):
+        text=text.decode('ascii')
+    return np.fromstring(text.strip(), dtype=np.float64, sep=',')#Parse in C instead of per point float()
+
+def decodeBinaryTrace(block, fmt='REAL64'):
+    """decodeBinaryTrace:
+    Decodes binary trace data into a numpy array
+    INPUTS:
+    block (bytes): The data bytes of the block (without header)
+    fmt (str, default 'REAL64'): 'REAL64' or 'REAL32'
+    RETURNS:
+    A numpy float64 array of the values"""
+    return np.frombuffer(block, dtype=traceFormatTypes[fmt]).astype(np.float64)
+
 def codeFromSensitivity(sensitivity):
     """codeFromSensitivity:
     Returns the code from a given sensitivity name using sequential search:
@@ -102,18 +176,75 @@ def codeFromSensitivity(sensitivity):
     print('Invalid Sensitivity Setting')
     return -1
 
+class AnalysisResult:
+    """class AnalysisResult:
+        Instrument analysis results of one sweep, see AQ6380Controls.analyze
+        Fields of analyses that were not requested are None:
+        peak: peakWavelength (nm), peakPower (dBm)
+        width: widthCenter (nm), width (nm) at the -3 dB threshold
+        power: power (dBm) total power
+        smsr: peakWavelength, peakPower, modeWavelength (nm), modePower (dBm) of the strongest side mode,
+              smsr (dB) side mode suppression ratio, modeOffset (nm) from the peak"""
+    def __init__(self, categories, values, sweep):
+        """initialize:
+        INPUTS:
+            categories (list of str): The analyses, keys of analysisCategories
+            values (dict): Field values
+            sweep (int): AQ6380Controls.sweepCount of the sweep analyzed
+            """
+        self.categories=list(categories)
+        self.sweep=sweep
+        for fields in analysisFields.values():
+            for (field, scale) in fields:
+                setattr(self, field, values.get(field))
+
+    def asDict(self):
+        """asDict: RETURNS: The fields of the requested analyses as a dict"""
+        return {field:getattr(self, field) for category in self.categories for (field, scale) in analysisFields[category]}
+
+    def __repr__(self):
+        return f'AnalysisResult(sweep={self.sweep}, {self.asDict()})'
+
+def parseAnalysis(response, categories):
+    """parseAnalysis:
+    Parses the reply to a compound analysis query
+    INPUTS:
+    response (str): The ';' separated :calc:data? replies
+    categories (list of str): The analyses in the order they were queried
+    RETURNS:
+    A dict of category to dict of field values
+    Throws exception if the reply does not match the categories"""
+    replies=response.strip().split(';')
+    if len(replies)!=len(categories):
+        raise ValueError(f'Analysis reply has {len(replies)} results for {len(categories)} categories')
+    results={}
+    for (category, reply) in zip(categories, replies):
+        fields=analysisFields[category]
+        values=[float(value) for value in reply.split(',') if value.strip()]
+        if len(values)<len(fields):
+            raise ValueError(f'Analysis reply for {category} of {reply} is invalid')
+        results[category]={field:value*scale for ((field, scale), value) in zip(fields, values)}
+    return results
+
 class AQ6380Controls:
     """class AQ6380Controls:
         A simple controls class for the AQ"""
-    def __init__(self, address=None, port='10001', username='anonymous', password='aaa'):
+    def __init__(self, address=None, port='10001', username='anonymous', password='aaa', traceFormat='REAL64',
+                 cacheXAxis=True, transport='pyvisa'):
         """initialize:
         INPUTS:
             address (str): The ip address of the OSA, default None
             port (str, default '10001'): The port of the OSA
             username (str, default 'anonymous'): The username for sign in
             password (str, default 'aaa'): The password for sign in
-            Throws exception if address is of an invalid format
+            traceFormat (str, default 'REAL64'): Trace transfer format, one of traceFormats
+            cacheXAxis (bool, default True): Compute the wavelength axis locally and reuse it
+                between sweeps instead of downloading it with every trace
+            transport (str, default 'pyvisa'): Connection backend, one of transports, see OSATransport
+            Throws exception if address, traceFormat or transport is of an invalid format
             """
+        if transport not in transports:
+            raise ValueError(f'Transport of {transport} is invalid, use one of {transports}')
         if address is not None:
             m = re.match(r'(\d+)\.(\d+)\.(\d+)\.(\d+)', address.strip())
             if not m:
@@ -121,12 +252,38 @@ class AQ6380Controls:
                 raise ValueError(f"IP address of {address} is invalid")
         self.address=address
         self.port=port
-        self.resourceManager=pyvisa.ResourceManager()
+        self.transport=transport
+        self.resourceManager=None#Created on first pyvisa open, see getResourceManager
         self.username=username
         self.password=password
         self.osa=None
         self.inSweep=False
         self.connected=False
+        self.traceFormat='ASCII'
+        self.instrumentFormat=None#Data format last written to the OSA, None if unknown
+        self.setTraceFormat(traceFormat)
+        self.cacheXAxis=cacheXAxis
+        self.xAxis=None#Cached wavelength axis in nm
+        self.xAxisValid=False#False when a setting that changes the axis was written
+        self.xAxisVerifyInterval=0#Verify cached axis against a full download every N uses, 0 to never verify
+        self.xAxisUses=0
+        self.completionMode='poll'#'poll' for status polling or 'opc' for blocking *OPC? wait
+        self.sweepTimeout=600#Hard sweep timeout in seconds
+        self.expectedSweepTime=None#Expected sweep duration in seconds, None to use last sweep duration
+        self.lastSweepDuration=None#Duration of last sweep with the same settings in seconds
+        self.minPollInterval=0.005#Shortest status poll interval in seconds
+        self.maxPollInterval=0.25#Longest status poll interval in seconds
+        self.pollBackoff=1.5#Poll interval multiplier after each incomplete poll
+        self.pollStartFraction=0.8#Fraction of expected sweep time to wait before first poll
+        self.cancelEvent=threading.Event()#Set by cancelSweep to stop a running sweep
+        self.lastSweepTiming={}#Timing of last singleSweep, see singleSweep
+        self.settings={}#Shadow copy of sweep settings written to the OSA, see configure
+        self.pipelineTrace='TRB'#Trace that holds the previous sweep in pipelined mode, TRB..TRG
+        self.lastPipelineTiming={}#Timing of last pipelined cycle, see pipelinedSweeps
+        self.instrumentation=None#Latency instrumentation, None when off, see enableInstrumentation
+        self.sweepCount=0#Sweeps started by this object; identifies cached analysis results
+        self.analysisCache={}#Analysis field values by category for the current sweep, see analyze
+        self.sweepModel=None#Learns sweep times from completed sweeps when set, see OSASweepModel
 
     def setAddress(self, address):
         """setAddress:
@@ -139,22 +296,63 @@ class AQ6380Controls:
             print('Wrong IP format.')
             raise ValueError(f"IP address of {address} is invalid")
         self.address=address
+    def getResourceManager(self):
+        """getResourceManager:
+        Gets the pyvisa ResourceManager, creating it on first use
+        RETURNS:
+        The pyvisa.ResourceManager"""
+        if self.resourceManager is None:
+            self.resourceManager=loadPyvisa().ResourceManager()
+        return self.resourceManager
     def open(self):
         """open: Opens/connects to the OSA
         Throws exception if connection fails or address is not set"""
-        #Connect to OSA via pyvisa resource manager
+        #Connect to OSA via the transport backend
         if self.address is None:
             raise ValueError('No IP address given')#
         
-        self.osa=self.resourceManager.open_resource(f'TCPIP::{self.address}::{self.port}::SOCKET', open_timeout=5000)
+        self.osa=createTransport(self.transport, self.getResourceManager)
+        self.osa.open(self.address, self.port, timeout=5000)
         self.connected=True
-        self.osa.read_termination = '\n'
-        self.osa.write_termination = '\n'
-        a = self.query("open \""+self.username+"\"")    # send username & get strings
-        print('OPENED: '+str(a))
-        a = self.query(self.password)    # send password & get "ready" strings
-        print(a)
-        
+        try:
+            a = self.query("open \""+self.username+"\"")    # send username & get strings
+            print('OPENED: '+str(a))
+            a = self.query(self.password)    # send password & get "ready" strings
+            print(a)
+        except Exception:#Sign in failed; do not report as connected
+            self.close()
+            raise
+        self.instrumentFormat=None#Format of new session is unknown
+        self.invalidateXAxis()
+        self.invalidateSettings()
+        self.invalidateAnalysis()
+
+    def enableInstrumentation(self, instrumentation=None):
+        """enableInstrumentation:
+        Starts recording command latencies, bytes, parse times and sweep durations
+        INPUTS:
+        instrumentation (OSAInstrumentation.Instrumentation, default None): Shared instrumentation,
+            None for a new one for this OSA
+        RETURNS:
+        The Instrumentation, see its snapshot, reset, report and addHook"""
+        if instrumentation is None:
+            instrumentation=Instrumentation(source=self.address)
+        self.instrumentation=instrumentation
+        return instrumentation
+    def disableInstrumentation(self):
+        """disableInstrumentation:
+        Stops recording; commands are no longer timed
+        RETURNS:
+        The Instrumentation that was in use, None if it was off"""
+        (instrumentation, self.instrumentation)=(self.instrumentation, None)
+        return instrumentation
+    def close(self):
+        """close: Closes the connection to the OSA"""
+        if self.osa is not None:
+            self.osa.close()
+        self.osa=None
+        self.connected=False
+
     def query(self, cmd):
         """query: Sends a SCPI query to the OSA
         INPUTS:
@@ -164,7 +362,17 @@ class AQ6380Controls:
         if not self.connected:#Check for connection status
             print('OSA Not Connected')
             return None
-        return self.osa.query(cmd)#Query command from OSA
+        instrumentation=self.instrumentation
+        if instrumentation is None:
+            return self.osa.query(cmd)#Query command from OSA
+        t0=time.perf_counter()
+        try:
+            response=self.osa.query(cmd)
+        except Exception:
+            instrumentation.recordCommand('query', cmd, time.perf_counter()-t0, len(cmd)+1, 0, error=True)
+            raise
+        instrumentation.recordCommand('query', cmd, time.perf_counter()-t0, len(cmd)+1, len(response)+1)
+        return response
     def write(self, cmd):
         """write: Sends a SCPI command to the OSA
         INPUTS:
@@ -174,7 +382,64 @@ class AQ6380Controls:
         if not self.connected:#Check for connection status
             print('OSA Not Connected')
             return None
-        return self.osa.write(cmd)#Write command to OSA
+        instrumentation=self.instrumentation
+        if instrumentation is None:
+            return self.osa.write(cmd)#Write command to OSA
+        t0=time.perf_counter()
+        try:
+            count=self.osa.write(cmd)
+        except Exception:
+            instrumentation.recordCommand('write', cmd, time.perf_counter()-t0, error=True)
+            raise
+        instrumentation.recordCommand('write', cmd, time.perf_counter()-t0, count)
+        return count
+    def queryBinary(self, cmd):
+        """queryBinary: Sends a SCPI query that returns an IEEE 488.2 block
+        INPUTS:
+        cmd (str): The command to send
+        RETURNS:
+        The data bytes of the block, or the raw response (str) if the OSA answered in ascii
+        None if not connected"""
+        if not self.connected:#Check for connection status
+            print('OSA Not Connected')
+            return None
+        t0=time.perf_counter()
+        try:
+            (data, received)=self.osa.queryBlock(cmd)
+        except Exception:
+            if self.instrumentation is not None:
+                self.instrumentation.recordCommand('binary', cmd, time.perf_counter()-t0, len(cmd)+1, 0, error=True)
+            raise
+        if self.instrumentation is not None:
+            self.instrumentation.recordCommand('binary', cmd, time.perf_counter()-t0, len(cmd)+1, received)
+        return data
+    def queryBlocks(self, cmds, count=None):
+        """queryBlocks: Sends several SCPI queries that return IEEE 488.2 blocks as one compound query,
+        so they cost one round trip instead of one each
+        INPUTS:
+        cmds (list of str): The queries to send, one reply each; commands without a reply may be appended with ';'
+        count (int, default None): The number of replies, None for one per command
+        RETURNS:
+        A list with the data bytes of each block, or the raw responses (str) if the OSA answered in ascii
+        None if not connected
+        Throws exception if the number of replies does not match"""
+        if not self.connected:#Check for connection status
+            print('OSA Not Connected')
+            return None
+        cmd=';'.join(cmds)
+        count=len(cmds) if count is None else count
+        t0=time.perf_counter()
+        try:
+            (replies, received)=self.osa.queryBlocks(cmd, count)
+        except Exception:
+            if self.instrumentation is not None:
+                self.instrumentation.recordCommand('binary', cmd, time.perf_counter()-t0, len(cmd)+1, 0, error=True)
+            raise
+        if self.instrumentation is not None:
+            self.instrumentation.recordCommand('binary', cmd, time.perf_counter()-t0, len(cmd)+1, received)
+        if len(replies)!=count:
+            raise ValueError(f'Expected {count} replies, got {len(replies)}')
+        return replies
     def sendSCPI(self, cmd):
         """sendScpi: Sends a SCPI command to the OSA
         Sends a query command if the command contains '?'
@@ -184,35 +449,143 @@ class AQ6380Controls:
         RETURNS:
         The result of the command if query command
         The length of the command if write command"""
+        headers=[part.split(None, 1)[0] for part in cmd.split(';') if part.strip()]
+        if any(not header.endswith('?') for header in headers):#Raw command may change the sweep settings
+            self.invalidateXAxis()
+            self.invalidateSettings()
+            self.invalidateAnalysis()
         if '?' in cmd:#Query command format
             return self.query(cmd)
         else:#Write command format
             return self.write(cmd)
+    def invalidateSettings(self):
+        """invalidateSettings:
+        Forgets the shadow copy of the OSA settings so the next set* call is always sent"""
+        self.settings={}
+    def resyncSettings(self):
+        """resyncSettings:
+        Reads the sweep settings from the OSA into the shadow copy
+        RETURNS:
+        The shadow copy (dict)"""
+        self.invalidateSettings()
+        self.settings['center']=round(float(self.query(':sens:wav:cent?'))*1e9, 6)#Round off conversion from m
+        self.settings['span']=round(float(self.query(':sens:wav:span?'))*1e9, 6)
+        self.settings['sensitivity']=sensitivityFromCode(self.getSensitivity())
+        self.settings['speed']=sweepSpeeds[int(self.getSweepSpeed())]
+        self.settings['resolution']=round(self.getResolution(), 6)
+        return self.settings
+    def settingCommand(self, name, value):
+        """settingCommand:
+        Builds the command for one sweep setting unless the shadow copy shows it is already set
+        Caches that depend on the setting are invalidated; the shadow copy is only updated
+        with the normalized value once the command was sent (see writeSetting, configure)
+        INPUTS:
+        name (str): 'center', 'span', 'sensitivity', 'speed' or 'resolution'
+        value (str, int or float): The value as accepted by the matching set function
+        RETURNS:
+        (command, normalized value); the command is None if the OSA already has this value"""
+        if name in ('center', 'span', 'resolution'):#Values in nm
+            try:
+                normalized=float(value)
+            except ValueError:
+                normalized=str(value)
+        elif name=='sensitivity':
+            try:#Try to parse sensitivity as integer
+                normalized=sensitivityFromCode(int(value))
+            except Exception as e:#If not, try raw sensitivity name
+                normalized=str(value).upper()
+        elif name=='speed':
+            try:#Check if speed is int
+                normalized=sweepSpeeds[int(value)]
+            except Exception as e:#Otherwise, try raw sweep speed name
+                normalized=str(value).lower().replace('x2', '2x').replace('x1', '1x')
+        else:
+            raise ValueError(f'Setting {name} is invalid')
+        if name in self.settings and self.settings[name]==normalized:#Nothing changed
+            return (None, normalized)
+        if name!='center':
+            self.lastSweepDuration=None#Sweep time depends on span, sensitivity, speed and resolution
+        if name in ('center', 'span', 'resolution'):
+            self.invalidateXAxis()#Sampling points may follow resolution
+        if name=='center':
+            return (f':sens:wav:cent {value}nm', normalized)
+        elif name=='span':
+            return (f':sens:wav:span {value}nm', normalized)
+        elif name=='sensitivity':
+            return (f':sens:sens {normalized}', normalized)
+        elif name=='speed':
+            return (f':sens:swe:spe {normalized}', normalized)
+        return (f':sens:band {value}nm', normalized)
+    def writeSetting(self, name, value):
+        """writeSetting:
+        Writes one sweep setting to the OSA unless it is already set
+        INPUTS:
+        name (str): 'center', 'span', 'sensitivity', 'speed' or 'resolution'
+        value (str, int or float): The value
+        RETURNS:
+        The return of the osa write command, 0 if nothing was sent"""
+        (cmd, normalized)=self.settingCommand(name, value)
+        if cmd is None:
+            return 0
+        sent=self.write(cmd)#Shadow copy is left as it was if this raises
+        if self.connected:
+            self.settings[name]=normalized
+        return sent
+    def configure(self, center=None, span=None, sensitivity=None, speed=None, resolution=None):
+        """configure:
+        Sets several sweep settings with one command.
+        Only settings that differ from the shadow copy are sent, joined with semicolons
+        INPUTS:
+        center (str or float, default None): The center wavelength in nm
+        span (str or float, default None): The span in nm
+        sensitivity (str or int, default None): The sensitivity name or code
+        speed (str or int, default None): '1x', '2x', 0 or 1
+        resolution (str, default None): The resolution in nm, one of resolutions
+        Settings that are None are left unchanged
+        RETURNS:
+        The return of the osa write command, 0 if nothing was sent
+        Throws exception if resolution is invalid"""
+        if resolution is not None:
+            checkResolution(resolution)
+        values={'speed':speed, 'sensitivity':sensitivity, 'center':center, 'span':span, 'resolution':resolution}
+        cmds=[]
+        changed={}
+        for (name, value) in values.items():
+            if value is not None:
+                (cmd, normalized)=self.settingCommand(name, value)
+                if cmd is not None:
+                    cmds.append(cmd)
+                    changed[name]=normalized
+        if len(cmds)==0:
+            return 0
+        sent=self.write(';'.join(cmds))#Shadow copy is left as it was if this raises
+        if self.connected:
+            self.settings.update(changed)
+        return sent
     def setCenter(self, center):
         """setCenter: Sets the center point of the OSA sweep
+        Not sent if the OSA already has this center (see configure)
         INPUTS: 
         center (str or int): The center wavelength in nm
         RETURNS:
         The return of the osa write command (number of bytes sent)"""
-        return self.write(f':sens:wav:cent {center}nm')#Set center value
+        return self.writeSetting('center', center)#Set center value
     def setSpan(self, span):
         """setSpan: Sets the span of the OSA sweep
+        Not sent if the OSA already has this span (see configure)
         INPUTS: 
         span (str or int): The span in nm
         RETURNS:
         The return of the osa write command (number of bytes sent)"""
-        self.write(f':sens:wav:span {span}nm')#Set span value
+        return self.writeSetting('span', span)#Set span value
     def setSensitivity(self, sens):
         """setSensitivity: Sets the sensitivity of the OSA
+        Not sent if the OSA already has this sensitivity (see configure)
         INPUTS:
         sens (str or int): The sensitivity to set
         RETURNS:
         The result of the osa write command"""
-        try:#Try to parse sensitivity as integer
-            sensint=int(sens)
-            return self.write(f':sens:sens {sensitivityFromCode(sensint)}')
-        except Exception as e:#If not, try raw sensitivity name
-            return self.write(f':sens:sens {sens}')
+        return self.writeSetting('sensitivity', sens)
     def getSensitivity(self):
         """getSensitivity: Gets the current sensitivity of the OSA
         RETURNS:
@@ -222,35 +595,27 @@ class AQ6380Controls:
     def setSweepSpeed(self, speed):
         """setSweepSpeed:
         Sets the sweep speed of the OSA
+        Not sent if the OSA already has this speed (see configure)
         INPUTS:
         speed (int or string): The sweep speed to set
                 Valid values are "1x" "2x" 0 and 1
         RETURNS:
         The return of the write command"""
-        try:#Check if speed is int
-            speedint=int(speed)
-            if speedint==0:#Parse and assign sweep speed
-                sweepspeed='1x'
-            elif speedint==1:
-                sweepspeed='2x'
-        except Exception as e:#Otherwise, try raw sweep speed name
-            sweepspeed=speed
-        finally:
-            return self.write(f':sens:swe:spe {sweepspeed}')#Write the sweep speed to the OSA
+        return self.writeSetting('speed', speed)#Write the sweep speed to the OSA
     def getSweepSpeed(self):
         """getSweepSpeed: Gets the current sweep speed:
         Returns 0 for 1x, 1 for 2x"""
         return self.query(f':sens:swe:spe?')#Get and return sweep speed from OSA
     def setResolution(self, resolution):
         """setResolution: Sets the Resolution of the OSA in nm
+        Not sent if the OSA already has this resolution (see configure)
         INPUTS:
-        resolution (float or str): The resolution in nm
+        resolution (float or str): The resolution in nm, one of resolutions
         OUTPUTS:
-        The return of the write command"""
-        if resolution not in resolutions:#Invalid resolution
-            print(f'Resolution of {resolution} invalid')
-            return None
-        return self.write(f':sens:band {resolution}nm')#Set resolution on OSA
+        The return of the write command
+        Throws exception if resolution is invalid"""
+        checkResolution(resolution)
+        return self.writeSetting('resolution', resolution)#Set resolution on OSA
     def getResolution(self):
         """getResolution: Gets the current resolution
         RETURNS:
@@ -258,47 +623,263 @@ class AQ6380Controls:
         resstr=self.query(':sens:band?')#Get resolution in meters
         return float(resstr)*1e9#Return resolution in nm
     
-    def singleSweep(self, center=None, span=None):
+    def abortSweep(self):
+        """abortSweep:
+        Stops the current sweep on the OSA
+        RETURNS:
+        The result of the write command"""
+        return self.write(':abor')
+    def cancelSweep(self):
+        """cancelSweep:
+        Requests cancellation of a sweep being waited on from another thread.
+        In 'poll' mode the sweep is aborted before the next poll.
+        In 'opc' mode the blocking *OPC? wait can only end by completion or timeout.
+        A request made before the sweep starts cancels it when it starts;
+        clearCancel drops a request that is no longer wanted"""
+        self.cancelEvent.set()
+    def clearCancel(self):
+        """clearCancel: Drops a pending cancelSweep request, i.e. before starting a new job"""
+        self.cancelEvent.clear()
+    def checkCancel(self):
+        """checkCancel:
+        Consumes a pending cancelSweep request
+        Throws InterruptedError if one was pending"""
+        if self.cancelEvent.is_set():
+            self.cancelEvent.clear()
+            raise InterruptedError('Sweep cancelled')
+    def waitForSweep(self, timeout=None, mode=None, expected=None):
+        """waitForSweep:
+        Waits for a sweep started with :init to complete
+        INPUTS:
+        timeout (float, default self.sweepTimeout): Hard timeout in seconds
+        mode (str, default self.completionMode): 'poll' polls :stat:oper:even? with
+            adaptive backoff, 'opc' blocks on a single *OPC? query
+        expected (float, default None): Expected sweep duration in seconds.
+            If None, self.expectedSweepTime, the last sweep duration or the sweepModel prediction is used.
+            Polling starts at pollStartFraction of the expected duration.
+        RETURNS:
+        A dict with 'poll' (seconds spent in status queries) and 'polls' (number of queries)
+        Throws TimeoutError if the sweep does not complete within timeout and
+        InterruptedError if cancelSweep was called. The sweep is aborted in both cases."""
+        if timeout is None:
+            timeout=self.sweepTimeout
+        if mode is None:
+            mode=self.completionMode
+        if mode not in completionModes:
+            raise ValueError(f'Completion mode of {mode} is invalid')
+        if expected is None:
+            expected=self.expectedSweepTime if self.expectedSweepTime is not None else self.lastSweepDuration
+            if expected is None and self.sweepModel is not None:#New settings; time the first poll from the model
+                expected=self.sweepModel.predict(self.settings)
+        stats={'poll':0.0, 'polls':0}
+        deadline=time.perf_counter()+timeout
+        if mode=='opc':#Block until operation complete
+            oldtimeout=self.osa.timeout
+            self.osa.timeout=timeout*1000#Transport timeout in ms
+            try:
+                t0=time.perf_counter()
+                self.query('*OPC?')
+                stats['poll']+=time.perf_counter()-t0
+                stats['polls']+=1
+            except self.osa.timeoutErrors as e:
+                self.abortSweep()
+                raise TimeoutError(f'Sweep did not complete within {timeout} s: {e}')
+            finally:
+                self.osa.timeout=oldtimeout
+            return stats
+        #Poll with adaptive backoff
+        if expected:
+            wait=expected*self.pollStartFraction#Sleep through most of the sweep
+            interval=max(self.minPollInterval, expected*0.02)
+        else:
+            wait=0
+            interval=self.minPollInterval
+        while True:
+            wait=min(wait, max(deadline-time.perf_counter(), 0))
+            if self.cancelEvent.wait(wait):#Returns True if cancelled while waiting
+                self.cancelEvent.clear()#Request is consumed by this sweep
+                self.abortSweep()
+                raise InterruptedError('Sweep cancelled')
+            t0=time.perf_counter()
+            queryval=self.query(':stat:oper:even?')#Is sweep complete?
+            now=time.perf_counter()
+            stats['poll']+=now-t0
+            stats['polls']+=1
+            if queryval.strip()[-1]=='1':#Sweep is complete
+                return stats
+            if now>=deadline:
+                self.abortSweep()
+                raise TimeoutError(f'Sweep did not complete within {timeout} s')
+            wait=interval
+            interval=min(interval*self.pollBackoff, self.maxPollInterval)
+    def singleSweep(self, center=None, span=None, timeout=None):
         """singleSweep: Performs a single sweep of the OSA
+        Timing of the sweep is stored in self.lastSweepTiming as a dict with
+        'configure' (seconds setting up), 'sweep' (seconds from :init to completion),
+        'poll' (seconds spent in completion queries), 'polls' (number of completion queries)
+        and 'total' (seconds)
         INPUTS:
         center (str): The center in nm
         span (str): The span in nm
+        timeout (float, default self.sweepTimeout): Hard timeout in seconds
         RETURNS:
-        True if sweep is a success, False if exception is thrown
+        True if sweep is a success, False if exception is thrown, times out or is cancelled
         """
+        t0=time.perf_counter()
         if center is not None:
             self.setCenter(center)
         if span is not None:
             self.setSpan(span)
-        self.write(':init:smode 1')#Single Sweep Mode
-        self.write("*CLS")
-        self.write(':init')#Start sweep
-        #wait until sweep complete
-        completeFlag=False
+        t1=time.perf_counter()
+        self.inSweep=True
+        self.invalidateAnalysis(newSweep=True)
         try:
-            while not completeFlag:
-                queryval = self.query(":stat:oper:even?")#Is sweep complete>
-                if queryval.strip()[-1] == "1":#Sweep is complete
-                    completeFlag=True
+            self.checkCancel()#Cancelled before it started
+            self.write(':init:smode 1;*CLS;:init')#Single Sweep Mode, clear status and start sweep in one message
+            stats=self.waitForSweep(timeout)#wait until sweep complete
         except Exception as e:
             print(f'Error: {e}')#Print exception
+            if self.instrumentation is not None:
+                self.instrumentation.record('sweep', str(self.settings.get('sensitivity', 'unknown')),
+                                            time.perf_counter()-t1, error=True)
             return False
         else:
+            t2=time.perf_counter()
+            self.lastSweepDuration=t2-t1
+            if self.sweepModel is not None:
+                self.sweepModel.observe(self.settings, t2-t1)
+            self.lastSweepTiming={'configure':t1-t0, 'sweep':t2-t1, 'poll':stats['poll'],
+                                  'polls':stats['polls'], 'total':t2-t0}
+            if self.instrumentation is not None:
+                self.instrumentation.record('sweep', str(self.settings.get('sensitivity', 'unknown')), t2-t1,
+                                            polls=stats['polls'], poll=stats['poll'])
             return True
-        
+        finally:
+            self.inSweep=False
+
+    def pipelinedSweeps(self, count=None, timeout=None):
+        """pipelinedSweeps:
+        Sweeps repeatedly and downloads each trace while the next sweep runs.
+        After a sweep, TRA is copied to self.pipelineTrace, the next sweep is started
+        and the copy is downloaded during that sweep. The trace is fixed while the generator
+        runs and gets its previous attribute back when it ends, is closed or fails; it still
+        holds the last copied sweep afterwards.
+        Timing of each cycle is stored in self.lastPipelineTiming as a dict with
+        'sweep' (seconds per sweep), 'download' (seconds downloading the copy),
+        'wait' (seconds waiting for the sweep after the download), 'cycle' (seconds from
+        starting the sweep to its completion) and 'hidden' (seconds of download that overlapped the sweep)
+        INPUTS:
+        count (int, default None): Number of traces, None to sweep until the generator is closed;
+            below 1 nothing is swept
+        timeout (float, default self.sweepTimeout): Hard timeout per sweep in seconds
+        RETURNS:
+        A generator of (xvals, yvals) traces, see getTraceVals
+        Throws TimeoutError or InterruptedError from waitForSweep"""
+        if count is not None and count<1:#Nothing to sweep
+            return
+        trace=self.pipelineTrace
+        self.checkCancel()#Cancelled before it started
+        previous=self.query(f':trac:attr:{trace}?').strip().upper()
+        if previous.isdigit():#Attribute reported by number
+            previous=traceAttributes[int(previous)]
+        self.write(f':trac:attr:{trace} fix')#Copy must not be overwritten by the running sweep
+        try:
+            tstart=time.perf_counter()
+            self.invalidateAnalysis(newSweep=True)
+            self.inSweep=True
+            try:
+                self.write(':init:smode 1;*CLS;:init')#First sweep
+                self.waitForSweep(timeout)
+            finally:
+                self.inSweep=False
+            sweepref=time.perf_counter()-tstart#Sweep duration without a download running
+            self.lastSweepDuration=sweepref
+            if self.sweepModel is not None:
+                self.sweepModel.observe(self.settings, sweepref)
+            done=0
+            while count is None or done<count-1:
+                t0=time.perf_counter()
+                self.invalidateAnalysis(newSweep=True)
+                self.write(f':trac:copy TRA,{trace};*CLS;:init')#Keep finished sweep, start the next one
+                self.inSweep=True
+                try:
+                    (xvals, yvals)=self.getTraceVals(trace)#Download while the OSA sweeps
+                    t1=time.perf_counter()
+                    stats=self.waitForSweep(timeout, expected=max(sweepref-(t1-t0), 0))#Remaining sweep time
+                finally:
+                    self.inSweep=False
+                t2=time.perf_counter()
+                download=t1-t0
+                if stats['polls']>1:#Sweep outlasted the download, so t2-t0 is the sweep duration
+                    sweepref=t2-t0
+                    self.lastSweepDuration=sweepref
+                self.lastPipelineTiming={'sweep':sweepref, 'download':download, 'wait':t2-t1, 'cycle':t2-t0,
+                                         'hidden':min(download, sweepref)}
+                if self.instrumentation is not None:
+                    self.instrumentation.record('sweep', 'pipelined', t2-t0, polls=stats['polls'], download=download)
+                done+=1
+                yield (xvals, yvals)
+            t0=time.perf_counter()
+            (xvals, yvals)=self.getTraceVals()#Last trace; nothing left to overlap
+            t1=time.perf_counter()
+            self.lastPipelineTiming={'sweep':sweepref, 'download':t1-t0, 'wait':0.0, 'cycle':t1-t0, 'hidden':0.0}
+            yield (xvals, yvals)
+        finally:#Give the trace back to the user as it was
+            try:
+                self.write(f':trac:attr:{trace} {previous}')
+            except Exception as e:
+                print(f'Error restoring {trace}: {e}')
+
+    def invalidateAnalysis(self, newSweep=False):
+        """invalidateAnalysis:
+        Forgets cached analysis results so the next analyze call queries the OSA
+        INPUTS:
+        newSweep (bool, default False): A sweep is being started; counts it in sweepCount"""
+        self.analysisCache={}
+        if newSweep:
+            self.sweepCount+=1
+
+    def analyze(self, categories=('peak',)):
+        """analyze:
+        Runs instrument analyses of the previous sweep in one compound query
+        (:calc:cat <x>;:calc;:calc:data? for each analysis in one message).
+        Results are cached until the next sweep, so repeated calls and other analyses
+        of the same sweep only query what has not been fetched yet.
+        INPUTS:
+        categories (list of str, default ('peak',)): Keys of analysisCategories: 'peak', 'width', 'power', 'smsr'
+        RETURNS:
+        An AnalysisResult, None if not connected
+        Throws exception if a category is invalid or the reply cannot be parsed"""
+        for category in categories:
+            if category not in analysisCategories:
+                raise ValueError(f'Analysis category of {category} is invalid, use one of {list(analysisCategories)}')
+        missing=[category for category in dict.fromkeys(categories) if category not in self.analysisCache]
+        if missing:
+            sweep=self.sweepCount
+            response=self.query(';'.join([f':calc:cat {analysisCategories[category]};:calc;:calc:data?' for category in missing]))
+            if response is None:
+                return None
+            results=parseAnalysis(response, missing)
+            if self.sweepCount==sweep:#Do not cache results of a sweep started meanwhile
+                self.analysisCache.update(results)
+        else:
+            results={}
+        values={}
+        for category in categories:
+            values.update(results.get(category, self.analysisCache.get(category, {})))
+        return AnalysisResult(categories, values, self.sweepCount)
+
     def getPeakWavelength(self):
         """getPeakWavelength: Returns peak wavelength from previous sweep:
         RETURNS:
         The peak wavelength in nm (float)"""
-        queryval= self.query(":calc:cat filp; :calc; :calc:data?")#Get peak data
-        return float(queryval.split(',')[0].strip())*1e9#Return wavelength in nm
+        return self.analyze(['peak']).peakWavelength#Cached with the peak power
 
     def getPeakPower(self):
         """getPeakPower: Returns peak power from previous sweep
         RETURNS:
         The peak power in dBm (float)"""
-        queryval= self.query(":calc:cat filp; :calc; :calc:data?")#Get peak data
-        return float(queryval.split(',')[1].strip())#Return peak power
+        return self.analyze(['peak']).peakPower
     def activateTrace(self, tracename):
         """activateTrace:
         Activates trace with name tracename
@@ -309,6 +890,7 @@ class AQ6380Controls:
         traceformatstr=':trac:act'
         if len(tracename)>0:
             traceformatstr +=' '+tracename
+        self.invalidateAnalysis()#Analyses run on the active trace
         return self.write(traceformatstr)#Set active trace
     def getActiveTrace(self):
         """getActiveTrace:
@@ -316,17 +898,211 @@ class AQ6380Controls:
         RETURNS:
         The name of the active trace"""
         return self.query(':trac:act?')
-    def getTraceVals(self):
+    def setTraceFormat(self, fmt):
+        """setTraceFormat:
+        Sets the format used to transfer trace data
+        INPUTS:
+        fmt (str): 'ASCII', 'REAL64' or 'REAL32'
+        Throws exception if fmt is invalid"""
+        fmt=fmt.upper()
+        if fmt not in traceFormats:
+            print(f'Trace format of {fmt} invalid')
+            raise ValueError(f'Trace format of {fmt} is invalid')
+        self.traceFormat=fmt
+    def dataFormatCommand(self, fmt):
+        """dataFormatCommand:
+        Gets the command that selects a data format on the OSA
+        The format is recorded as selected, so the command must be sent
+        INPUTS:
+        fmt (str): 'ASCII', 'REAL64' or 'REAL32'
+        RETURNS:
+        The command string, or None if the format is already selected"""
+        if self.instrumentFormat==fmt:
+            return None
+        self.instrumentFormat=fmt
+        return traceFormatCommands[fmt]
+    def getTraceData(self, axis, trace='TRA', restore=True):
+        """getTraceData:
+        Gets one axis of a trace from the OSA in the selected trace format
+        Falls back to ascii parsing if the OSA does not answer with a binary block
+        The format commands are sent in the same message as the query
+        INPUTS:
+        axis (str): 'x' or 'y'
+        trace (str, default 'TRA'): The trace name
+        restore (bool, default True): Switch the OSA back to ascii format afterwards
+        RETURNS:
+        The values as a numpy float64 array, x in meters and y in dBm"""
+        fmt=self.traceFormat
+        cmds=[self.dataFormatCommand(fmt), f':trac:{axis}? {trace}']
+        if restore and fmt!='ASCII':
+            cmds.append(self.dataFormatCommand('ASCII'))#Other queries expect ascii responses
+        cmd=';'.join([c for c in cmds if c is not None])
+        if fmt=='ASCII':
+            data=self.query(cmd)
+        else:
+            try:
+                data=self.queryBinary(cmd)
+            except Exception:
+                self.instrumentFormat=None#Unknown after a failed transfer
+                raise
+        return self.decodeTraceData(data, fmt)
+    def decodeTraceData(self, data, fmt):
+        """decodeTraceData:
+        Decodes a trace query response
+        INPUTS:
+        data (bytes or str): The block data, or the ascii response
+        fmt (str): The trace format the data was requested in
+        RETURNS:
+        The values as a numpy float64 array"""
+        t0=time.perf_counter()
+        if isinstance(data, str):#ASCII format, or OSA answered in ascii
+            values=parseAsciiTrace(data)
+        else:
+            values=decodeBinaryTrace(data, fmt)
+        if self.instrumentation is not None:
+            self.instrumentation.record('parse', 'ASCII' if isinstance(data, str) else fmt, time.perf_counter()-t0,
+                                        bytesIn=len(data), points=len(values))
+        return values
+    def invalidateXAxis(self):
+        """invalidateXAxis:
+        Marks the cached wavelength axis as stale so it is rebuilt on next use"""
+        self.xAxisValid=False
+    def computeXAxis(self, trace='TRA'):
+        """computeXAxis:
+        Rebuilds the wavelength axis from the start and stop wavelength
+        and the number of samples instead of downloading it
+        INPUTS:
+        trace (str, default 'TRA'): The trace name
+        RETURNS:
+        The wavelength axis in nm as a numpy array"""
+        start=float(self.query(':sens:wav:star?'))#Start wavelength in m
+        stop=float(self.query(':sens:wav:stop?'))#Stop wavelength in m
+        npoints=int(float(self.query(f':trac:snum? {trace}')))#Number of samples in trace
+        return np.round(np.linspace(start, stop, npoints)*1e9, 4)
+    def verifyXAxis(self, trace='TRA'):
+        """verifyXAxis:
+        Downloads the full wavelength axis and compares it with the cached axis.
+        The cache is replaced with the downloaded axis.
+        INPUTS:
+        trace (str, default 'TRA'): The trace name
+        RETURNS:
+        True if the cached axis matched the downloaded axis, False otherwise"""
+        xvals=np.round(self.getTraceData('x', trace)*1e9, 4)
+        atol=1e-4#Axis is rounded to 4 decimals
+        if self.traceFormat=='REAL32' and len(xvals)>0:#Allow for single precision download
+            atol+=2*np.finfo(np.float32).eps*np.abs(xvals).max()
+        matched=(self.xAxis is not None and len(self.xAxis)==len(xvals)
+                 and np.allclose(self.xAxis, xvals, rtol=0, atol=atol))
+        if matched:#Keep computed axis; it does not have the download rounding
+            xvals=self.xAxis
+        else:
+            print('Cached wavelength axis does not match OSA; using downloaded axis')
+            xvals.flags.writeable=False#Shared between traces
+        self.xAxis=xvals
+        self.xAxisValid=True
+        self.xAxisUses=0
+        return matched
+    def getXAxis(self, trace='TRA'):
+        """getXAxis:
+        Gets the wavelength axis, reusing the cached axis if no setting changed
+        INPUTS:
+        trace (str, default 'TRA'): The trace name
+        RETURNS:
+        The wavelength axis in nm as a numpy array"""
+        if not self.cacheXAxis:#Caching disabled; download full axis
+            return np.round(self.getTraceData('x', trace)*1e9, 4)
+        if not self.xAxisValid or self.xAxis is None:
+            self.xAxis=self.computeXAxis(trace)
+            self.xAxis.flags.writeable=False#Shared between traces
+            self.xAxisValid=True
+            self.xAxisUses=0
+        self.xAxisUses+=1
+        if self.xAxisVerifyInterval>0 and self.xAxisUses>=self.xAxisVerifyInterval:#Periodic check
+            self.verifyXAxis(trace)
+        return self.xAxis
+    def getTraceVals(self, trace='TRA'):
         """getTraceVals:
-        Gets the trace data from the OSA in ascii format and converts it to floating point
+        Gets the trace data from the OSA in the selected trace format (see setTraceFormat)
+        The wavelength axis is taken from the cache (see getXAxis)
+        INPUTS:
+        trace (str, default 'TRA'): The trace name
         RETURNS
-        (xvals, yvals) where xvals is all wavelengths in nm
+        (xvals, yvals) as numpy arrays where xvals is all wavelengths in nm
         and yvals is the corresponding amplitudes in dBm"""
-        xstr=self.query(':trac:x? TRA')
-        ystr=self.query(':trac:y? TRA')
-        xsplit=xstr.split(',')#Split csv x axis
-        ysplit=ystr.split(',')#Split csv y axis
-        xvals=[round(float(x)*1e9, 4) for x in xsplit]
-        yvals=[float(y) for y in ysplit]
+        t0=time.perf_counter()
+        yvals=self.getTraceData('y', trace)
+        xvals=self.getXAxis(trace)
+        if len(xvals)!=len(yvals):#Cache out of date, i.e. settings changed on the front panel
+            self.invalidateXAxis()
+            xvals=self.getXAxis(trace)
+        if self.instrumentation is not None:
+            self.instrumentation.record('trace', trace, time.perf_counter()-t0, points=len(yvals))
+        return (xvals, yvals)
+    
+    def getTraces(self, traces=None):
+        """getTraces:
+        Gets several traces in the selected trace format with two round trips: one compound query
+        for the number of samples of every trace, then one for all the downloads together with the
+        first and last wavelength of each trace (:trac:x? TRA,1,1 and TRA,N,N)
+        Each trace's axis is rebuilt from its endpoints and number of samples like computeXAxis.
+        Traces with the axis of the first non-empty trace share it; the others, i.e. fixed traces
+        recorded at another center or span, are interpolated onto it, NaN outside their range.
+        The cached wavelength axis (see getXAxis) is reused when it matches and invalidated
+        when it does not, i.e. after settings changed on the front panel. Empty traces are all NaN.
+        INPUTS:
+        traces (list of str, default None): Trace names from traceNames, None for all traces
+        RETURNS:
+        (xvals, yvals) as numpy arrays where xvals is the shared wavelength axis in nm and yvals
+        has one row of amplitudes in dBm per trace, in the order of traces
+        None if not connected
+        Throws exception if a trace name is invalid"""
+        names=[t.upper() for t in (traceNames if traces is None else traces)]
+        for name in names:
+            if name not in traceNames:
+                raise ValueError(f'Trace of {name} is invalid, use one of {traceNames}')
+        if not self.connected:#Check for connection status
+            print('OSA Not Connected')
+            return None
+        t0=time.perf_counter()
+        counts=[int(float(c)) for c in self.query(';'.join(f':trac:snum? {name}' for name in names)).split(';')]
+        fetch=[(name, count) for (name, count) in zip(names, counts) if count>0]
+        if not fetch:#Nothing recorded; rows of the current axis
+            xvals=self.getXAxis()
+            return (xvals, np.full((len(names), len(xvals)), np.nan))
+        fmt=self.traceFormat
+        cmds=[]
+        for (name, count) in fetch:
+            cmds+=[f':trac:y? {name}', f':trac:x? {name},1,1', f':trac:x? {name},{count},{count}']
+        start=self.dataFormatCommand(fmt)
+        if start is not None:
+            cmds[0]=start+';'+cmds[0]
+        if fmt!='ASCII':#Other queries expect ascii responses
+            cmds[-1]=cmds[-1]+';'+self.dataFormatCommand('ASCII')
+        try:
+            replies=self.queryBlocks(cmds)
+        except Exception:
+            self.instrumentFormat=None#Unknown after a failed transfer
+            raise
+        values=[self.decodeTraceData(data, fmt) for data in replies]
+        axes={}#Trace name: (first nm, last nm, count)
+        for (idx, (name, count)) in enumerate(fetch):
+            axes[name]=(round(float(values[3*idx+1][0])*1e9, 4), round(float(values[3*idx+2][0])*1e9, 4), count)
+        (first, last, count)=axes[fetch[0][0]]
+        cached=self.xAxis if self.cacheXAxis and self.xAxisValid else None
+        if cached is not None and len(cached)==count and abs(cached[0]-first)<=1e-4 and abs(cached[-1]-last)<=1e-4:
+            xvals=cached
+        else:
+            if cached is not None and len(cached)==count:#Same sampling, other range; settings changed on the front panel
+                self.invalidateXAxis()
+            xvals=np.round(np.linspace(first, last, count), 4)
+        yvals=np.full((len(names), len(xvals)), np.nan)
+        for (idx, (name, count)) in enumerate(fetch):
+            trace=values[3*idx]
+            if axes[name]!=(first, last, len(xvals)):#Own sampling
+                trace=np.interp(xvals, np.round(np.linspace(axes[name][0], axes[name][1], count), 4), trace,
+                                left=np.nan, right=np.nan)
+            for row in [row for (row, other) in enumerate(names) if other==name]:
+                yvals[row]=trace
+        if self.instrumentation is not None:
+            self.instrumentation.record('trace', ','.join(names), time.perf_counter()-t0, points=yvals.size)
         return (xvals, yvals)
-    
\ No newline at end of file
@@ -0,0 +1,308 @@
+"""OSAAnalysis.py:
+Spectral analysis of OSA traces with numpy, without instrument round trips
+Works on traces from AQ6380Controls.getTraceVals and on saved CSV files such as test1.csv
+(wavelength in nm, amplitude in dBm)
+Provides multi-peak detection, -3/-20 dB spectral width, centroid, SMSR, OSNR and band power
+Depends on OSAExport library
+Depends on numpy
+To get dependencies,
+pip install numpy
+To run: python OSAAnalysis.py file.csv or py OSAAnalysis.py file.csv depending on system
+    Prints the analysis of each CSV file given; add "--resolution 0.02" (nm) before the files for total power
+"""
+import sys
+import numpy as np
+from OSAExport import loadTrace
+
+def dBmToMw(yvals):
+    """dBmToMw:
+    Converts dBm to linear power
+    INPUTS:
+    yvals (numpy array or float): Power in dBm
+    RETURNS:
+    Power in mW"""
+    return 10**(np.asarray(yvals, dtype=np.float64)/10)
+
+def mwToDbm(power):
+    """mwToDbm:
+    Converts linear power to dBm
+    INPUTS:
+    power (numpy array or float): Power in mW
+    RETURNS:
+    Power in dBm, -210 for zero power"""
+    power=np.asarray(power, dtype=np.float64)
+    return np.where(power>0, 10*np.log10(np.maximum(power, 1e-300)), -210.0)
+
+def loadTraceCsv(filename):
+    """loadTraceCsv:
+    Loads a two column wavelength (nm), amplitude (dBm) CSV file with vectorized parsing
+    INPUTS:
+    filename (str): The CSV file name
+    RETURNS:
+    (xvals, yvals) numpy arrays"""
+    return loadTrace(filename, 'csv')
+
+def noiseFloor(yvals, percentile=10):
+    """noiseFloor:
+    Estimates the noise floor of a trace as a low percentile of the amplitudes
+    INPUTS:
+    yvals (numpy array): Amplitudes in dBm
+    percentile (float, default 10): The percentile
+    RETURNS:
+    The noise floor in dBm"""
+    return float(np.percentile(yvals, percentile))
+
+def findPeaks(xvals, yvals, threshold=None, minSeparation=0.0, maxPeaks=None, margin=10.0):
+    """findPeaks:
+    Finds local maxima above a threshold, strongest first
+    Peaks closer than minSeparation to a stronger peak are dropped
+    INPUTS:
+    xvals (numpy array): Wavelengths in nm
+    yvals (numpy array): Amplitudes in dBm
+    threshold (float, default None): Minimum peak amplitude in dBm,
+        None for noise floor plus margin
+    minSeparation (float, default 0.0): Minimum distance between peaks in nm
+    maxPeaks (int, default None): Maximum number of peaks returned, None for all
+    margin (float, default 10.0): dB above the noise floor for the default threshold
+    RETURNS:
+    A numpy array of peak indices sorted by descending amplitude"""
+    yvals=np.asarray(yvals)
+    if len(yvals)<3:
+        return np.argmax(yvals, keepdims=True) if len(yvals) else np.zeros(0, dtype=int)
+    if threshold is None:
+        threshold=noiseFloor(yvals)+margin
+    middle=yvals[1:-1]
+    candidates=np.flatnonzero((middle>yvals[:-2])&(middle>=yvals[2:])&(middle>=threshold))+1
+    candidates=candidates[np.argsort(yvals[candidates])[::-1]]#Strongest first
+    if minSeparation<=0 or len(candidates)<2:
+        return candidates[:maxPeaks]
+    xvals=np.asarray(xvals)
+    kept=[]
+    for idx in candidates:#Candidates above threshold are few; keep ones clear of stronger peaks
+        if len(kept)==0 or np.min(np.abs(xvals[kept]-xvals[idx]))>=minSeparation:
+            kept.append(idx)
+            if maxPeaks is not None and len(kept)>=maxPeaks:
+                break
+    return np.array(kept, dtype=int)
+
+def crossing(xvals, yvals, idx1, idx2, level):
+    """crossing:
+    Linearly interpolates the wavelength where the trace crosses a level between two samples
+    INPUTS:
+    xvals, yvals (numpy array): The trace
+    idx1, idx2 (int): The sample indices on either side of the crossing
+    level (float): The level in dBm
+    RETURNS:
+    The crossing wavelength in nm"""
+    (y1, y2)=(yvals[idx1], yvals[idx2])
+    if y1==y2:
+        return float(xvals[idx1])
+    return float(xvals[idx1]+(level-y1)*(xvals[idx2]-xvals[idx1])/(y2-y1))
+
+def spectralWidth(xvals, yvals, peakIndex=None, level=3.0):
+    """spectralWidth:
+    Measures the width of a peak at a level below its amplitude
+    INPUTS:
+    xvals (numpy array): Wavelengths in nm
+    yvals (numpy array): Amplitudes in dBm
+    peakIndex (int, default None): Index of the peak, None for the highest sample
+    level (float, default 3.0): dB below peak, i.e. 3.0 or 20.0
+    RETURNS:
+    (width, left, right) in nm, where left and right are the interpolated crossings.
+    If the trace does not fall below the level on a side, the trace edge is used"""
+    yvals=np.asarray(yvals)
+    if peakIndex is None:
+        peakIndex=int(np.argmax(yvals))
+    threshold=yvals[peakIndex]-level
+    below=yvals<threshold
+    leftbelow=np.flatnonzero(below[:peakIndex])
+    rightbelow=np.flatnonzero(below[peakIndex+1:])
+    if len(leftbelow):
+        idx=leftbelow[-1]
+        left=crossing(xvals, yvals, idx, idx+1, threshold)
+    else:
+        left=float(xvals[0])
+    if len(rightbelow):
+        idx=rightbelow[0]+peakIndex+1
+        right=crossing(xvals, yvals, idx-1, idx, threshold)
+    else:
+        right=float(xvals[-1])
+    return (right-left, left, right)
+
+def centroid(xvals, yvals, level=None, peakIndex=None):
+    """centroid:
+    Power weighted mean wavelength
+    INPUTS:
+    xvals (numpy array): Wavelengths in nm
+    yvals (numpy array): Amplitudes in dBm
+    level (float, default None): Only use samples within level dB of the peak, None for all samples
+    peakIndex (int, default None): Index of the peak for level, None for the highest sample
+    RETURNS:
+    The centroid wavelength in nm"""
+    xvals=np.asarray(xvals)
+    power=dBmToMw(yvals)
+    if level is not None:
+        if peakIndex is None:
+            peakIndex=int(np.argmax(yvals))
+        power=np.where(np.asarray(yvals)>=yvals[peakIndex]-level, power, 0.0)
+    return float(np.sum(xvals*power)/np.sum(power))
+
+def bandPower(xvals, yvals, start=None, stop=None, resolution=None):
+    """bandPower:
+    Integrated power between two wavelengths
+    Each sample is the power in one resolution bandwidth, so sample powers are scaled by
+    sample step/resolution; without the resolution the sum would be off by that factor
+    INPUTS:
+    xvals (numpy array): Wavelengths in nm
+    yvals (numpy array): Amplitudes in dBm
+    start, stop (float, default None): Band edges in nm, None for the trace edges
+    resolution (float): Resolution bandwidth in nm the trace was measured with
+    RETURNS:
+    The band power in dBm
+    Throws exception if resolution is not given"""
+    if resolution is None or not resolution>0:
+        raise ValueError('Band power needs the resolution bandwidth of the trace')
+    xvals=np.asarray(xvals)
+    mask=np.ones(len(xvals), dtype=bool)
+    if start is not None:
+        mask&=xvals>=start
+    if stop is not None:
+        mask&=xvals<=stop
+    power=np.sum(dBmToMw(np.asarray(yvals)[mask]))
+    if len(xvals)>1:
+        power*=(xvals[-1]-xvals[0])/(len(xvals)-1)/resolution
+    return float(mwToDbm(power))
+
+def smsr(xvals, yvals, minSeparation=0.0, peakIndex=None, threshold=None, level=20.0):
+    """smsr:
+    Side mode suppression ratio: main peak amplitude minus the strongest other peak found by
+    findPeaks outside the main peak's -level dB width, so ripple on the skirt of a wide or
+    noisy peak is not taken for a side mode
+    INPUTS:
+    xvals (numpy array): Wavelengths in nm
+    yvals (numpy array): Amplitudes in dBm
+    minSeparation (float, default 0.0): Side modes must be further than this from the main peak in nm
+    peakIndex (int, default None): Index of the main peak, None for the highest sample
+    threshold (float, default None): Minimum side mode amplitude in dBm, None for the findPeaks default
+        (noise floor plus 10 dB)
+    level (float, default 20.0): dB below the main peak for the width that side modes must be outside of
+    RETURNS:
+    (smsr in dB, side mode wavelength in nm, side mode amplitude in dBm),
+    (None, None, None) if there is no side mode"""
+    xvals=np.asarray(xvals)
+    yvals=np.asarray(yvals)
+    if peakIndex is None:
+        peakIndex=int(np.argmax(yvals))
+    (width, left, right)=spectralWidth(xvals, yvals, peakIndex, level)
+    candidates=findPeaks(xvals, yvals, threshold, minSeparation)
+    candidates=candidates[(candidates!=peakIndex)&((xvals[candidates]<left)|(xvals[candidates]>right))
+                          &(np.abs(xvals[candidates]-xvals[peakIndex])>minSeparation)]
+    if len(candidates)==0:
+        return (None, None, None)
+    side=candidates[0]#Strongest first
+    return (float(yvals[peakIndex]-yvals[side]), float(xvals[side]), float(yvals[side]))
+
+def osnr(xvals, yvals, peakIndex=None, offset=0.4, window=0.1, resolution=None, referenceBandwidth=0.1):
+    """osnr:
+    Optical signal to noise ratio with the noise interpolated from windows on both sides of the peak
+    INPUTS:
+    xvals (numpy array): Wavelengths in nm
+    yvals (numpy array): Amplitudes in dBm
+    peakIndex (int, default None): Index of the signal peak, None for the highest sample
+    offset (float, default 0.4): Distance from the peak to the center of each noise window in nm
+    window (float, default 0.1): Width of each noise window in nm
+    resolution (float, default None): Resolution bandwidth in nm; if given the OSNR is
+        normalized to referenceBandwidth
+    referenceBandwidth (float, default 0.1): Reference noise bandwidth in nm
+    RETURNS:
+    (osnr in dB, noise level in dBm), (None, None) if a noise window has no samples"""
+    xvals=np.asarray(xvals)
+    yvals=np.asarray(yvals)
+    if peakIndex is None:
+        peakIndex=int(np.argmax(yvals))
+    peakx=xvals[peakIndex]
+    levels=[]
+    for side in (-1, 1):
+        mask=np.abs(xvals-(peakx+side*offset))<=window/2
+        if not np.any(mask):
+            return (None, None)
+        levels.append(np.mean(dBmToMw(yvals[mask])))
+    noise=(levels[0]+levels[1])/2#Linear interpolation at the peak
+    signal=dBmToMw(yvals[peakIndex])-noise
+    if signal<=0:
+        return (float('-inf'), float(mwToDbm(noise)))
+    ratio=10*np.log10(signal/noise)
+    if resolution is not None:
+        ratio+=10*np.log10(resolution/referenceBandwidth)
+    return (float(ratio), float(mwToDbm(noise)))
+
+def analyzeTrace(xvals, yvals, threshold=None, minSeparation=0.1, maxPeaks=None, widthLevels=(3.0, 20.0),
+                 noiseOffset=0.4, noiseWindow=0.1, resolution=None):
+    """analyzeTrace:
+    Runs all analyses on a trace
+    INPUTS:
+    xvals (numpy array or list): Wavelengths in nm
+    yvals (numpy array or list): Amplitudes in dBm
+    threshold (float, default None): Minimum peak amplitude in dBm, see findPeaks
+    minSeparation (float, default 0.1): Minimum distance between peaks and to side modes in nm
+    maxPeaks (int, default None): Maximum number of peaks, None for all
+    widthLevels (tuple, default (3.0, 20.0)): dB levels for spectral width
+    noiseOffset, noiseWindow (float): Noise windows for OSNR in nm, see osnr
+    resolution (float, default None): Resolution bandwidth in nm for OSNR normalization and band power,
+        i.e. AQ6380Controls.settings['resolution']
+    RETURNS:
+    A dict with 'peakWavelength', 'peakPower', 'centroid', 'width' (dict by level),
+    'smsr', 'osnr', 'noiseFloor', 'totalPower' (None without the resolution) and 'peaks', a list of dicts with
+    'wavelength', 'power', 'width', 'osnr' for every detected peak"""
+    xvals=np.asarray(xvals, dtype=np.float64)
+    yvals=np.asarray(yvals, dtype=np.float64)
+    peakIndex=int(np.argmax(yvals))
+    peaks=findPeaks(xvals, yvals, threshold, minSeparation, maxPeaks)
+    peaklist=[]
+    for idx in peaks:
+        peaklist.append({'wavelength':float(xvals[idx]), 'power':float(yvals[idx]),
+                         'width':spectralWidth(xvals, yvals, idx, widthLevels[0])[0],
+                         'osnr':osnr(xvals, yvals, idx, noiseOffset, noiseWindow, resolution)[0]})
+    return {'peakWavelength':float(xvals[peakIndex]), 'peakPower':float(yvals[peakIndex]),
+            'centroid':centroid(xvals, yvals, widthLevels[-1], peakIndex),
+            'width':{level:spectralWidth(xvals, yvals, peakIndex, level)[0] for level in widthLevels},
+            'smsr':smsr(xvals, yvals, minSeparation, peakIndex)[0],
+            'osnr':osnr(xvals, yvals, peakIndex, noiseOffset, noiseWindow, resolution)[0],
+            'noiseFloor':noiseFloor(yvals),
+            'totalPower':bandPower(xvals, yvals, resolution=resolution) if resolution is not None else None,
+            'peaks':peaklist}
+
+def analyzeFile(filename, **kwargs):
+    """analyzeFile:
+    Loads a trace file and runs analyzeTrace on it
+    INPUTS:
+    filename (str): The trace file name; .csv, .npy, .npz or .aqb (see OSAExport)
+    kwargs: Options of analyzeTrace
+    RETURNS:
+    The analysis dict, see analyzeTrace"""
+    (xvals, yvals)=loadTrace(filename)
+    return analyzeTrace(xvals, yvals, **kwargs)
+
+if __name__=='__main__':
+    args=sys.argv[1:]
+    resolution=None
+    if len(args)>=2 and args[0]=='--resolution':#Resolution bandwidth in nm for the total power
+        resolution=float(args[1])
+        args=args[2:]
+    if len(args)<1:
+        print('Usage: python OSAAnalysis.py [--resolution nm] file.csv [file2.csv ...]')
+        exit(1)
+    for filename in args:
+        result=analyzeFile(filename, resolution=resolution)
+        print(filename)
+        print(f"  Peak: {result['peakWavelength']:.4f} nm, {result['peakPower']:.3f} dBm")
+        print(f"  Centroid: {result['centroid']:.4f} nm")
+        for (level, width) in result['width'].items():
+            print(f'  -{level:g} dB width: {width:.4f} nm')
+        print(f"  SMSR: {result['smsr']} dB")
+        print(f"  OSNR: {result['osnr']} dB")
+        print(f"  Noise floor: {result['noiseFloor']:.2f} dBm")
+        if result['totalPower'] is not None:
+            print(f"  Total power: {result['totalPower']:.3f} dBm")
+        for peak in result['peaks']:
+            print(f"  Peak {peak['wavelength']:.4f} nm {peak['power']:.3f} dBm width {peak['width']:.4f} nm")
@@ -0,0 +1,335 @@
+"""OSAArchive.py:
+Append-only binary archive of OSA sweeps for long monitoring runs
+An archive is two files:
+    name.aqd: a 64 byte header followed by fixed width float32/float64 trace blocks
+    name.aqi: one fixed size index record per sweep with timestamp, center, span,
+              resolution, sensitivity, speed, start and stop wavelength
+Both files are memory mapped when read, so any sweep or range of sweeps is a zero-copy
+numpy view and multi-GB archives can be scanned without loading them into RAM.
+All sweeps in an archive have the same number of points. By default only amplitudes are stored
+and the wavelength axis is rebuilt from the start and stop wavelength; use storeX=True for
+traces without an evenly spaced axis.
+Depends on OSAExport library
+Depends on numpy
+To get dependencies,
+pip install numpy
+To run: python OSAArchive.py or py OSAArchive.py depending on system
+    Commands:
+    import archive file1.csv [file2.csv ...]: Imports CSV traces into an archive
+    export archive index file.csv: Exports one sweep to CSV
+    info archive: Prints the number of sweeps and the time range
+"""
+import os
+import struct
+import sys
+import time
+import numpy as np
+from OSAExport import loadTrace, saveTrace
+
+archiveMagic=b'AQTRACE1'
+headerSize=64
+headerFormat='<8s2sIB'#magic, dtype ('f4' or 'f8'), points, storeX
+indexDtype=np.dtype([('timestamp', '<f8'), ('center', '<f8'), ('span', '<f8'), ('resolution', '<f8'),
+                     ('start', '<f8'), ('stop', '<f8'), ('sensitivity', 'S8'), ('speed', 'S2'), ('points', '<u4')])
+
+def archiveFiles(path):
+    """archiveFiles:
+    Gets the data and index file names of an archive
+    INPUTS:
+    path (str): The archive name, with or without extension
+    RETURNS:
+    (data file, index file)"""
+    (base, ext)=os.path.splitext(path)
+    if ext not in ('.aqd', '.aqi'):
+        base=path
+    return (base+'.aqd', base+'.aqi')
+
+def settingValue(settings, name):
+    """settingValue:
+    Gets a numeric setting in nm from a settings dict, NaN if missing or not numeric
+    INPUTS:
+    settings (dict): i.e. AQ6380Controls.settings
+    name (str): The setting name
+    RETURNS:
+    The value (float)"""
+    try:
+        return float(settings.get(name))
+    except (TypeError, ValueError):
+        return float('nan')
+
+class SweepArchive:
+    """class SweepArchive:
+        Reads and appends sweeps of an archive"""
+    def __init__(self, path, mode='r', points=None, dtype='f4', storeX=False):
+        """initialize:
+        INPUTS:
+            path (str): The archive name; '.aqd' and '.aqi' files are used
+            mode (str, default 'r'): 'r' to read, 'a' to read and append (created if missing)
+            points (int, default None): Points per sweep for a new archive, None to take it from the first sweep
+            dtype (str, default 'f4'): 'f4' or 'f8' storage for a new archive
+            storeX (bool, default False): Store wavelengths with every sweep in a new archive
+            Throws exception if the archive is missing in 'r' mode or its header is invalid
+            """
+        (self.dataFile, self.indexFile)=archiveFiles(path)
+        self.mode=mode
+        self.points=points
+        self.dtype=np.dtype(dtype).newbyteorder('<')
+        self.storeX=storeX
+        self.dataHandle=None
+        self.indexHandle=None
+        self.dataMap=None
+        self.indexMap=None
+        self.count=0#Complete sweeps; the maps may hold fewer until the next read, see ensureMapped
+        if os.path.exists(self.dataFile):
+            self.readHeader()
+        elif mode=='r':
+            raise FileNotFoundError(f'Archive {self.dataFile} does not exist')
+        if mode=='a':
+            if self.points is not None and not os.path.exists(self.dataFile):
+                self.writeHeader()
+            if not os.path.exists(self.indexFile):
+                open(self.indexFile, 'wb').close()
+            self.repair()
+        self.refresh()
+
+    def readHeader(self):
+        """readHeader: Reads points, dtype and storeX from the data file header"""
+        with open(self.dataFile, 'rb') as fp:
+            header=fp.read(headerSize)
+        (magic, dtype, points, storeX)=struct.unpack_from(headerFormat, header)
+        if magic!=archiveMagic:
+            raise ValueError(f'{self.dataFile} is not an OSA archive')
+        self.dtype=np.dtype(dtype.decode('ascii')).newbyteorder('<')
+        self.points=points
+        self.storeX=bool(storeX)
+
+    def writeHeader(self):
+        """writeHeader: Creates the data file with its header"""
+        header=struct.pack(headerFormat, archiveMagic, self.dtype.str[1:].encode('ascii'), self.points, int(self.storeX))
+        with open(self.dataFile, 'wb') as fp:
+            fp.write(header.ljust(headerSize, b'\0'))
+
+    def blockWidth(self):
+        """blockWidth: Number of values stored per sweep"""
+        return self.points*2 if self.storeX else self.points
+
+    def repair(self):
+        """repair:
+        Drops a partly written last sweep, i.e. a data block without its index record after the
+        writing process was killed, so the next append lines up with the index again"""
+        if self.points is None or not os.path.exists(self.dataFile):
+            return
+        blockBytes=self.blockWidth()*self.dtype.itemsize
+        nindex=os.path.getsize(self.indexFile)//indexDtype.itemsize
+        ndata=(os.path.getsize(self.dataFile)-headerSize)//blockBytes
+        count=min(nindex, ndata)
+        if os.path.getsize(self.dataFile)!=headerSize+count*blockBytes:
+            print(f'{self.dataFile}: dropping incomplete sweep data after sweep {count}')
+            os.truncate(self.dataFile, headerSize+count*blockBytes)
+        if os.path.getsize(self.indexFile)!=count*indexDtype.itemsize:
+            os.truncate(self.indexFile, count*indexDtype.itemsize)
+
+    def refresh(self):
+        """refresh:
+        Memory maps the sweeps written so far, including ones appended by another process"""
+        self.dataMap=None
+        self.indexMap=None
+        self.count=0
+        if self.points is None or not os.path.exists(self.dataFile):
+            return
+        nindex=os.path.getsize(self.indexFile)//indexDtype.itemsize if os.path.exists(self.indexFile) else 0
+        ndata=(os.path.getsize(self.dataFile)-headerSize)//(self.blockWidth()*self.dtype.itemsize)
+        self.count=min(nindex, ndata)#A sweep is complete once both its block and index record are written
+        self.ensureMapped()
+
+    def ensureMapped(self):
+        """ensureMapped:
+        Maps sweeps appended since the last read; append only counts them, so writing
+        does not pay for remapping after every sweep"""
+        mapped=0 if self.indexMap is None else len(self.indexMap)
+        if self.count==mapped:
+            return
+        self.indexMap=np.memmap(self.indexFile, dtype=indexDtype, mode='r', shape=(self.count,))
+        self.dataMap=np.memmap(self.dataFile, dtype=self.dtype, mode='r', offset=headerSize, shape=(self.count, self.blockWidth()))
+
+    def __len__(self):
+        """len: Number of sweeps in the archive"""
+        return self.count
+
+    @property
+    def index(self):
+        """index: The index records as a structured numpy array (memory mapped)"""
+        self.ensureMapped()
+        return self.indexMap if self.indexMap is not None else np.zeros(0, dtype=indexDtype)
+
+    def append(self, xvals, yvals, timestamp=None, settings=None):
+        """append:
+        Appends a sweep to the archive
+        INPUTS:
+        xvals (numpy array): Wavelengths in nm
+        yvals (numpy array): Amplitudes in dBm
+        timestamp (float, default None): Acquisition time (time.time()), None for now
+        settings (dict, default None): Sweep settings with 'center', 'span', 'resolution',
+            'sensitivity' and 'speed', i.e. AQ6380Controls.settings
+        Throws exception if the archive is read only or the sweep has the wrong number of points;
+        all sweeps of an archive have the same number of points, start a new archive for other settings"""
+        if self.mode!='a':
+            raise ValueError('Archive is not open for appending')
+        yvals=np.asarray(yvals)
+        xvals=np.asarray(xvals)
+        if self.points is None:#First sweep of a new archive sets the width
+            self.points=len(yvals)
+            self.writeHeader()
+        if len(yvals)!=self.points or len(xvals)!=self.points:
+            raise ValueError(f'Sweep has {len(yvals)} points; archive {self.dataFile} has {self.points}')
+        settings=settings or {}
+        record=np.zeros(1, dtype=indexDtype)
+        record['timestamp']=time.time() if timestamp is None else timestamp
+        record['center']=settingValue(settings, 'center')
+        record['span']=settingValue(settings, 'span')
+        record['resolution']=settingValue(settings, 'resolution')
+        record['start']=xvals[0] if len(xvals) else float('nan')
+        record['stop']=xvals[-1] if len(xvals) else float('nan')
+        record['sensitivity']=str(settings.get('sensitivity', '')).encode('ascii')[:8]
+        record['speed']=str(settings.get('speed', '')).encode('ascii')[:2]
+        record['points']=self.points
+        if self.dataHandle is None:
+            self.dataHandle=open(self.dataFile, 'ab')
+            self.indexHandle=open(self.indexFile, 'ab')
+        if self.storeX:
+            self.dataHandle.write(xvals.astype(self.dtype).tobytes())
+        self.dataHandle.write(yvals.astype(self.dtype).tobytes())
+        self.dataHandle.flush()#Block before index record; readers only see complete sweeps
+        self.indexHandle.write(record.tobytes())
+        self.indexHandle.flush()
+        self.count+=1#Mapped on the next read
+
+    def xAxis(self, idx):
+        """xAxis:
+        Gets the wavelength axis of a sweep
+        INPUTS:
+        idx (int): The sweep number
+        RETURNS:
+        The wavelengths in nm; a view if stored, otherwise rebuilt from start and stop"""
+        self.ensureMapped()
+        if self.storeX:
+            return self.dataMap[idx, :self.points]
+        record=self.indexMap[idx]
+        return np.linspace(record['start'], record['stop'], self.points)
+
+    def getSweep(self, idx):
+        """getSweep:
+        Gets one sweep
+        INPUTS:
+        idx (int): The sweep number, negative numbers count from the end
+        RETURNS:
+        (xvals, yvals) where yvals is a zero-copy view into the archive"""
+        if len(self)==0:
+            raise IndexError('Archive is empty')
+        self.ensureMapped()
+        return (self.xAxis(idx), self.dataMap[idx, -self.points:])
+
+    def getSweeps(self, start=0, stop=None):
+        """getSweeps:
+        Gets a range of sweeps
+        INPUTS:
+        start (int, default 0): The first sweep number
+        stop (int, default None): One past the last sweep number, None for the end
+        RETURNS:
+        A 2-D zero-copy view of amplitudes, one row per sweep"""
+        if len(self)==0:
+            return np.zeros((0, self.points or 0), dtype=self.dtype)
+        self.ensureMapped()
+        return self.dataMap[start:stop, -self.points:]
+
+    def find(self, startTime=None, stopTime=None, **settings):
+        """find:
+        Finds sweeps by time range and settings
+        INPUTS:
+        startTime, stopTime (float, default None): Time range (time.time() values)
+        settings: Settings that must match, i.e. center=1608.0, sensitivity='MID'
+        RETURNS:
+        A numpy array of matching sweep numbers"""
+        index=self.index
+        mask=np.ones(len(index), dtype=bool)
+        if startTime is not None:
+            mask&=index['timestamp']>=startTime
+        if stopTime is not None:
+            mask&=index['timestamp']<=stopTime
+        for (name, value) in settings.items():
+            if name in ('sensitivity', 'speed'):
+                mask&=index[name]==str(value).encode('ascii')
+            else:
+                mask&=np.isclose(index[name], float(value))
+        return np.flatnonzero(mask)
+
+    def iterSweeps(self, chunk=1024, start=0, stop=None):
+        """iterSweeps:
+        Scans the archive in chunks without loading it into memory
+        INPUTS:
+        chunk (int, default 1024): Sweeps per chunk
+        start, stop (int): Range of sweep numbers, stop None for the end
+        RETURNS:
+        A generator of (first sweep number, index records, 2-D amplitude view)"""
+        stop=len(self) if stop is None else min(stop, len(self))
+        self.ensureMapped()
+        for first in range(start, stop, chunk):
+            last=min(first+chunk, stop)
+            yield (first, self.indexMap[first:last], self.dataMap[first:last, -self.points:])
+
+    def exportCsv(self, idx, filename):
+        """exportCsv:
+        Exports one sweep in the two column wavelength, amplitude CSV layout
+        INPUTS:
+        idx (int): The sweep number
+        filename (str): The CSV file"""
+        (xvals, yvals)=self.getSweep(idx)
+        saveTrace(filename, np.round(xvals, 4), yvals, fmt='csv')
+
+    def importCsv(self, filename, timestamp=None, settings=None):
+        """importCsv:
+        Appends a sweep from a two column wavelength, amplitude CSV file
+        INPUTS:
+        filename (str): The CSV file
+        timestamp (float, default None): Sweep time, None for the file modification time
+        settings (dict, default None): Sweep settings, None to derive center and span from the file"""
+        (xvals, yvals)=loadTrace(filename, 'csv')
+        if settings is None and len(xvals):
+            settings={'center':(xvals[0]+xvals[-1])/2, 'span':xvals[-1]-xvals[0]}
+        self.append(xvals, yvals, os.path.getmtime(filename) if timestamp is None else timestamp, settings)
+
+    def close(self):
+        """close: Closes the archive"""
+        if self.dataHandle is not None:
+            self.dataHandle.close()
+            self.indexHandle.close()
+            self.dataHandle=None
+            self.indexHandle=None
+        self.dataMap=None
+        self.indexMap=None
+        self.count=0
+
+if __name__=='__main__':
+    if len(sys.argv)<3:
+        print('Usage: python OSAArchive.py import archive file1.csv [file2.csv ...]')
+        print('       python OSAArchive.py export archive index file.csv')
+        print('       python OSAArchive.py info archive')
+        exit(1)
+    command=sys.argv[1].lower()
+    if command=='import':
+        archive=SweepArchive(sys.argv[2], 'a')
+        for filename in sys.argv[3:]:
+            archive.importCsv(filename)
+        archive.close()
+        print(f'Imported {len(sys.argv)-3} traces')
+    elif command=='export':
+        archive=SweepArchive(sys.argv[2])
+        archive.exportCsv(int(sys.argv[3]), sys.argv[4])
+    elif command=='info':
+        archive=SweepArchive(sys.argv[2])
+        print(f'{len(archive)} sweeps of {archive.points} points ({archive.dtype.name})')
+        if len(archive):
+            timestamps=archive.index['timestamp']
+            print(f'From {time.ctime(timestamps.min())} to {time.ctime(timestamps.max())}')
+    else:
+        print(f'Invalid Command: {command}')
@@ -0,0 +1,258 @@
+"""OSABatch.py:
+Parallel offline analysis of directories of saved traces
+Every trace file (CSV in the two column wavelength/dBm layout of test1.csv, or any
+OSAExport format) is parsed with the vectorized OSAExport reader and summarized with
+OSAAnalysis: peak wavelength and power, spectral widths, and with the resolution bandwidth
+of the traces the total power and the power in each wavelength band. The summaries are
+written as one CSV table, one row per file.
+Files are found lazily and handed to a process pool in chunks, with a bounded number of
+chunks in flight; rows are written in file order as soon as their chunk is done. Memory
+stays flat however many files there are, and a file that fails only gets an error row.
+Depends on OSAAnalysis and OSAExport libraries
+Depends on numpy
+To get dependencies,
+pip install numpy
+To run: python OSABatch.py directory [directory ...] or py OSABatch.py directory [directory ...] depending on system
+    Example: "python OSABatch.py traces --recursive --resolution 0.02 --bands 1530:1565 1565:1625 --output summary.csv"
+"""
+import argparse
+import csv
+import fnmatch
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from OSAAnalysis import spectralWidth, bandPower
+from OSAExport import loadTrace
+
+defaultPattern='*.csv'
+defaultChunkSize=32#Files per task sent to a worker
+chunksPerWorker=4#Chunks in flight per worker; bounds the memory held by pending results
+progressInterval=1.0#Seconds between progress lines
+
+def findTraceFiles(paths, pattern=defaultPattern, recursive=False):
+    """findTraceFiles:
+    Lists trace files lazily, in name order within each directory
+    INPUTS:
+    paths (list of str): Directories or files; files are taken as they are
+    pattern (str, default defaultPattern): File name pattern, i.e. '*.csv'
+    recursive (bool, default False): Include sub directories
+    RETURNS:
+    A generator of file names"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for (directory, subdirs, files) in os.walk(path):
+            subdirs.sort()
+            for name in sorted(files):
+                if fnmatch.fnmatch(name, pattern):
+                    yield os.path.join(directory, name)
+            if not recursive:
+                break
+
+def parseBand(text):
+    """parseBand:
+    Parses a 'start:stop' wavelength band
+    INPUTS:
+    text (str): The band in nm, i.e. '1530:1565'
+    RETURNS:
+    (start, stop) as floats
+    Throws exception if the band is invalid"""
+    try:
+        (start, stop)=[float(value) for value in text.split(':')]
+    except ValueError:
+        raise ValueError(f'Band of {text} is invalid, use start:stop in nm')
+    if stop<=start:
+        raise ValueError(f'Band of {text} is invalid, stop must be above start')
+    return (start, stop)
+
+def widthColumn(level):
+    """widthColumn: RETURNS: The summary column of the spectral width at level dB, i.e. 'width3dB'"""
+    return f'width{level:g}dB'
+
+def bandColumn(start, stop):
+    """bandColumn: RETURNS: The summary column of the power in a band, i.e. 'band1530_1565'"""
+    return f'band{start:g}_{stop:g}'
+
+def summaryColumns(widthLevels=(3.0, 20.0), bands=()):
+    """summaryColumns:
+    Gets the columns of the summary table
+    INPUTS:
+    widthLevels (tuple of float, default (3.0, 20.0)): dB levels of the spectral widths
+    bands (list of tuple, default ()): (start, stop) bands in nm
+    RETURNS:
+    The column names (list of str)"""
+    return (['file', 'points', 'start', 'stop', 'peakWavelength', 'peakPower']
+            +[widthColumn(level) for level in widthLevels]+['totalPower']
+            +[bandColumn(start, stop) for (start, stop) in bands]+['error'])
+
+def summarizeTrace(xvals, yvals, widthLevels=(3.0, 20.0), bands=(), resolution=None):
+    """summarizeTrace:
+    Summarizes one trace
+    INPUTS:
+    xvals, yvals (numpy array): The trace in nm and dBm
+    widthLevels (tuple of float, default (3.0, 20.0)): dB levels of the spectral widths
+    bands (list of tuple, default ()): (start, stop) bands in nm for band power
+    resolution (float, default None): Resolution bandwidth of the trace in nm, see bandPower;
+        None leaves totalPower and the band powers empty, as they cannot be integrated without it
+    RETURNS:
+    A dict by summaryColumns without 'file' and 'error'; powers in dBm, wavelengths and widths in nm"""
+    xvals=np.asarray(xvals, dtype=np.float64)
+    yvals=np.asarray(yvals, dtype=np.float64)
+    if len(yvals)==0:
+        raise ValueError('Trace is empty')
+    peakIndex=int(np.argmax(yvals))
+    row={'points':len(yvals), 'start':float(xvals[0]), 'stop':float(xvals[-1]),
+         'peakWavelength':float(xvals[peakIndex]), 'peakPower':float(yvals[peakIndex])}
+    for level in widthLevels:
+        row[widthColumn(level)]=spectralWidth(xvals, yvals, peakIndex, level)[0]
+    row['totalPower']=bandPower(xvals, yvals, resolution=resolution) if resolution is not None else None
+    for (start, stop) in bands:
+        inband=np.count_nonzero((xvals>=start)&(xvals<=stop))
+        row[bandColumn(start, stop)]=bandPower(xvals, yvals, start, stop, resolution) if inband and resolution is not None else None
+    return row
+
+def summarizeFiles(filenames, widthLevels=(3.0, 20.0), bands=(), resolution=None):
+    """summarizeFiles:
+    Loads and summarizes a chunk of trace files; runs in a worker process
+    INPUTS:
+    filenames (list of str): The files
+    widthLevels, bands, resolution: see summarizeTrace
+    RETURNS:
+    A list of row dicts in the order of filenames; a file that cannot be read or analyzed
+    has only 'file' and 'error'"""
+    rows=[]
+    for filename in filenames:
+        try:
+            (xvals, yvals)=loadTrace(filename)
+            row=summarizeTrace(xvals, yvals, widthLevels, bands, resolution)
+        except Exception as e:#Keep going; one bad file must not stop the batch
+            row={'error':f'{type(e).__name__}: {e}'}
+        row['file']=filename
+        rows.append(row)
+    return rows
+
+def chunked(items, size):
+    """chunked: RETURNS: A generator of lists of up to size items from an iterable"""
+    chunk=[]
+    for item in items:
+        chunk.append(item)
+        if len(chunk)>=size:
+            yield chunk
+            chunk=[]
+    if chunk:
+        yield chunk
+
+def batchSummaries(filenames, workers=None, chunkSize=defaultChunkSize, **options):
+    """batchSummaries:
+    Summarizes trace files on a process pool, keeping at most chunksPerWorker chunks per worker in flight
+    INPUTS:
+    filenames (iterable of str): The files, consumed lazily
+    workers (int, default None): Worker processes, None for the number of CPUs, 0 to run in this process
+    chunkSize (int, default defaultChunkSize): Files per task
+    options: widthLevels, bands and resolution, see summarizeTrace
+    RETURNS:
+    A generator of row dicts in the order of filenames"""
+    chunks=chunked(filenames, chunkSize)
+    if workers==0:
+        for chunk in chunks:
+            yield from summarizeFiles(chunk, **options)
+        return
+    workers=workers or os.cpu_count() or 1
+    limit=workers*chunksPerWorker
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending=deque()
+        for chunk in chunks:
+            pending.append(pool.submit(summarizeFiles, chunk, **options))
+            if len(pending)>=limit:#Wait for the oldest chunk before reading more files
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def writeSummary(fp, rows, columns, progress=None):
+    """writeSummary:
+    Writes summary rows as CSV as they arrive
+    INPUTS:
+    fp (file): The open output file
+    rows (iterable of dict): The rows, see summarizeFiles
+    columns (list of str): The columns, see summaryColumns
+    progress (function, default None): Called with (files, errors) after every row
+    RETURNS:
+    (files, errors) counts"""
+    writer=csv.DictWriter(fp, columns, extrasaction='ignore')
+    writer.writeheader()
+    (files, errors)=(0, 0)
+    for row in rows:
+        writer.writerow({key:(f'{value:.6f}' if isinstance(value, float) else value) for (key, value) in row.items()})
+        files+=1
+        if row.get('error'):
+            errors+=1
+        if progress is not None:
+            progress(files, errors)
+    return (files, errors)
+
+class ProgressReporter:
+    """class ProgressReporter:
+        Prints files done, rate and estimated time left to stderr at most every progressInterval seconds"""
+    def __init__(self, total=None, interval=progressInterval):
+        """initialize:
+        INPUTS:
+            total (int, default None): Number of files, None if unknown
+            interval (float, default progressInterval): Seconds between lines
+            """
+        self.total=total
+        self.interval=interval
+        self.started=time.perf_counter()
+        self.lastReport=self.started
+
+    def __call__(self, files, errors, final=False):
+        now=time.perf_counter()
+        if not final and now-self.lastReport<self.interval:
+            return
+        self.lastReport=now
+        rate=files/max(now-self.started, 1e-9)
+        line=f'{files} files'
+        if self.total:
+            line=f'{files}/{self.total} files ({100*files/self.total:.1f}%)'
+        line+=f', {rate:.1f} files/s, {errors} errors'
+        if self.total and not final and rate>0:
+            line+=f', {(self.total-files)/rate:.0f} s left'
+        print(line, file=sys.stderr, flush=True)
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Summarize directories of saved traces in parallel')
+    parser.add_argument('paths', nargs='+', help='Directories of trace files, or trace files')
+    parser.add_argument('--pattern', default=defaultPattern, help='File name pattern in directories')
+    parser.add_argument('--recursive', action='store_true', help='Include sub directories')
+    parser.add_argument('--output', default='summary.csv', help="Summary CSV file, '-' for stdout")
+    parser.add_argument('--bands', nargs='*', default=[], help='Bands for band power as start:stop in nm')
+    parser.add_argument('--width-levels', nargs='+', type=float, default=[3.0, 20.0], help='dB levels of the spectral widths')
+    parser.add_argument('--resolution', type=float, default=None, help='Resolution bandwidth (nm) of the traces; needed for total and band power')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes; default the number of CPUs, 0 for none')
+    parser.add_argument('--chunk-size', type=int, default=defaultChunkSize, help='Files per worker task')
+    parser.add_argument('--no-count', action='store_true', help='Do not count the files first; progress without a total')
+    args=parser.parse_args()
+    try:
+        bands=[parseBand(band) for band in args.bands]
+    except ValueError as e:
+        parser.error(str(e))
+    if bands and args.resolution is None:
+        parser.error('--bands needs the --resolution of the traces')
+    if args.chunk_size<1:
+        parser.error('--chunk-size must be at least 1')
+    total=None if args.no_count else sum(1 for filename in findTraceFiles(args.paths, args.pattern, args.recursive))
+    columns=summaryColumns(args.width_levels, bands)
+    rows=batchSummaries(findTraceFiles(args.paths, args.pattern, args.recursive), args.workers, args.chunk_size,
+                        widthLevels=args.width_levels, bands=bands, resolution=args.resolution)
+    progress=ProgressReporter(total)
+    if args.output=='-':
+        (files, errors)=writeSummary(sys.stdout, rows, columns, progress)
+    else:
+        with open(args.output, 'w', newline='') as fp:
+            (files, errors)=writeSummary(fp, rows, columns, progress)
+    progress(files, errors, final=True)
+    if args.output!='-':
+        print(f'Summary of {files} files written to {args.output}', file=sys.stderr)
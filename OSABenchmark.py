@@ -0,0 +1,395 @@
+"""OSABenchmark.py:
+Throughput and latency benchmarks for the AQ6380Controls client
+Runs against a local OSASimulator by default, or against any OSA with --host
+Measures:
+    query/write round trip latency, with and without instrumentation
+    query latency and trace download time of each transport backend (pyvisa, socket)
+    sweeps per minute of the repeatsinglesweep.py loop (sweep, download, save CSV)
+    trace download and parse time against point count for each trace format
+    download time of all traces with getTraces against one getTraceVals per trace
+    export time of each OSAExport format against the per point CSV loop
+    peak memory per trace download
+    startup: module import time and time from a fresh interpreter to the first command reply
+Results are written as JSON so runs can be compared between releases
+Depends on AQ6380Controls and OSASimulator libraries
+Depends on pyvisa, pyvisa-py, numpy
+To get dependencies,
+pip install pyvisa
+pip install pyvisa-py
+pip install numpy
+To run: python OSABenchmark.py or py OSABenchmark.py depending on system
+    Example: "python OSABenchmark.py --points 1001 10001 100001 --output results.json"
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from AQ6380Controls import AQ6380Controls, traceFormats, traceNames, parseAsciiTrace, decodeBinaryTrace, traceFormatTypes
+from OSATransport import transports
+from OSASimulator import startSimulator, simcsv
+from OSAExport import saveTrace, loadTrace
+
+defaultPoints=[1001, 10001, 100001, 200001]#Trace sizes to benchmark
+defaultOutput='benchmark_results.json'
+startupModules=['AQ6380Controls', 'OSAExport', 'OSACommandLine', 'OSATerminal', 'OSAPlot', 'OSAGUIv2']#Imported by scripts at startup
+
+def summarize(times):
+    """summarize:
+    Summarizes a list of durations
+    INPUTS:
+    times (list of float): The durations in seconds
+    RETURNS:
+    A dict with count, mean, median, min, max, p95 and p99 in seconds"""
+    ordered=sorted(times)
+    def percentile(p):
+        return ordered[min(len(ordered)-1, int(round(p/100*(len(ordered)-1))))]
+    return {'count':len(ordered), 'mean':statistics.fmean(ordered), 'median':statistics.median(ordered),
+            'min':ordered[0], 'max':ordered[-1], 'p95':percentile(95), 'p99':percentile(99)}
+
+def timeCall(func, repeats):
+    """timeCall:
+    Times repeated calls of a function
+    INPUTS:
+    func (function): The function to call with no arguments
+    repeats (int): The number of calls
+    RETURNS:
+    A list of durations in seconds"""
+    times=[]
+    for idx in range(repeats):
+        t0=time.perf_counter()
+        func()
+        times.append(time.perf_counter()-t0)
+    return times
+
+def saveCsv(filename, xvals, yvals):
+    """saveCsv:
+    Saves a trace with the per point loop the scripts used before OSAExport
+    INPUTS:
+    filename (str): The file to write
+    xvals, yvals: The trace"""
+    with open(filename, 'w') as fp:
+        for idx in range(len(xvals)):
+            fp.write(f'{xvals[idx]},{yvals[idx]}\n')
+
+def benchLatency(osa, iterations):
+    """benchLatency:
+    Measures single command round trip latency
+    INPUTS:
+    osa (AQ6380Controls): A connected OSA
+    iterations (int): The number of commands of each kind
+    RETURNS:
+    A dict of latency summaries for query, write, write followed by query and
+    query with instrumentation enabled"""
+    center=float(osa.query(':sens:wav:cent?'))*1e9
+    results={}
+    results['query']=summarize(timeCall(lambda: osa.query('*IDN?'), iterations))
+    results['write']=summarize(timeCall(lambda: osa.write(f':sens:wav:cent {center}nm'), iterations))
+    #A write only returns when sent; pair it with a query to include the instrument processing it
+    results['write_query']=summarize(timeCall(lambda: (osa.write(f':sens:wav:cent {center}nm'), osa.query('*OPC?')), iterations))
+    instrumentation=osa.enableInstrumentation()#Overhead of leaving instrumentation on
+    results['query_instrumented']=summarize(timeCall(lambda: osa.query('*IDN?'), iterations))
+    osa.disableInstrumentation()
+    osa.invalidateXAxis()
+    return results
+
+def setPoints(osa, npoints):
+    """setPoints:
+    Sets a fixed number of sampling points and sweeps once so the trace has that size
+    INPUTS:
+    osa (AQ6380Controls): A connected OSA
+    npoints (int): The number of sampling points"""
+    osa.sendSCPI(f':sens:swe:poin {npoints}')
+    osa.singleSweep()
+
+def benchTraceTransfer(osa, points, formats, repeats):
+    """benchTraceTransfer:
+    Measures getTraceVals time against point count for each trace format,
+    with and without the cached wavelength axis
+    INPUTS:
+    osa (AQ6380Controls): A connected OSA
+    points (list of int): The trace sizes
+    formats (list of str): The trace formats
+    repeats (int): The number of downloads of each size and format
+    RETURNS:
+    A list of dicts with points, format, cacheXAxis, time summary, points per second and peak memory"""
+    results=[]
+    oldformat=osa.traceFormat
+    oldcache=osa.cacheXAxis
+    for npoints in points:
+        setPoints(osa, npoints)
+        for fmt in formats:
+            for cache in (False, True):
+                osa.setTraceFormat(fmt)
+                osa.cacheXAxis=cache
+                osa.getTraceVals()#Warm up; fills axis cache
+                times=timeCall(osa.getTraceVals, repeats)
+                tracemalloc.start()
+                osa.getTraceVals()
+                peakmemory=tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                summary=summarize(times)
+                results.append({'points':npoints, 'format':fmt, 'cacheXAxis':cache, 'time':summary,
+                                'points_per_second':npoints/summary['median'], 'peak_memory_bytes':peakmemory})
+                print(f'Transfer {npoints} points {fmt} cache={cache}: {summary["median"]*1000:.2f} ms')
+    osa.setTraceFormat(oldformat)
+    osa.cacheXAxis=oldcache
+    osa.sendSCPI(':sens:swe:poin:auto on')
+    return results
+
+def benchMultiTrace(osa, repeats, names=traceNames):
+    """benchMultiTrace:
+    Measures getTraces against one getTraceVals per trace, with every trace holding the last sweep
+    INPUTS:
+    osa (AQ6380Controls): A connected OSA
+    repeats (int): The number of downloads of each kind
+    names (list of str, default traceNames): The traces to download
+    RETURNS:
+    A dict with traces, points and time summaries of 'batch' and 'sequential'"""
+    osa.singleSweep()
+    for name in names:
+        if name!='TRA':
+            osa.sendSCPI(f':trac:copy TRA,{name}')
+    osa.getTraces(names)#Warm up; fills axis cache
+    batch=summarize(timeCall(lambda: osa.getTraces(names), repeats))
+    sequential=summarize(timeCall(lambda: [osa.getTraceVals(name) for name in names], repeats))
+    print(f'{len(names)} traces: getTraces {batch["median"]*1000:.2f} ms, getTraceVals each {sequential["median"]*1000:.2f} ms')
+    return {'traces':len(names), 'points':len(osa.getXAxis()), 'batch':batch, 'sequential':sequential}
+
+def benchTransports(host, port, names, points, iterations, repeats):
+    """benchTransports:
+    Measures query latency and REAL64 trace download time over each transport backend,
+    each with its own connection
+    INPUTS:
+    host (str), port (str or int): The OSA address
+    names (list of str): The transports to compare
+    points (list of int): The trace sizes
+    iterations (int): The number of queries per latency measurement
+    repeats (int): The number of downloads of each size
+    RETURNS:
+    A dict by transport of 'open' (seconds to connect and sign in), 'query' latency summary
+    and 'trace_transfer', a list of dicts with points, time summary and points per second"""
+    results={}
+    for name in names:
+        osa=AQ6380Controls(host, port=str(port), traceFormat='REAL64', transport=name)
+        t0=time.perf_counter()
+        osa.open()
+        result={'open':time.perf_counter()-t0, 'trace_transfer':[]}
+        try:
+            result['query']=summarize(timeCall(lambda: osa.query('*IDN?'), iterations))
+            print(f"Transport {name} query: {result['query']['median']*1e6:.1f} us")
+            for npoints in points:
+                setPoints(osa, npoints)
+                osa.getTraceVals()#Warm up; fills axis cache
+                summary=summarize(timeCall(osa.getTraceVals, repeats))
+                result['trace_transfer'].append({'points':npoints, 'time':summary, 'points_per_second':npoints/summary['median']})
+                print(f'Transport {name} transfer {npoints} points: {summary["median"]*1000:.2f} ms')
+            osa.sendSCPI(':sens:swe:poin:auto on')
+        finally:
+            osa.close()
+        results[name]=result
+    return results
+
+def benchParse(points, repeats):
+    """benchParse:
+    Measures parse time of each trace format without the network, including
+    the per point Python parser used before binary transfer
+    INPUTS:
+    points (list of int): The trace sizes
+    repeats (int): The number of parses of each size and format
+    RETURNS:
+    A list of dicts with points, parser and time summary"""
+    results=[]
+    for npoints in points:
+        values=np.linspace(1.6e-6, 1.61e-6, npoints)
+        text=','.join(f'{v:+.8E}' for v in values)
+        payloads={'python':lambda: [float(v) for v in text.split(',')],
+                  'ASCII':lambda: parseAsciiTrace(text)}
+        for fmt in traceFormatTypes:
+            block=values.astype(traceFormatTypes[fmt]).tobytes()
+            payloads[fmt]=lambda block=block, fmt=fmt: decodeBinaryTrace(block, fmt)
+        for (parser, func) in payloads.items():
+            results.append({'points':npoints, 'parser':parser, 'time':summarize(timeCall(func, repeats))})
+    return results
+
+def benchCsvExport(points, repeats, directory):
+    """benchCsvExport:
+    Measures export and load time against point count for the per point CSV loop
+    and each OSAExport format
+    INPUTS:
+    points (list of int): The trace sizes
+    repeats (int): The number of exports of each size
+    directory (str): The directory to write files to
+    RETURNS:
+    A list of dicts with points, writer, time summary, load time summary and file size"""
+    results=[]
+    writers={'saveCsv':('csv', lambda filename, x, y: saveCsv(filename, x, y)),
+             'csv':('csv', lambda filename, x, y: saveTrace(filename, x, y)),
+             'csv_fixed':('csv', lambda filename, x, y: saveTrace(filename, x, y, precision=(4, 3))),
+             'npy':('npy', lambda filename, x, y: saveTrace(filename, x, y)),
+             'npz_compressed':('npz', lambda filename, x, y: saveTrace(filename, x, y, compress=True)),
+             'aqb':('aqb', lambda filename, x, y: saveTrace(filename, x, y)),
+             'aqb_f4_compressed':('aqb', lambda filename, x, y: saveTrace(filename, x, y, compress=True, dtype='f4'))}
+    for npoints in points:
+        xvals=np.round(np.linspace(1600, 1610, npoints), 4)
+        yvals=np.random.uniform(-80, 0, npoints)
+        for (writer, (fmt, func)) in writers.items():
+            filename=os.path.join(directory, f'benchmark_trace.{fmt}')
+            times=timeCall(lambda: func(filename, xvals, yvals), repeats)
+            loadtimes=timeCall(lambda: loadTrace(filename), repeats)
+            results.append({'points':npoints, 'writer':writer, 'time':summarize(times), 'load_time':summarize(loadtimes),
+                            'bytes':os.path.getsize(filename)})
+            print(f'Export {npoints} points {writer}: {results[-1]["time"]["median"]*1000:.2f} ms')
+            os.remove(filename)
+    return results
+
+def benchSweepLoop(osa, sweeps, directory):
+    """benchSweepLoop:
+    Runs the repeatsinglesweep.py loop (sweep, download, save CSV)
+    INPUTS:
+    osa (AQ6380Controls): A connected OSA
+    sweeps (int): The number of sweeps
+    directory (str): The directory to write the trace file to
+    RETURNS:
+    A dict with sweeps per minute and summaries of the sweep, download, save and cycle times"""
+    filename=os.path.join(directory, 'tracedata.csv')
+    stages={'sweep':[], 'download':[], 'save':[], 'cycle':[]}
+    t0=time.perf_counter()
+    for idx in range(sweeps):
+        t1=time.perf_counter()
+        osa.singleSweep()
+        t2=time.perf_counter()
+        (xvals, yvals)=osa.getTraceVals()
+        t3=time.perf_counter()
+        saveTrace(filename, xvals, yvals)
+        t4=time.perf_counter()
+        stages['sweep'].append(t2-t1)
+        stages['download'].append(t3-t2)
+        stages['save'].append(t4-t3)
+        stages['cycle'].append(t4-t1)
+    elapsed=time.perf_counter()-t0
+    os.remove(filename)
+    result={'sweeps':sweeps, 'sweeps_per_minute':sweeps/elapsed*60}
+    for (name, times) in stages.items():
+        result[name]=summarize(times)
+    return result
+
+def runPython(code):
+    """runPython:
+    Runs code in a fresh interpreter in the directory of this file
+    INPUTS:
+    code (str): The code to run
+    RETURNS:
+    (printed lines, process wall time in seconds)"""
+    t0=time.perf_counter()
+    output=subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                          capture_output=True, text=True, check=True).stdout
+    return (output.strip().splitlines(), time.perf_counter()-t0)
+
+def benchStartup(host, port, repeats, transport='pyvisa'):
+    """benchStartup:
+    Measures startup cost in fresh interpreters: the import time of each module used by the scripts,
+    the modules each import pulls in, and the time to import AQ6380Controls, open the OSA and get a
+    reply to the first command
+    INPUTS:
+    host (str), port (str or int): The OSA address
+    repeats (int): The number of interpreters per measurement
+    transport (str, default 'pyvisa'): The transport for the first command
+    RETURNS:
+    A dict with 'interpreter' (process time of an empty script), 'imports' by module
+    and 'first_command' summaries"""
+    results={'interpreter':summarize([runPython('print(0)')[1] for idx in range(repeats)]), 'imports':{}}
+    for module in startupModules:
+        code=(f'import sys, time\nt0=time.perf_counter()\nimport {module}\nt1=time.perf_counter()\n'
+              f"print(','.join(sorted(m for m in ('pyvisa', 'matplotlib', 'numpy', 'tkinter') if m in sys.modules)))\n"
+              f'print(t1-t0)')
+        runs=[runPython(code)[0] for idx in range(repeats)]
+        loaded=runs[0][-2]
+        results['imports'][module]={'time':summarize([float(lines[-1]) for lines in runs]), 'loads':loaded.split(',') if loaded else []}
+        print(f'Import {module}: {results["imports"][module]["time"]["median"]*1000:.1f} ms, loads {loaded}')
+    code=(f'import time\nt0=time.perf_counter()\nfrom AQ6380Controls import AQ6380Controls\n'
+          f"osa=AQ6380Controls('{host}', port='{port}', transport='{transport}')\nosa.open()\nosa.query('*IDN?')\nprint(time.perf_counter()-t0)")
+    results['first_command']=summarize([float(runPython(code)[0][-1]) for idx in range(repeats)])
+    print(f"First command: {results['first_command']['median']*1000:.1f} ms")
+    return results
+
+def runBenchmarks(args):
+    """runBenchmarks:
+    Runs the benchmarks selected by the command line arguments
+    INPUTS:
+    args (argparse.Namespace): The parsed command line arguments
+    RETURNS:
+    The results as a dict"""
+    server=None
+    host=args.host
+    port=args.port
+    if host is None:#Start a local simulator
+        server=startSimulator(port=0, csvfile=args.csv, latency=args.latency, jitter=args.jitter, timeScale=args.timescale)
+        (host, port)=server.server_address
+    results={'metadata':{'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'), 'python':platform.python_version(),
+                         'numpy':np.__version__, 'platform':platform.platform(), 'transport':args.transport,
+                         'host':host, 'simulated':server is not None, 'latency':args.latency, 'jitter':args.jitter,
+                         'timescale':args.timescale, 'trace_format':args.format}}
+    if args.startup_only:
+        try:
+            results['startup']=benchStartup(host, port, args.repeats, args.transport)
+        finally:
+            if server is not None:
+                server.shutdown()
+        return results
+    osa=AQ6380Controls(host, port=str(port), traceFormat=args.format, transport=args.transport)
+    osa.open()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            print('Command latency')
+            results['latency']=benchLatency(osa, args.iterations)
+            print('Sweep loop')
+            osa.sendSCPI(':sens:swe:poin:auto on')
+            results['sweep_loop']=benchSweepLoop(osa, args.sweeps, directory)
+            print(f"{results['sweep_loop']['sweeps_per_minute']:.1f} sweeps per minute")
+            results['trace_transfer']=benchTraceTransfer(osa, args.points, args.formats, args.repeats)
+            print('Multiple traces')
+            results['multi_trace']=benchMultiTrace(osa, args.repeats)
+            print('Transports')
+            results['transports']=benchTransports(host, port, args.transports, args.points, args.iterations, args.repeats)
+            print('Parsing')
+            results['parse']=benchParse(args.points, args.repeats)
+            print('Export')
+            results['csv_export']=benchCsvExport(args.points, args.repeats, directory)
+            print('Startup')
+            results['startup']=benchStartup(host, port, args.repeats, args.transport)
+    finally:
+        osa.close()
+        if server is not None:
+            server.shutdown()
+    return results
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='AQ6380Controls throughput and latency benchmarks')
+    parser.add_argument('--host', default=None, help='OSA address; a local simulator is started if not given')
+    parser.add_argument('--port', default='10001', help='OSA port')
+    parser.add_argument('--csv', default=simcsv if os.path.exists(simcsv) else None, help='Simulator spectrum CSV file')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulator response latency (s)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Simulator response jitter (s)')
+    parser.add_argument('--timescale', type=float, default=0.01, help='Simulator sweep time multiplier')
+    parser.add_argument('--transport', default='pyvisa', choices=transports, help='Transport for the other measurements')
+    parser.add_argument('--transports', nargs='+', default=transports, choices=transports, help='Transports to compare')
+    parser.add_argument('--format', default='REAL64', choices=traceFormats, help='Trace format for the sweep loop')
+    parser.add_argument('--formats', nargs='+', default=traceFormats, choices=traceFormats, help='Trace formats to compare')
+    parser.add_argument('--points', nargs='+', type=int, default=defaultPoints, help='Trace sizes to compare')
+    parser.add_argument('--iterations', type=int, default=200, help='Commands per latency measurement')
+    parser.add_argument('--sweeps', type=int, default=20, help='Sweeps in the sweep loop measurement')
+    parser.add_argument('--repeats', type=int, default=5, help='Repeats per transfer, parse and export measurement')
+    parser.add_argument('--output', default=defaultOutput, help='JSON results file')
+    parser.add_argument('--startup-only', action='store_true', help='Only run the startup benchmark')
+    args=parser.parse_args()
+    results=runBenchmarks(args)
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=2)
+    print(f'Results written to {args.output}')
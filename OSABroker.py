@@ -0,0 +1,442 @@
+"""OSABroker.py:
+Local broker that shares one signed in OSA connection between several tools
+The broker keeps one persistent connection per instrument and listens on a local port
+for each of them. Clients connect to that port with the same protocol as the OSA,
+i.e. AQ6380Controls('127.0.0.1', port='10101'); the open "user"/password handshake
+is answered by the broker without a round trip to the instrument.
+    Commands of all clients run one at a time in arrival order. A client waits for its
+        command to run before the next one is read, so every client gets a turn in each round.
+    The data format (:form:data) is kept per client and selected on the OSA before each
+        query in the format the client had selected at that point of its message, so clients
+        using ascii and binary transfers can be mixed.
+    Replies to read-only queries (traces, the wavelength axis, settings, :calc:cat ...;:calc:data?
+        peak and width analysis) are cached and shared between clients until any other command
+        is sent or cacheTTL seconds pass, so a monitor and an operator reading the same sweep
+        cause one download. Nothing is cached from an :init until the sweep is seen to complete
+        (*OPC? or the sweep bit of :stat:oper:even?), nor in repeat sweep mode.
+    A lost connection is reopened and signed in again on the next command, and by the
+        keep-alive check while idle.
+Clients share the instrument settings; a client that changes settings others rely on
+should be the only one sweeping. Waits on *OPC? hold the instrument for all clients.
+Depends on AQ6380Controls library
+Depends on numpy, and pyvisa, pyvisa-py for the 'pyvisa' transport
+To get dependencies,
+pip install numpy
+pip install pyvisa
+pip install pyvisa-py
+To run: python OSABroker.py [addresses] or py OSABroker.py [addresses] depending on system
+    Instruments listen on consecutive ports from --listen-port
+    Example: "python OSABroker.py 192.168.1.177 192.168.1.178 --listen-port 10101"
+"""
+import argparse
+import queue
+import socketserver
+import threading
+import time
+from AQ6380Controls import AQ6380Controls
+from OSAFleet import splitAddress
+from OSATransport import transports
+
+brokeraddr='127.0.0.1'#Address to listen on; local clients only
+brokerport=10101#First port to listen on
+cacheableQueries=[':trac:x?', ':trac:y?', ':trac:data:x?', ':trac:data:y?', ':trac:snum?', ':trac:act?',
+                  ':sens:wav:cent?', ':sens:wav:span?', ':sens:wav:star?', ':sens:wav:stop?',
+                  ':sens:band:res?', ':sens:band?', ':sens:sens?', ':sens:swe:spe?', '*idn?']#Read-only queries whose replies are shared
+analysisCommands=[':calc:cat', ':calc']#Analysis setup that may be cached with the :calc:data? query in the same message
+maxCacheEntries=64
+cacheTTL=1.0#Seconds a cached reply is shared; bounds staleness after sweeps started from the front panel
+sweepCommands=[':init', ':init:imm']#Start a sweep
+sweepModeCommands=[':init:smod', ':init:smode']#Single or repeat sweep mode
+
+def normalizeCommand(part):
+    """normalizeCommand: RETURNS: A command in lower case with single spaces, for comparison"""
+    return ' '.join(part.lower().split())
+
+def isCacheable(parts):
+    """isCacheable:
+    Checks if the reply to a message only depends on the last sweep and settings
+    INPUTS:
+    parts (list of str): The normalized commands of the message
+    RETURNS:
+    True if the reply can be shared until the next other command"""
+    analysis=False
+    for part in parts:
+        header=part.split(' ', 1)[0]
+        if header in analysisCommands:
+            analysis=analysis or header==':calc:cat'
+        elif header==':calc:data?':
+            if not analysis:#Result of an analysis selected in another message
+                return False
+        elif header not in cacheableQueries:
+            return False
+    return any(part.split(' ', 1)[0].endswith('?') for part in parts)
+
+def sweepState(parts, sweeping, repeating):
+    """sweepState:
+    Follows the sweep state through the commands of a message
+    INPUTS:
+    parts (list of str): The normalized commands of the message
+    sweeping (bool): A sweep was started and not seen to complete
+    repeating (bool): Repeat sweep mode is selected
+    RETURNS:
+    (sweeping, repeating) after the commands; *OPC? and :stat:oper:even? replies are handled by the caller"""
+    for part in parts:
+        (header, arg)=(part.split(' ', 1)+[''])[:2]
+        if header in sweepModeCommands:
+            repeating=arg.strip() in ('2', 'rep', 'repeat')
+        elif header in sweepCommands:
+            sweeping=True
+        elif header in (':abor', ':abort'):
+            (sweeping, repeating)=(False, False)
+    return (sweeping, repeating)
+
+def sweepCompleted(parts, isquery, reply):
+    """sweepCompleted:
+    Checks a reply for the end of a running sweep
+    INPUTS:
+    parts (list of str): The normalized commands of the message
+    isquery (list of bool): Which commands are queries
+    reply (bytes): The reply with terminator
+    RETURNS:
+    True if the message waited on *OPC? or :stat:oper:even? reports the sweep complete"""
+    headers=[part.split(' ', 1)[0] for (part, query) in zip(parts, isquery) if query]
+    if '*opc?' in headers:#Answered once the sweep is done
+        return True
+    if ':stat:oper:even?' in headers:
+        try:
+            value=reply.rstrip(b'\r\n').split(b';')[headers.index(':stat:oper:even?')]
+            return int(float(value))&1==1
+        except (ValueError, IndexError):
+            return False
+    return False
+
+class BrokerRequest:
+    """class BrokerRequest:
+        A client message waiting for the instrument"""
+    def __init__(self, session, line):
+        """initialize:
+        INPUTS:
+            session (BrokerSession): The client
+            line (str): The message
+            """
+        self.session=session
+        self.line=line
+        self.reply=None
+        self.error=None
+        self.done=threading.Event()
+
+class BrokerSession:
+    """class BrokerSession:
+        State of one client connection"""
+    def __init__(self, name):
+        """initialize:
+        INPUTS:
+            name (str): The client address for messages
+            """
+        self.name=name
+        self.dataFormat='ascii'#Selected with :form:data, see BrokerInstrument.execute
+        self.commands=0
+
+class BrokerInstrument(threading.Thread):
+    """class BrokerInstrument:
+        Owns the connection to one OSA and runs client messages on it in arrival order"""
+    def __init__(self, address, port='10001', username='anonymous', password='aaa', transport='socket',
+                 timeout=120, keepalive=30, reconnectInterval=5):
+        """initialize:
+        INPUTS:
+            address (str), port (str, default '10001'): The OSA address
+            username (str, default 'anonymous'), password (str, default 'aaa'): The OSA sign in
+            transport (str, default 'socket'): Connection backend, see OSATransport
+            timeout (float, default 120): Reply timeout in seconds; long enough for *OPC? sweep waits
+            keepalive (float, default 30): Seconds idle before the connection is checked, 0 to never check
+            reconnectInterval (float, default 5): Seconds between attempts to reopen a lost connection
+            """
+        super().__init__(daemon=True)
+        self.osa=AQ6380Controls(address, port=port, username=username, password=password, transport=transport)
+        self.timeout=timeout
+        self.keepalive=keepalive
+        self.reconnectInterval=reconnectInterval
+        self.requests=queue.Queue()
+        self.cache={}#(message, data format of each query): (time.perf_counter() when stored, reply bytes)
+        self.sweeping=False#An :init was sent and the sweep was not seen to complete
+        self.repeating=False#Repeat sweep mode; traces change without commands
+        self.dataFormat=None#Format selected on the OSA, None if unknown
+        self.lastAttempt=None#time.perf_counter() of the last failed open
+        self.stats={'clients':0, 'commands':0, 'forwarded':0, 'hits':0, 'reconnects':0, 'errors':0}
+        self.lock=threading.Lock()
+
+    def submit(self, session, line):
+        """submit:
+        Runs a client message on the instrument and waits for it
+        INPUTS:
+        session (BrokerSession): The client
+        line (str): The message
+        RETURNS:
+        The reply bytes with terminator, None if the message has no query
+        Throws exception if the OSA cannot run the message"""
+        request=BrokerRequest(session, line)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.reply
+
+    def stop(self):
+        """stop: Stops the instrument thread and closes the connection"""
+        self.requests.put(None)
+
+    def run(self):
+        """run: Instrument thread; runs messages in arrival order and checks the connection while idle"""
+        self.checkConnection()#Sign in before the first client needs it
+        while True:
+            try:
+                request=self.requests.get(timeout=self.keepalive or None)
+            except queue.Empty:
+                self.checkConnection()
+                continue
+            if request is None:
+                self.osa.close()
+                return
+            try:
+                request.reply=self.execute(request.session, request.line)
+            except Exception as e:
+                request.error=e
+                with self.lock:
+                    self.stats['errors']+=1
+            request.done.set()
+
+    def execute(self, session, line):
+        """execute:
+        Runs one client message, from the cache when possible
+        INPUTS:
+        session (BrokerSession): The client
+        line (str): The message
+        RETURNS:
+        The reply bytes with terminator, None if the message has no query"""
+        session.commands+=1
+        (forwarded, formats)=([], [])
+        for part in line.split(';'):
+            part=part.strip()
+            normalized=normalizeCommand(part)
+            if normalized.startswith(':form:data '):#Kept per client; selected before its next query
+                session.dataFormat=normalized[len(':form:data '):].replace(' ', '')
+            elif part:
+                forwarded.append(part)
+                formats.append(session.dataFormat)#Format in effect for this command
+        with self.lock:
+            self.stats['commands']+=1
+        if not forwarded:
+            return None
+        parts=[normalizeCommand(part) for part in forwarded]
+        isquery=[part.split(' ', 1)[0].endswith('?') for part in parts]
+        key=None
+        if isCacheable(parts) and not (self.sweeping or self.repeating):
+            key=(';'.join(parts), tuple(fmt for (fmt, query) in zip(formats, isquery) if query))
+            entry=self.cache.get(key)
+            if entry is not None and time.perf_counter()-entry[0]<cacheTTL:
+                with self.lock:
+                    self.stats['hits']+=1
+                return entry[1]
+        else:#May change the trace or settings, or is a status query
+            self.cache.clear()
+        (self.sweeping, self.repeating)=sweepState(parts, self.sweeping, self.repeating)
+        reply=self.forward(forwarded, formats, isquery)
+        if self.sweeping and reply is not None:
+            self.sweeping=not sweepCompleted(parts, isquery, reply)
+        if key is not None:
+            if len(self.cache)>=maxCacheEntries:
+                del self.cache[next(iter(self.cache))]#Oldest entry
+            self.cache[key]=(time.perf_counter(), reply)
+        return reply
+
+    def forward(self, forwarded, formats, isquery):
+        """forward:
+        Sends a message to the OSA, reopening the connection and retrying once if it was lost
+        INPUTS:
+        forwarded (list of str): The commands of the message without data format commands
+        formats (list of str): The client's data format in effect for each command
+        isquery (list of bool): Which commands are queries; their replies are ';' separated
+        RETURNS:
+        The reply bytes with terminator, None if there is no query"""
+        queries=sum(isquery)
+        for attempt in range(2):
+            self.ensureConnected()
+            timeoutErrors=self.osa.osa.timeoutErrors
+            try:
+                with self.lock:
+                    self.stats['forwarded']+=1
+                if queries==0:
+                    self.osa.write(';'.join(forwarded))
+                    return None
+                (cmds, selected)=([], self.dataFormat)
+                for (part, fmt, query) in zip(forwarded, formats, isquery):
+                    if query and fmt!=selected:#Select the client's format for this query
+                        cmds.append(f':form:data {fmt}')
+                        selected=fmt
+                    cmds.append(part)
+                self.dataFormat=None#Unknown until the reply arrives
+                replies=self.osa.queryBlocks(cmds, queries)
+                self.dataFormat=selected
+            except Exception as e:#The reply stream may be out of step; start a new session
+                self.disconnect()
+                if attempt>0 or isinstance(e, timeoutErrors):#Do not wait out a timeout twice
+                    raise
+                print(f'{self.osa.address}: connection lost ({e}), reconnecting')
+                continue
+            parts=[]
+            for data in replies:
+                if isinstance(data, str):
+                    parts.append(data.encode('ascii'))
+                else:
+                    length=str(len(data)).encode('ascii')
+                    parts.append(b'#'+str(len(length)).encode('ascii')+length+bytes(data))
+            return b';'.join(parts)+b'\n'
+
+    def ensureConnected(self):
+        """ensureConnected:
+        Opens and signs in to the OSA if the connection is not open
+        Throws ConnectionError if the OSA cannot be reached"""
+        if self.osa.connected:
+            return
+        now=time.perf_counter()
+        if self.lastAttempt is not None and now-self.lastAttempt<self.reconnectInterval:
+            raise ConnectionError(f'OSA {self.osa.address} is not reachable')
+        try:
+            self.osa.open()
+        except Exception as e:
+            self.lastAttempt=now
+            raise ConnectionError(f'OSA {self.osa.address} is not reachable: {e}')
+        self.osa.osa.timeout=self.timeout*1000
+        self.lastAttempt=None
+        self.dataFormat=None
+        self.cache.clear()
+        with self.lock:
+            self.stats['reconnects']+=1
+
+    def disconnect(self):
+        """disconnect: Closes the connection after an error; it is reopened on the next command"""
+        try:
+            self.osa.close()
+        except Exception:
+            self.osa.connected=False
+        self.dataFormat=None
+        self.cache.clear()
+
+    def checkConnection(self):
+        """checkConnection: Keep-alive while idle; reopens a lost connection before a client needs it"""
+        try:
+            self.ensureConnected()
+            self.osa.query('*OPC?')
+        except Exception as e:
+            print(f'{self.osa.address}: keep-alive failed ({e})')
+            self.disconnect()
+
+    def snapshot(self):
+        """snapshot:
+        Gets the broker counters
+        RETURNS:
+        A dict with clients (connected now), commands (from clients), forwarded (sent to the OSA),
+        hits (replies from the cache), reconnects and errors"""
+        with self.lock:
+            return dict(self.stats)
+
+class OSABrokerHandler(socketserver.StreamRequestHandler):
+    """class OSABrokerHandler:
+        Handles one client connection"""
+    rbufsize=1<<16
+    def handle(self):
+        """handle: Answers the login handshake and then passes messages to the instrument until the client disconnects"""
+        instrument=self.server.instrument
+        session=BrokerSession(f'{self.client_address[0]}:{self.client_address[1]}')
+        with instrument.lock:
+            instrument.stats['clients']+=1
+        try:
+            username=None
+            authenticated=False
+            while True:
+                line=self.rfile.readline()
+                if not line:#Client disconnected
+                    return
+                line=line.decode('ascii', errors='replace').strip()
+                if not authenticated:#Login handshake; the broker is already signed in to the OSA
+                    if username is None and line.lower().startswith('open'):
+                        username=line[4:].strip().strip('"')
+                        self.wfile.write(b'AUTHENTICATE CRAM-MD5.\n')
+                    elif username is not None:
+                        authenticated=True
+                        self.wfile.write(b'ready\n')
+                    continue
+                try:
+                    reply=instrument.submit(session, line)
+                except Exception as e:#Drop the client so it does not wait for a reply that will not come
+                    print(f'{session.name}: {line} failed: {e}')
+                    return
+                if reply is not None:
+                    self.wfile.write(reply)
+        finally:
+            with instrument.lock:
+                instrument.stats['clients']-=1
+
+class OSABrokerServer(socketserver.ThreadingTCPServer):
+    """class OSABrokerServer:
+        Threaded TCP server for the clients of one instrument"""
+    allow_reuse_address=True
+    daemon_threads=True
+    def __init__(self, instrument, address=brokeraddr, port=brokerport):
+        """initialize:
+        INPUTS:
+            instrument (BrokerInstrument): The instrument
+            address (str, default brokeraddr): The address to listen on
+            port (int, default brokerport): The port to listen on, 0 for any free port
+            """
+        self.instrument=instrument
+        super().__init__((address, int(port)), OSABrokerHandler)
+
+def startBroker(address, port='10001', listenAddress=brokeraddr, listenPort=0, **kwargs):
+    """startBroker:
+    Starts a broker for one instrument in background threads
+    INPUTS:
+    address (str), port (str, default '10001'): The OSA address
+    listenAddress (str, default brokeraddr): The address to listen on
+    listenPort (int, default 0): The port to listen on, 0 for any free port
+    kwargs: Other BrokerInstrument options (username, password, transport, timeout, keepalive, reconnectInterval)
+    RETURNS:
+    The running OSABrokerServer; its port is server.server_address[1]
+    Call stopBroker(server) to stop it"""
+    instrument=BrokerInstrument(address, port, **kwargs)
+    instrument.start()
+    server=OSABrokerServer(instrument, listenAddress, listenPort)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def stopBroker(server):
+    """stopBroker: Stops a broker started with startBroker and closes its OSA connection"""
+    server.shutdown()
+    server.server_close()
+    server.instrument.stop()
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Shares OSA connections between local tools')
+    parser.add_argument('addresses', nargs='*', default=['192.168.1.177'], help='OSA addresses as ip or ip:port')
+    parser.add_argument('--host', default=brokeraddr, help='Address to listen on')
+    parser.add_argument('--listen-port', type=int, default=brokerport, help='Port of the first OSA; the others follow')
+    parser.add_argument('--transport', default='socket', choices=transports, help='Connection backend')
+    parser.add_argument('--username', default='anonymous', help='OSA username')
+    parser.add_argument('--password', default='aaa', help='OSA password')
+    parser.add_argument('--timeout', type=float, default=120, help='OSA reply timeout (s)')
+    parser.add_argument('--keepalive', type=float, default=30, help='Idle seconds between connection checks, 0 for none')
+    args=parser.parse_args()
+    servers=[]
+    for (idx, address) in enumerate(args.addresses):
+        (ip, port)=splitAddress(address)
+        servers.append(startBroker(ip, port, args.host, args.listen_port+idx, username=args.username, password=args.password,
+                                   transport=args.transport, timeout=args.timeout, keepalive=args.keepalive))
+        print(f'{ip}:{port} shared on {args.host}:{args.listen_port+idx}')
+    try:
+        while True:
+            time.sleep(60)
+            for server in servers:
+                print(f'{server.instrument.osa.address}: {server.instrument.snapshot()}')
+    except KeyboardInterrupt:
+        for server in servers:
+            stopBroker(server)
@@ -1,23 +1,30 @@
 """OSACommandLine.py:
 A Simple Command-line interface for the AQ6380 OSA
-Depends on AQ6380Controls library
+Depends on AQ6380Controls and OSAExport libraries
 Depends on pyvisa
 Depends on pyvisa-py as visa interface
+Depends on numpy
 To get dependencies,
 pip install pyvisa
 pip install pyvisa-py
+pip install numpy
 To run: python OSACommandLine.py or py OSACommandLine.py depending on system
 """
-from AQ6380Controls import AQ6380Controls, sensitivities
+from AQ6380Controls import AQ6380Controls, sensitivities, traceFormats, analysisCategories
+from OSAExport import saveTrace
 
 cmdlist="""Command list:
+ANALYZE [peak width power smsr]: Gets instrument analysis results of the last sweep in one query
+    Example: "ANALYZE peak smsr"
 CENTER val: Sets the center in nm
     Example:  "CENTER 1608"
+FORMAT ASCII, REAL64 or REAL32: Sets the trace transfer format
+    Example: "FORMAT REAL32"
 PEAKWLEN: Gets peak wavelength
 PEAKPOWER: Gets peak power
 RES val (in nm)
     Example: "RES 0.005"
-SAVE Filename: Gets data and saves to filename as csv
+SAVE Filename: Gets data and saves to filename; .csv, .npy, .npz or .aqb by extension
     Example: "SAVE testres.csv"
 SCPI CMD: Sends a SCPI command to the OSA
     Example: "SCPI :calc:mark:max"
@@ -34,8 +41,10 @@ Commands are not case sensitive
 """
 
 osaaddr='192.168.1.177'#Set OSA Address
+osaport='10001'#OSA port; the OSABroker.py port (i.e. '10101') shares one connection with other tools
+traceformat='REAL64'#Trace transfer format: ASCII, REAL64 or REAL32
 if __name__=='__main__':
-    osa=AQ6380Controls(osaaddr)
+    osa=AQ6380Controls(osaaddr, port=osaport, traceFormat=traceformat)
     osa.open()#Open connection to OSA
     while True:
         cmd=input('Enter Command: ')#Obtain command and split it
@@ -54,10 +63,20 @@ if __name__=='__main__':
         elif basecmd=='RES':
             #Set Resolution in nm
             resolutionval=splitcmd[1]
-            osa.setResolution(resolutionval)
+            try:
+                osa.setResolution(resolutionval)
+            except ValueError:#Already printed
+                pass
         elif basecmd=='SPEED':
             #Set Speed 1x or 2x
             osa.setSweepSpeed(splitcmd[1])
+        elif basecmd=='FORMAT':
+            #Set trace transfer format
+            formatval=splitcmd[1].upper()
+            if formatval not in traceFormats:#Invalid format
+                print(f'Format of {formatval} is invalid')
+            else:
+                osa.setTraceFormat(formatval)
         elif basecmd=='CENTER':
             #Set center (nm)
             osa.setCenter(splitcmd[1])
@@ -73,6 +92,14 @@ if __name__=='__main__':
         elif basecmd=='PEAKPOWER':
             #Get Peak Power
             print(osa.getPeakPower())
+        elif basecmd=='ANALYZE':
+            #Get analysis results, all analyses if none are given
+            categories=[name.lower() for name in splitcmd[1:]] or list(analysisCategories)
+            try:
+                for (field, value) in osa.analyze(categories).asDict().items():
+                    print(f'{field}: {value}')
+            except ValueError as e:
+                print(e)
         elif basecmd=='SCPI':
             #SCPI Command
             scpicmd=' '.join(splitcmd[1:])
@@ -81,11 +108,10 @@ if __name__=='__main__':
             #Save trace as CSV to file
             (xvals, yvals)=osa.getTraceVals()
             filename=splitcmd[1]
-            with open(filename, 'w') as fp:
-                #Open file
-                for idx in range(len(xvals)):
-                    #Save CSV line by line
-                    fp.write(f'{xvals[idx]},{yvals[idx]}\n')
+            try:
+                saveTrace(filename, xvals, yvals)#Save whole trace at once in the format of the extension
+            except ValueError as e:
+                print(e)
         elif basecmd=='EXIT':
             #Exit application
             exit(0)
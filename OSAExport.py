@@ -0,0 +1,259 @@
+"""OSAExport.py:
+Saves and loads traces in bulk from numpy arrays
+Formats, chosen by file extension:
+    .csv: Two column wavelength, amplitude text, the layout of test1.csv
+    .npy: numpy array of shape (points, 2)
+    .npz: numpy archive with 'x' and 'y' arrays, optionally compressed
+    .aqb: Compact binary; a 48 byte header and float32/float64 amplitudes. Evenly spaced
+          wavelengths are stored as start and stop only. The data can be zlib compressed.
+CSV values are written with the shortest repr that reads back exactly, or with a fixed
+number of decimals. CSV files are read with np.loadtxt after any header lines; '#' comment
+lines (i.e. the sweep headers of OSATraceWriter append files) are skipped.
+Depends on numpy
+To get dependencies,
+pip install numpy
+To run: python OSAExport.py input output or py OSAExport.py input output depending on system
+    Converts a trace file to the format of the output file extension
+    Example: "python OSAExport.py test1.csv test1.aqb"
+"""
+import io
+import os
+import struct
+import sys
+import zlib
+import numpy as np
+
+exportFormats=['csv', 'npy', 'npz', 'aqb']
+binaryMagic=b'AQTRACEB'
+binaryHeaderFormat='<8sB2sBIdd4x'#magic, version, dtype ('f4' or 'f8'), flags, points, start, stop
+binaryHeaderSize=struct.calcsize(binaryHeaderFormat)
+binaryCompressed=1#Flag: data is zlib compressed
+binaryStoreX=2#Flag: wavelengths are stored, not only start and stop
+csvChunkPoints=65536#Points formatted per write
+
+def exportFormat(filename, fmt=None):
+    """exportFormat:
+    Gets the export format of a file
+    INPUTS:
+    filename (str): The file name
+    fmt (str, default None): The format, None to take it from the extension
+    RETURNS:
+    The format, one of exportFormats
+    Throws exception if the format is unknown"""
+    if fmt is None:
+        fmt=os.path.splitext(filename)[1].lstrip('.').lower()
+    if fmt not in exportFormats:
+        raise ValueError(f'Export format of {fmt} is invalid, use one of {exportFormats}')
+    return fmt
+
+def formatCsv(xvals, yvals, precision=None):
+    """formatCsv:
+    Formats a trace as CSV lines of x,y in one pass
+    INPUTS:
+    xvals, yvals (numpy array or list): The trace
+    precision (int or (int, int), default None): Decimals for x and y, None for the shortest exact repr
+    RETURNS:
+    The CSV text (str)"""
+    xvals=np.asarray(xvals)
+    yvals=np.asarray(yvals)
+    if len(xvals)==0:
+        return ''
+    if isinstance(precision, (tuple, list)):
+        (xprecision, yprecision)=precision
+    else:
+        (xprecision, yprecision)=(precision, precision)
+    columns=[]
+    codes=[]
+    for (vals, digits) in ((xvals, xprecision), (yvals, yprecision)):
+        if digits is not None:
+            columns.append(vals.astype(np.float64).tolist())
+            codes.append(f'%.{int(digits)}f')
+        elif vals.dtype==np.float32:#Shortest float32 repr, i.e. -64.28702 instead of -64.28702545166016
+            columns.append(vals.astype(str).tolist())
+            codes.append('%s')
+        else:
+            columns.append(vals.astype(np.float64).tolist())
+            codes.append('%r')
+    interleaved=[None]*(2*len(xvals))
+    interleaved[0::2]=columns[0]
+    interleaved[1::2]=columns[1]
+    return (f'{codes[0]},{codes[1]}\n'*len(xvals))%tuple(interleaved)
+
+def writeCsv(fp, xvals, yvals, precision=None):
+    """writeCsv:
+    Writes a trace as CSV to an open text file in large chunks
+    INPUTS:
+    fp (file): The file, opened for text writing
+    xvals, yvals (numpy array or list): The trace
+    precision (int or (int, int), default None): Decimals for x and y, None for the shortest exact repr
+    RETURNS:
+    The number of characters written"""
+    written=0
+    for start in range(0, len(xvals), csvChunkPoints):
+        written+=fp.write(formatCsv(xvals[start:start+csvChunkPoints], yvals[start:start+csvChunkPoints], precision))
+    return written
+
+def isCsvHeader(line):
+    """isCsvHeader:
+    Checks if a line ahead of the data is a header, i.e. a blank line, a '#' comment or a
+    row whose first field is not a number; nan and inf are numbers
+    INPUTS:
+    line (str): The line
+    RETURNS:
+    True if the line is a header"""
+    field=line.split('#', 1)[0].split(',', 1)[0].strip()
+    if not field:
+        return True
+    try:
+        float(field)
+    except ValueError:
+        return True
+    return False
+
+def parseCsv(text):
+    """parseCsv:
+    Parses two column CSV text; header lines ahead of the first numeric row are skipped and
+    the rest is parsed with np.loadtxt, which skips blank lines and '#' comments
+    INPUTS:
+    text (str): The CSV text
+    RETURNS:
+    (xvals, yvals) float64 numpy arrays
+    Throws exception if a row does not have two numeric columns"""
+    start=0
+    while start<len(text):
+        end=text.find('\n', start)
+        end=len(text) if end<0 else end+1
+        if not isCsvHeader(text[start:end]):
+            break
+        start=end
+    if start>=len(text):#Only headers
+        return (np.zeros(0), np.zeros(0))
+    try:
+        values=np.loadtxt(io.StringIO(text[start:]), dtype=np.float64, delimiter=',', comments='#', ndmin=2)
+    except ValueError as e:
+        raise ValueError(f'CSV data is not two numeric columns: {e}') from None
+    if values.shape[1]!=2:
+        raise ValueError(f'CSV data has {values.shape[1]} columns, not 2')
+    return (values[:, 0], values[:, 1])
+
+def isEvenlySpaced(xvals):
+    """isEvenlySpaced:
+    Checks if wavelengths can be rebuilt from start and stop to within float64 rounding
+    INPUTS:
+    xvals (numpy array): The wavelengths
+    RETURNS:
+    True if evenly spaced"""
+    if len(xvals)<2:
+        return len(xvals)==1
+    rebuilt=np.linspace(xvals[0], xvals[-1], len(xvals))
+    tolerance=8*np.finfo(np.float64).eps*float(np.max(np.abs(xvals)))
+    return bool(np.max(np.abs(rebuilt-xvals))<=tolerance)
+
+def encodeBinary(xvals, yvals, dtype='f4', compress=False):
+    """encodeBinary:
+    Encodes a trace in the compact binary format
+    INPUTS:
+    xvals, yvals (numpy array): The trace
+    dtype (str, default 'f4'): Amplitude storage, 'f4' or 'f8'
+    compress (bool, default False): zlib compress the data
+    RETURNS:
+    The encoded trace (bytes)
+    Throws exception if dtype is invalid"""
+    if dtype not in ('f4', 'f8'):
+        raise ValueError(f'Binary dtype of {dtype} is invalid')
+    xvals=np.asarray(xvals, dtype=np.float64)
+    yvals=np.asarray(yvals)
+    flags=0
+    data=yvals.astype('<'+dtype).tobytes()
+    if not isEvenlySpaced(xvals):
+        flags|=binaryStoreX
+        data=xvals.astype('<f8').tobytes()+data
+    if compress:
+        flags|=binaryCompressed
+        data=zlib.compress(data)
+    (start, stop)=(float(xvals[0]), float(xvals[-1])) if len(xvals) else (0.0, 0.0)
+    header=struct.pack(binaryHeaderFormat, binaryMagic, 1, dtype.encode('ascii'), flags, len(yvals), start, stop)
+    return header+data
+
+def decodeBinary(data):
+    """decodeBinary:
+    Decodes a trace in the compact binary format
+    INPUTS:
+    data (bytes): The encoded trace
+    RETURNS:
+    (xvals, yvals) numpy arrays
+    Throws exception if the header is invalid"""
+    (magic, version, dtype, flags, points, start, stop)=struct.unpack_from(binaryHeaderFormat, data)
+    if magic!=binaryMagic:
+        raise ValueError('Not a binary trace file')
+    payload=data[binaryHeaderSize:]
+    if flags&binaryCompressed:
+        payload=zlib.decompress(payload)
+    ydtype=np.dtype('<'+dtype.decode('ascii'))
+    if flags&binaryStoreX:
+        xvals=np.frombuffer(payload, dtype='<f8', count=points)
+        yvals=np.frombuffer(payload, dtype=ydtype, count=points, offset=8*points)
+    else:
+        xvals=np.linspace(start, stop, points)
+        yvals=np.frombuffer(payload, dtype=ydtype, count=points)
+    return (xvals, yvals)
+
+def saveTrace(filename, xvals, yvals, fmt=None, precision=None, compress=False, dtype='f8'):
+    """saveTrace:
+    Saves a trace; the format is taken from the file extension unless given
+    INPUTS:
+    filename (str): The file
+    xvals, yvals (numpy array or list): The trace
+    fmt (str, default None): 'csv', 'npy', 'npz' or 'aqb', None for the extension
+    precision (int or (int, int), default None): CSV decimals for x and y, None for the shortest exact repr
+    compress (bool, default False): Compress npz and aqb files
+    dtype (str, default 'f8'): aqb amplitude storage, 'f4' or 'f8'
+    RETURNS:
+    The number of bytes written
+    Throws exception if the format is unknown"""
+    fmt=exportFormat(filename, fmt)
+    xvals=np.asarray(xvals)
+    yvals=np.asarray(yvals)
+    if fmt=='csv':
+        with open(filename, 'w', buffering=1<<20) as fp:
+            writeCsv(fp, xvals, yvals, precision)
+    elif fmt=='npy':
+        with open(filename, 'wb') as fp:#File object so np.save does not add an extension
+            np.save(fp, np.column_stack((xvals, yvals)))
+    elif fmt=='npz':
+        with open(filename, 'wb') as fp:
+            (np.savez_compressed if compress else np.savez)(fp, x=xvals, y=yvals)
+    else:
+        with open(filename, 'wb') as fp:
+            fp.write(encodeBinary(xvals, yvals, dtype, compress))
+    return os.path.getsize(filename)
+
+def loadTrace(filename, fmt=None):
+    """loadTrace:
+    Loads a trace saved by saveTrace or a CSV file such as test1.csv
+    INPUTS:
+    filename (str): The file
+    fmt (str, default None): 'csv', 'npy', 'npz' or 'aqb', None for the extension
+    RETURNS:
+    (xvals, yvals) numpy arrays
+    Throws exception if the format is unknown"""
+    fmt=exportFormat(filename, fmt)
+    if fmt=='csv':
+        with open(filename, 'r') as fp:
+            return parseCsv(fp.read())
+    if fmt=='npy':
+        values=np.load(filename)
+        return (values[:, 0], values[:, 1])
+    if fmt=='npz':
+        with np.load(filename) as archive:
+            return (archive['x'], archive['y'])
+    with open(filename, 'rb') as fp:
+        return decodeBinary(fp.read())
+
+if __name__=='__main__':
+    if len(sys.argv)<3:
+        print('Usage: python OSAExport.py input output')
+        sys.exit(1)
+    (xvals, yvals)=loadTrace(sys.argv[1])
+    nbytes=saveTrace(sys.argv[2], xvals, yvals)
+    print(f'{len(xvals)} points written to {sys.argv[2]} ({nbytes} bytes)')
@@ -0,0 +1,237 @@
+"""OSAFleet.py:
+Controls several AQ63xx OSAs of a test station in parallel
+Opens and authenticates all instruments at once and runs configure, sweep and fetch
+jobs concurrently on a worker pool, one job at a time per instrument.
+Results are returned as each instrument finishes, so a station cycle takes as long
+as the slowest instrument instead of the sum of all of them.
+Depends on AQ6380Controls library
+Depends on pyvisa, pyvisa-py, numpy
+To get dependencies,
+pip install pyvisa
+pip install pyvisa-py
+pip install numpy
+To run: python OSAFleet.py or py OSAFleet.py depending on system
+    Optional arguments: OSA addresses as ip or ip:port
+    Example: "python OSAFleet.py 192.168.1.177 192.168.1.178"
+"""
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from AQ6380Controls import AQ6380Controls
+
+osaaddrs=['192.168.1.177']#Change to the addresses of the station's OSAs
+
+def splitAddress(address, port='10001'):
+    """splitAddress:
+    Splits an 'ip' or 'ip:port' address
+    INPUTS:
+    address (str): The address
+    port (str, default '10001'): The port if the address has none
+    RETURNS:
+    (ip, port) as strings"""
+    if ':' in address:
+        (address, port)=address.rsplit(':', 1)
+    return (address.strip(), str(port))
+
+def acquire(osa, center=None, span=None, **settings):
+    """acquire:
+    Configure, sweep and fetch job for one OSA
+    INPUTS:
+    osa (AQ6380Controls): A connected OSA
+    center, span (str or float, default None): Sweep center and span in nm
+    settings: Other configure settings (sensitivity, speed, resolution)
+    RETURNS:
+    (xvals, yvals) trace
+    Throws exception if the sweep fails"""
+    osa.configure(center=center, span=span, **settings)
+    if not osa.singleSweep():
+        raise RuntimeError('Sweep failed')
+    return osa.getTraceVals()
+
+class OSAFleet:
+    """class OSAFleet:
+        A set of OSAs driven in parallel by a worker pool"""
+    def __init__(self, addresses, port='10001', username='anonymous', password='aaa', traceFormat='REAL64', maxWorkers=None):
+        """initialize:
+        INPUTS:
+            addresses (list of str): OSA addresses as 'ip' or 'ip:port'
+            port (str, default '10001'): The port of OSAs without a port in their address
+            username (str, default 'anonymous'): The username for sign in
+            password (str, default 'aaa'): The password for sign in
+            traceFormat (str, default 'REAL64'): Trace transfer format
+            maxWorkers (int, default None): Worker threads, None for one per OSA
+            Throws exception if an address is of an invalid format
+            """
+        self.osas={}#AQ6380Controls by address
+        self.locks={}#One job at a time per OSA
+        self.healthInfo={}
+        for address in addresses:
+            (ip, osaport)=splitAddress(address, port)
+            self.osas[address]=AQ6380Controls(ip, port=osaport, username=username, password=password, traceFormat=traceFormat)
+            self.locks[address]=threading.Lock()
+            self.healthInfo[address]={'healthy':False, 'connected':False, 'jobs':0, 'errors':0, 'lastError':None,
+                                      'lastLatency':None, 'totalLatency':0.0, 'lastSweepTiming':{}}
+        self.healthLock=threading.Lock()
+        self.pool=ThreadPoolExecutor(max_workers=maxWorkers or max(1, len(addresses)))
+
+    def runJob(self, address, func, args, kwargs):
+        """runJob:
+        Runs a job on one OSA in a worker thread and records health and latency
+        INPUTS:
+        address (str): The OSA address
+        func (function): Called as func(osa, *args, **kwargs)
+        args (tuple), kwargs (dict): The arguments
+        RETURNS:
+        A dict with 'address', 'result', 'error' (None or the exception) and 'elapsed' in seconds"""
+        osa=self.osas[address]
+        with self.locks[address]:
+            t0=time.perf_counter()
+            try:
+                result=func(osa, *args, **kwargs)
+                error=None
+            except Exception as e:
+                result=None
+                error=e
+            elapsed=time.perf_counter()-t0
+        with self.healthLock:
+            info=self.healthInfo[address]
+            info['jobs']+=1
+            info['lastLatency']=elapsed
+            info['totalLatency']+=elapsed
+            info['connected']=osa.connected
+            info['lastSweepTiming']=dict(osa.lastSweepTiming)
+            if error is not None:
+                info['errors']+=1
+                info['lastError']=str(error)
+        return {'address':address, 'result':result, 'error':error, 'elapsed':elapsed}
+
+    def submit(self, address, func, *args, **kwargs):
+        """submit:
+        Submits a job for one OSA to the worker pool
+        INPUTS:
+        address (str): The OSA address
+        func (function): Called as func(osa, *args, **kwargs)
+        RETURNS:
+        A concurrent.futures.Future with the runJob result dict"""
+        return self.pool.submit(self.runJob, address, func, args, kwargs)
+
+    def runAll(self, func, *args, addresses=None, **kwargs):
+        """runAll:
+        Runs a job on every OSA and yields results as each one finishes
+        INPUTS:
+        func (function): Called as func(osa, *args, **kwargs)
+        addresses (list of str, default None): The OSAs to use, None for all healthy ones (see available)
+        RETURNS:
+        A generator of runJob result dicts in completion order"""
+        if addresses is None:
+            addresses=self.available()
+        futures=[self.submit(address, func, *args, **kwargs) for address in addresses]
+        for future in as_completed(futures):
+            yield future.result()
+
+    def openAll(self, addresses=None):
+        """openAll:
+        Opens and authenticates all OSAs in parallel
+        OSAs that fail are marked unhealthy and left out of later jobs until they open
+        INPUTS:
+        addresses (list of str, default None): The OSAs to open, None for all
+        RETURNS:
+        A dict of address to None if opened or the exception if it failed"""
+        if addresses is None:
+            addresses=list(self.osas)
+        errors={r['address']:r['error'] for r in self.runAll(lambda osa: osa.open(), addresses=addresses)}
+        with self.healthLock:
+            for (address, error) in errors.items():
+                self.healthInfo[address]['healthy']=error is None
+        return errors
+
+    def available(self):
+        """available:
+        Gets the OSAs that opened, see openAll
+        RETURNS:
+        The healthy addresses (list of str) in fleet order"""
+        with self.healthLock:
+            return [address for address in self.osas if self.healthInfo[address]['healthy']]
+
+    def configureAll(self, **settings):
+        """configureAll:
+        Configures all OSAs in parallel, see AQ6380Controls.configure
+        RETURNS:
+        A generator of runJob result dicts in completion order"""
+        return self.runAll(lambda osa: osa.configure(**settings))
+
+    def sweepAll(self, center=None, span=None):
+        """sweepAll:
+        Runs a single sweep on all OSAs in parallel
+        INPUTS:
+        center, span (str, default None): Sweep center and span in nm
+        RETURNS:
+        A generator of runJob result dicts in completion order, result is True if the sweep succeeded"""
+        return self.runAll(lambda osa: osa.singleSweep(center, span))
+
+    def fetchAll(self):
+        """fetchAll:
+        Downloads the trace of all OSAs in parallel
+        RETURNS:
+        A generator of runJob result dicts in completion order, result is (xvals, yvals)"""
+        return self.runAll(lambda osa: osa.getTraceVals())
+
+    def acquireAll(self, **settings):
+        """acquireAll:
+        Configures, sweeps and fetches on all OSAs in parallel, see acquire
+        INPUTS:
+        settings: center, span, sensitivity, speed, resolution
+        RETURNS:
+        A generator of runJob result dicts in completion order, result is (xvals, yvals)"""
+        return self.runAll(acquire, **settings)
+
+    def pingAll(self):
+        """pingAll:
+        Sends *IDN? to all OSAs in parallel to update health and latency
+        RETURNS:
+        A dict of address to runJob result dict"""
+        return {r['address']:r for r in self.runAll(lambda osa: osa.query('*IDN?'))}
+
+    def health(self):
+        """health:
+        Gets a snapshot of per OSA health
+        RETURNS:
+        A dict of address to dict with 'healthy', 'connected', 'jobs', 'errors', 'lastError',
+        'lastLatency', 'meanLatency' (seconds) and 'lastSweepTiming'"""
+        with self.healthLock:
+            snapshot={}
+            for (address, info) in self.healthInfo.items():
+                snapshot[address]=dict(info)
+                snapshot[address]['meanLatency']=info['totalLatency']/info['jobs'] if info['jobs'] else None
+                del snapshot[address]['totalLatency']
+            return snapshot
+
+    def closeAll(self):
+        """closeAll: Closes all OSAs and stops the worker pool"""
+        for (address, osa) in self.osas.items():
+            with self.locks[address]:
+                try:
+                    osa.close()
+                except Exception as e:
+                    print(f'Error closing {address}: {e}')
+        self.pool.shutdown()
+
+if __name__=='__main__':
+    addresses=sys.argv[1:] if len(sys.argv)>1 else osaaddrs
+    fleet=OSAFleet(addresses)
+    for (address, error) in fleet.openAll().items():
+        print(f'{address}: {"opened" if error is None else f"failed: {error}"}')
+    try:
+        while True:
+            t0=time.perf_counter()
+            for r in fleet.acquireAll():
+                if r['error'] is not None:
+                    print(f"{r['address']}: error {r['error']}")
+                else:
+                    print(f"{r['address']}: {len(r['result'][0])} points in {r['elapsed']:.3f} s")
+            print(f'Station cycle {time.perf_counter()-t0:.3f} s')
+    except KeyboardInterrupt:
+        for (address, info) in fleet.health().items():
+            print(address, info)
+        fleet.closeAll()
@@ -1,10 +1,16 @@
 """OSAGUIv2.py
 A GUI interface for the AQ6380 OSA that includes graphing
-Depends on AQ6380Controls library
-Depends on pyvisa, pyvisa-py, and matplotlib
+The trace is shown in a live plot in the window (see OSAPlot); Repeat Sweep sweeps and plots continuously
+All OSA commands are queued to one I/O worker thread (see OSAWorker), so the window never blocks
+The address may be given as ip:port, i.e. 127.0.0.1:10101 to share the OSA through OSABroker.py
+The AUTO sensitivity picks the fastest sensitivity with a noise floor autoMargin dB below the peak,
+using sweep times learned from this session's sweeps (see OSASweepModel)
+Depends on AQ6380Controls, OSAFleet, OSAPlot, OSASweepModel, OSAWorker and OSAExport libraries
+Depends on pyvisa, pyvisa-py, numpy, and matplotlib
 To get dependencies,
 pip install pyvisa
 pip install pyvisa-py
+pip install numpy
 pip install matplotlib
 To run:
 python OSAGUIv2.py or py OSAGUIv2.py depending on system
@@ -12,18 +18,24 @@ This, along with the pip install commands should be done in a virtual environmen
 """
 import tkinter as tk
 from tkinter import ttk
-from tkinter.filedialog import asksaveasfile
+from tkinter.filedialog import asksaveasfilename
 from AQ6380Controls import *
-import time
+from OSAPlot import LivePlot
+from OSAWorker import OSAWorker
+from OSAExport import saveTrace
+from OSAFleet import splitAddress
+from OSASweepModel import SweepTimeModel, autoConfigure
 import threading
-import matplotlib.pyplot as plt
+import numpy as np
 
 #default TKinter Settings
 stickall='news'
 DEFAULT_PAD_X=5
 DEFAULT_PAD_Y=5
 
-osaBusy=threading.Event()#OSA Busy Event
+repeatSweep=threading.Event()#Set while repeat sweep mode runs
+readoutAnalyses=['peak', 'width', 'power', 'smsr']#Instrument analyses shown after a single sweep, see AQ6380Controls.analyze
+autoMargin=40#dB between the peak and the noise floor for the AUTO sensitivity
 
 def write_text_box(textbox, str):
     """write_text_box: Writes a string to a TKinter textbox
@@ -37,28 +49,35 @@ def write_text_box(textbox, str):
     textbox.update()#Force update text box
     textbox.config(state=tk.DISABLED)#Write disable text box
     
+def requireConnection(osa):
+    """requireConnection: Throws ConnectionError if the OSA is not connected
+    INPUTS:
+    osa (AQ6380Controls): The OSA"""
+    if not osa.connected:
+        raise ConnectionError('OSA Not Connected Error')
+
+def openOSA(osa, ipaddr):
+    """openOSA: Worker command that sets the OSA's IP address and opens it
+    INPUTS:
+    osa (AQ6380Controls): The OSA
+    ipaddr (str): The IP address, or ip:port"""
+    (ipaddr, port)=splitAddress(ipaddr)
+    osa.setAddress(ipaddr)
+    osa.port=port
+    osa.open()
+
 def connect_to_osa():
     """connect_to_osa: Retrieves inputs from GUI 
-    and tries to connect to OSA
-    Does not try to connect if OSA connection is busy"""
-    if osaBusy.is_set():#If OSA busy
-        write_text_box(textbox, 'OSA Busy Error')
-        print("OSA busy. Exiting function")
-        return
-    osaBusy.set()#Set event osaBusy
-    ipaddr=ipentry.get()#Get ip address from dialog and set the OSA's IP address
-    osa.setAddress(ipaddr)
-    try:
-        write_text_box(textbox, 'Connecting to OSA')
-        osa.open()#Try to open OSA
-    except Exception as e:#Exception
-        write_text_box(textbox, f'Cannot Connect to OSA: error {e}')#Print error to text box
-        connectedlabel.config(text='Not Connected', bg='red3')#Red label
-    else:#Connected
+    and queues a connection to the OSA"""
+    def connected(result):
         connectedlabel.config(text='Connected', bg='green3')#Set green label
         write_text_box(textbox, 'Connected to OSA')#Write connected to OSA
-    finally:
-        osaBusy.clear()#Clear event
+    def failed(e):
+        write_text_box(textbox, f'Cannot Connect to OSA: error {e}')#Print error to text box
+        connectedlabel.config(text='Not Connected', bg='red3')#Red label
+    ipaddr=ipentry.get()#Get ip address from dialog
+    write_text_box(textbox, 'Connecting to OSA')
+    worker.submit('Connect', openOSA, ipaddr, priority='urgent', callback=connected, errback=failed)
 
 def getSensitivities():
     """getSensitivities: Compile a list of valid sensitivities and return it
@@ -69,85 +88,175 @@ def getSensitivities():
         sensitivityvals.append(x+' '+str(dBmFromSensitivity(x))+' dBm')
         sensitivityvals.append(f'{x}(x2) '+str(dBmFromSensitivity(f'{x}(x2)'))+' dBm')
     sensitivityvals+=[x+' '+str(dBmFromSensitivity(x))+' dBm' for x in rapidSensitivities]#Add rapid sensitivities to list
+    sensitivityvals.append(f'AUTO {autoMargin} dB below peak')#Fastest sensitivity that meets the margin
     return sensitivityvals
 
-def sweepButtonPressed():
-    """sweepButtonPressed: Retrieves input from GUI and performs a single sweep
-    Does not perform sweep if OSA is not connected or is busy"""
-    if not osa.connected:#OSA Not Connected
-        write_text_box(textbox, 'OSA Not Connected Error')
-        return
-    if osaBusy.is_set():#OSA busy
-        write_text_box(textbox, 'OSA Busy Error')
-        print("OSA busy. Exiting function")
-        return
-    osaBusy.set()#Set OSA busy event
-    write_text_box(textbox, 'Performing Sweep')
+def getLivePlot():
+    """getLivePlot: Gets the live plot, creating it below the controls on first use
+    RETURNS:
+    The OSAPlot.LivePlot"""
+    global liveplot
+    if liveplot is None:
+        liveplot=LivePlot(window)#Updated in place
+        liveplot.pack(fill=tk.BOTH, expand=True)
+    return liveplot
+
+def applySettings(osa, settings):
+    """applySettings: Sends the GUI settings, choosing the sensitivity and speed for AUTO
+    INPUTS:
+    osa (AQ6380Controls): The OSA
+    settings (dict): The configure settings
+    RETURNS:
+    The autoConfigure choice, None if the sensitivity is not AUTO"""
+    if settings['sensitivity']!='AUTO':
+        osa.configure(**settings)#Send only changed settings from GUI in one command
+        return None
+    settings=dict(settings)
+    del settings['sensitivity']
+    del settings['speed']
+    osa.configure(**settings)#Span and resolution are needed to choose
+    return autoConfigure(osa, osa.sweepModel, autoMargin)
+
+def sweepOSA(osa, settings):
+    """sweepOSA: Worker command that configures the OSA and performs a single sweep
+    INPUTS:
+    osa (AQ6380Controls): The OSA
+    settings (dict): The configure settings
+    RETURNS:
+    (AnalysisResult of the readout analyses fetched in one query, the autoConfigure choice or None)
+    Throws exception if the OSA is not connected, a setting is invalid or the sweep fails"""
+    requireConnection(osa)
+    choice=applySettings(osa, settings)
+    if not osa.singleSweep():
+        raise RuntimeError('Sweep failed or was cancelled')
+    return (osa.analyze(readoutAnalyses), choice)
+
+def getTrace(osa):
+    """getTrace: Worker command that downloads the trace
+    INPUTS:
+    osa (AQ6380Controls): The OSA
+    RETURNS:
+    (xvals, yvals)"""
+    requireConnection(osa)
+    return osa.getTraceVals()
+
+def getSettings():
+    """getSettings: Retrieves the sweep settings from the GUI
+    RETURNS:
+    A dict of configure settings"""
     sensitivityspeed=sensitivityentry.get()#Get sensitivity and speed value from GUI
     if '(x2)' in sensitivityspeed:#Set sweep speed, 1x or 2x
-        osa.setSweepSpeed('2x')
+        speed='2x'
     else:
-        osa.setSweepSpeed('1x')
+        speed='1x'
     basesensitivity=sensitivityspeed.split('(')[0].split(' ')[0]#Get sensitivity name
-    osa.setSensitivity(basesensitivity)
-    osa.setCenter(centerentry.get())#Get center from GUI and set it
-    osa.setSpan(spanentry.get())#Get span from GUI and set it
-    osa.setResolution(resolutionentry.get())#Get resolution from GUI and set it
-    osa.singleSweep()#Perform single sweep and print peak power and peak wavelength to text box
-    write_text_box(textbox, f'Peak Power: {round(osa.getPeakPower(), 3)} dBm\nPeak Wavelength: {round(osa.getPeakWavelength(), 3)} nm')
-    osaBusy.clear()#Clear OSA busy event
+    return {'center':centerentry.get(), 'span':spanentry.get(), 'sensitivity':basesensitivity,
+            'speed':speed, 'resolution':resolutionentry.get()}
+
+def showError(e):
+    """showError: Writes a worker command error to the text box
+    INPUTS:
+    e (Exception): The error"""
+    if isinstance(e, ValueError):
+        write_text_box(textbox, f'Invalid Setting: {e}')
+    else:
+        write_text_box(textbox, str(e))
+
+def sweepButtonPressed():
+    """sweepButtonPressed: Retrieves input from GUI and queues a single sweep"""
+    def done(value):
+        (result, choice)=value
+        auto='' if choice is None else f"Auto Sensitivity: {choice['sensitivity']} {choice['speed']} ({choice['floor']} dBm)\n"
+        write_text_box(textbox, auto+f'Peak Power: {round(result.peakPower, 3)} dBm\nPeak Wavelength: {round(result.peakWavelength, 3)} nm\n'
+                       f'3 dB Width: {round(result.width, 4)} nm\nTotal Power: {round(result.power, 3)} dBm\nSMSR: {round(result.smsr, 2)} dB')
+    write_text_box(textbox, 'Performing Sweep' if worker.queueDepth()==0 else 'Sweep Queued')
+    worker.submit('Sweep', sweepOSA, getSettings(), callback=done, errback=showError)
 
 def save_sweep_data():
     """save_sweep_data: Brings up save file dialog to select file name
-    and then saves sweep data to chosesn CSV file
-    Does not save sweep data if OSA is not connected or is busy
+    and then queues a trace download that is saved to the chosen file
+    The file format is taken from the extension (see OSAExport)
     """
-    if not osa.connected:#Not Connected
-        write_text_box(textbox, 'OSA Not Connected Error')
-        return
-    f=asksaveasfile(initialfile='untitled.csv', defaultextension='.csv', filetypes=[('Commma Separated','*.csv')])#Get file name to save to
-    if f is None:#No valid file name, exit function
+    filename=asksaveasfilename(initialfile='untitled.csv', defaultextension='.csv',
+                               filetypes=[('Commma Separated','*.csv'), ('numpy array','*.npy'), ('numpy archive','*.npz'),
+                                          ('Compact binary','*.aqb')])#Get file name to save to
+    if not filename:#No valid file name, exit function
         return
-    if osaBusy.is_set():#OSA Busy
-        write_text_box(textbox, 'OSA Busy Error')
-        print("OSA busy. Exiting function")
-        return
-    osaBusy.set()#Set OSA busy event
-    (xvals, yvals)=osa.getTraceVals()#Get trace vals (xvals, yvals)
-    osaBusy.clear()#Clear OSA busy event
-    for idx in range(len(xvals)):#Get x and y vals into CSV format and write to file
-        f.write(f'{xvals[idx]},{yvals[idx]}\n')
-    f.close()
+    def save(trace):
+        try:
+            saveTrace(filename, *trace)#Write whole trace at once
+        except Exception as e:
+            write_text_box(textbox, f'Cannot Save: {e}')
+        else:
+            write_text_box(textbox, f'Saved {len(trace[0])} points to {filename}')
+    worker.submit('Save', getTrace, priority='data', key='trace', callback=save, errback=showError)
 
 def openPlotWindow():
     """openPlotWindow:
-    Opens a plot window with the OSA sweep data
-    Does not perform sweep if OSA is not connected or is busy
+    Queues a trace download that is shown in the live plot
     """
-    if not osa.connected:
-        write_text_box(textbox, 'OSA Not Connected Error')
-        return
-    if osaBusy.is_set():#OSA Busy
-        write_text_box(textbox, 'OSA Busy Error')
-        print("OSA busy. Exiting function")
+    worker.submit('Plot', getTrace, priority='data', key='trace', callback=lambda trace: getLivePlot().setTrace(*trace), errback=showError)
+
+def repeatSweepStep(osa, settings):
+    """repeatSweepStep: Worker command for one repeat sweep; sweeps and downloads the trace
+    INPUTS:
+    osa (AQ6380Controls): The OSA
+    settings (dict): The configure settings
+    RETURNS:
+    (xvals, yvals)"""
+    requireConnection(osa)
+    applySettings(osa, settings)
+    if not osa.singleSweep():
+        raise RuntimeError('Sweep failed or was cancelled')
+    return osa.getTraceVals()
+
+def queueRepeatSweep():
+    """queueRepeatSweep: Queues the next repeat sweep at background priority, so other commands go first
+    Peak power and wavelength are taken from the downloaded trace, without extra queries"""
+    def done(trace):
+        (xvals, yvals)=trace
+        getLivePlot().setTrace(xvals, yvals)
+        peak=int(np.argmax(yvals))
+        write_text_box(textbox, f'Repeat Sweep\nPeak Power: {round(float(yvals[peak]), 3)} dBm\n'
+                       f'Peak Wavelength: {round(float(xvals[peak]), 3)} nm\nDraw time: {liveplot.lastFrameTime*1000:.1f} ms')
+        if repeatSweep.is_set():
+            queueRepeatSweep()
+    def failed(e):
+        stopRepeatSweep()
+        write_text_box(textbox, f'Repeat Sweep Error: {e}')
+    worker.submit('Repeat Sweep', repeatSweepStep, getSettings(), priority='background', key='repeat',
+                  callback=done, errback=failed)
+
+def stopRepeatSweep():
+    """stopRepeatSweep: Stops repeat sweep mode; the running sweep is cancelled"""
+    repeatSweep.clear()
+    worker.cancel(key='repeat')
+    repeatbutton.config(text='Repeat Sweep')
+
+def repeatButtonPressed():
+    """repeatButtonPressed: Starts repeat sweep mode, or stops it if it is running"""
+    if repeatSweep.is_set():
+        stopRepeatSweep()
         return
-    osaBusy.set()#Set OSA busy event
-    (xvals, yvals)=osa.getTraceVals()#Get trace vals (xvals, yvals)
-    osaBusy.clear()#Clear OSA busy event
-    fig1, ax1=plt.subplots()#Set up plot window
-    ax1.plot(xvals, yvals)
-    ax1.set_xlabel('Wavelength (nm)')
-    ax1.set_ylabel('Amplitude (dBm)')
-    ax1.set_title('Amplitude vs wavelength')
-    plt.show()#Show plot window
+    repeatSweep.set()
+    repeatbutton.config(text='Stop Repeat')
+    queueRepeatSweep()
+
+def cancelButtonPressed():
+    """cancelButtonPressed: Cancels all queued commands and the running one"""
+    repeatSweep.clear()
+    repeatbutton.config(text='Repeat Sweep')
+    worker.cancelAll()
+    write_text_box(textbox, 'Cancelled')
 
 if __name__=='__main__':
     sensitivityvals=getSensitivities()#Compile list of sensitivities
-    osa=AQ6380Controls()
+    osa=AQ6380Controls(traceFormat='REAL64')#Binary trace transfer
+    osa.sweepModel=SweepTimeModel()#Learns sweep times for the AUTO sensitivity
     #Set up tkinter window
     window=tk.Tk()#Set up tkinter window
     window.title('AQ6380 Controls')
-    window.geometry('600x400')
+    window.geometry('700x900')
 
     #Frame inside window for responsive interface; widgets are put in a grid inside frame
     frame=tk.Frame(window)
@@ -159,7 +268,7 @@ if __name__=='__main__':
     ipentry.grid(row=0, column=1, columnspan=2, sticky=stickall, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y)
     connectedlabel=tk.Label(frame, text='Not Connected', bg='red3', width=14)#Is connected label
     connectedlabel.grid(row=0, column=3, sticky=stickall, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y)
-    connectbutton=tk.Button(frame, text='Connect', command=lambda: threading.Thread(target=connect_to_osa).start())#Connect button
+    connectbutton=tk.Button(frame, text='Connect', command=connect_to_osa)#Connect button
     connectbutton.grid(row=1, column=0, columnspan=2, sticky=stickall, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y)
     centerlabel=tk.Label(frame, text='Center WL (nm)')#Center wavelength label
     centerlabel.grid(row=2, column=0, sticky=stickall, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y)
@@ -179,15 +288,24 @@ if __name__=='__main__':
     sensitivityentry=ttk.Combobox(frame, width=20, values=sensitivityvals)#Sensitivity entry as dropdown, values from list of sensitivities
     sensitivityentry.current(0)#Set default sensitivity value
     sensitivityentry.grid(row=3, column=3, sticky=stickall, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y)
-    singlesweepbutton=tk.Button(frame, text='Single Sweep', command=lambda: threading.Thread(target=sweepButtonPressed).start())#Start Sweep Button
+    singlesweepbutton=tk.Button(frame, text='Single Sweep', command=sweepButtonPressed)#Start Sweep Button
     singlesweepbutton.grid(row=4, column=0, sticky=stickall, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y)
     textbox=tk.Text(frame,  width=40, height=10, state=tk.DISABLED)#Text box to be written to by program
     textbox.grid(row=5, column=0, columnspan=4, sticky=stickall, pady=10, padx=10)
     write_text_box(textbox, 'Not Connected')
-    savesweepbutton=tk.Button(frame, text='Save CSV', command=lambda: save_sweep_data())#Save Sweep Data as CSV button
+    savesweepbutton=tk.Button(frame, text='Save CSV', command=save_sweep_data)#Save Sweep Data as CSV button
     savesweepbutton.grid(row=6, column=0, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y, sticky=stickall)
-    plotbutton=tk.Button(frame, text='Plot OSA Data', command=lambda: openPlotWindow())#Save Sweep Data as CSV button
+    plotbutton=tk.Button(frame, text='Plot OSA Data', command=openPlotWindow)#Plot current trace button
     plotbutton.grid(row=6, column=1, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y, sticky=stickall)
+    repeatbutton=tk.Button(frame, text='Repeat Sweep', command=repeatButtonPressed)#Start/stop repeat sweep button
+    repeatbutton.grid(row=4, column=1, sticky=stickall, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y)
+    resetviewbutton=tk.Button(frame, text='Reset Zoom', command=lambda: liveplot is not None and liveplot.resetView())#Zoom out to whole trace button
+    resetviewbutton.grid(row=6, column=2, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y, sticky=stickall)
+    cancelbutton=tk.Button(frame, text='Cancel', command=cancelButtonPressed)#Cancel queued and running commands button
+    cancelbutton.grid(row=4, column=2, sticky=stickall, padx=DEFAULT_PAD_X, pady=DEFAULT_PAD_Y)
     frame.pack()
+    liveplot=None#Live plot below the controls; created on first plot so matplotlib loads only when needed
+    worker=OSAWorker(osa, window)#Only the worker thread talks to the OSA
+    worker.start()
     window.protocol('WM_DELETE_WINDOW', lambda:exit(0))
     window.mainloop()#Run main loop
\ No newline at end of file
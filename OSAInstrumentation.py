@@ -0,0 +1,235 @@
+"""OSAInstrumentation.py:
+Latency instrumentation for AQ6380Controls
+Records per SCPI command latency histograms grouped by command mnemonic, bytes sent
+and received, trace parse times and sweep durations. Every record can also be passed
+to hooks, i.e. a JSON lines trace file for later analysis.
+Instrumentation is off until AQ6380Controls.enableInstrumentation is called; while it
+is off, commands only pay for one attribute check.
+One Instrumentation may be shared by several OSAs (i.e. an OSAFleet); it is thread safe.
+Usage:
+    instrumentation=osa.enableInstrumentation()
+    instrumentation.addHook(JsonLinesHook('osa_trace.jsonl'))
+    ...
+    print(instrumentation.report())
+"""
+import json
+import math
+import threading
+import time
+
+eventKinds=['query', 'write', 'binary', 'parse', 'trace', 'sweep']
+bucketsPerDecade=8
+minBucketSeconds=1e-6#Lower edge of the first histogram bucket
+bucketCount=8*bucketsPerDecade#1 us to 100 s
+
+def commandMnemonic(cmd):
+    """commandMnemonic:
+    Gets the mnemonic of a SCPI command without its arguments, used to group latencies
+    INPUTS:
+    cmd (str): The command, may be several commands joined with ';'
+    RETURNS:
+    The lower case headers joined with ';', i.e. ':form:data;:trac:y?' for ':form:data real,64;:trac:y? TRA'"""
+    return ';'.join([part.strip().split(' ', 1)[0].lower() for part in cmd.split(';') if part.strip()])
+
+def bucketIndex(seconds):
+    """bucketIndex: RETURNS: The histogram bucket of a duration"""
+    if seconds<=minBucketSeconds:
+        return 0
+    return min(bucketCount-1, int(math.log10(seconds/minBucketSeconds)*bucketsPerDecade))
+
+def bucketEdge(idx):
+    """bucketEdge: RETURNS: The upper edge of a histogram bucket in seconds"""
+    return minBucketSeconds*10**((idx+1)/bucketsPerDecade)
+
+class LatencyHistogram:
+    """class LatencyHistogram:
+        Log spaced histogram of durations with byte counters"""
+    def __init__(self):
+        """initialize: An empty histogram"""
+        self.buckets=[0]*bucketCount
+        self.count=0
+        self.errors=0
+        self.total=0.0
+        self.minimum=math.inf
+        self.maximum=0.0
+        self.bytesOut=0
+        self.bytesIn=0
+
+    def record(self, seconds, bytesOut=0, bytesIn=0, error=False):
+        """record:
+        Adds a duration
+        INPUTS:
+        seconds (float): The duration
+        bytesOut, bytesIn (int, default 0): Bytes sent and received
+        error (bool, default False): The command failed"""
+        self.buckets[bucketIndex(seconds)]+=1
+        self.count+=1
+        self.errors+=int(error)
+        self.total+=seconds
+        self.minimum=min(self.minimum, seconds)
+        self.maximum=max(self.maximum, seconds)
+        self.bytesOut+=bytesOut
+        self.bytesIn+=bytesIn
+
+    def percentile(self, p):
+        """percentile:
+        Estimates a percentile from the buckets
+        INPUTS:
+        p (float): The percentile, 0 to 100
+        RETURNS:
+        The upper edge of the bucket holding the percentile in seconds, limited to the maximum"""
+        if self.count==0:
+            return 0.0
+        target=p/100*self.count
+        seen=0
+        for (idx, n) in enumerate(self.buckets):
+            seen+=n
+            if seen>=target and n>0:
+                return min(bucketEdge(idx), self.maximum)
+        return self.maximum
+
+    def snapshot(self):
+        """snapshot:
+        Gets the histogram statistics
+        RETURNS:
+        A dict with count, errors, total, mean, min, max, p50, p90, p99 (seconds), bytesOut, bytesIn
+        and buckets as a dict of upper bucket edge (seconds) to count for non-empty buckets"""
+        return {'count':self.count, 'errors':self.errors, 'total':self.total,
+                'mean':self.total/self.count if self.count else 0.0,
+                'min':self.minimum if self.count else 0.0, 'max':self.maximum,
+                'p50':self.percentile(50), 'p90':self.percentile(90), 'p99':self.percentile(99),
+                'bytesOut':self.bytesOut, 'bytesIn':self.bytesIn,
+                'buckets':{bucketEdge(idx):n for (idx, n) in enumerate(self.buckets) if n}}
+
+def summarizeHistograms(histograms, started):
+    """summarizeHistograms:
+    Gets the snapshots of histograms by kind and name
+    INPUTS:
+    histograms (dict): LatencyHistogram by (kind, name)
+    started (float): time.time() the histograms were started
+    RETURNS:
+    A dict of kind to dict of name to LatencyHistogram.snapshot dict, plus 'since'"""
+    result={'since':started}
+    for ((kind, name), histogram) in histograms.items():
+        result.setdefault(kind, {})[name]=histogram.snapshot()
+    return result
+
+class JsonLinesHook:
+    """class JsonLinesHook:
+        Hook that appends every record as one JSON line to a file"""
+    def __init__(self, filename):
+        """initialize:
+        INPUTS:
+            filename (str): The trace file; appended to if it exists
+            """
+        self.filename=filename
+        self.lock=threading.Lock()
+        self.fp=open(filename, 'a', buffering=1)#Line buffered; each record is on disk when written
+
+    def __call__(self, event):
+        """call: Writes one record"""
+        with self.lock:
+            if self.fp is not None:
+                self.fp.write(json.dumps(event)+'\n')
+
+    def close(self):
+        """close: Closes the trace file"""
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp=None
+
+class Instrumentation:
+    """class Instrumentation:
+        Collects latency histograms by event kind and name and calls hooks for every record"""
+    def __init__(self, source=None):
+        """initialize:
+        INPUTS:
+            source (str, default None): Name added to hook records, i.e. the OSA address
+            """
+        self.source=source
+        self.lock=threading.Lock()
+        self.hooks=[]
+        self.histograms={}#(kind, name): LatencyHistogram
+        self.started=time.time()
+
+    def addHook(self, hook):
+        """addHook:
+        Adds a hook called with a dict for every record: 'time', 'kind', 'name', 'seconds',
+        'bytesOut', 'bytesIn', 'error', 'source' and any extra values
+        INPUTS:
+        hook (function): The hook; it runs in the thread of the instrumented call
+        RETURNS:
+        The hook"""
+        with self.lock:
+            self.hooks=self.hooks+[hook]
+        return hook
+
+    def removeHook(self, hook):
+        """removeHook: Removes a hook added with addHook"""
+        with self.lock:
+            self.hooks=[h for h in self.hooks if h is not hook]
+
+    def record(self, kind, name, seconds, bytesOut=0, bytesIn=0, error=False, **extra):
+        """record:
+        Records one event
+        INPUTS:
+        kind (str): One of eventKinds
+        name (str): The group within the kind, i.e. the command mnemonic
+        seconds (float): The duration
+        bytesOut, bytesIn (int, default 0): Bytes sent and received
+        error (bool, default False): The event failed
+        extra: Other values passed to hooks, i.e. points"""
+        with self.lock:
+            histogram=self.histograms.get((kind, name))
+            if histogram is None:
+                histogram=self.histograms[(kind, name)]=LatencyHistogram()
+            histogram.record(seconds, bytesOut, bytesIn, error)
+            hooks=self.hooks
+        if hooks:
+            event={'time':time.time(), 'kind':kind, 'name':name, 'seconds':seconds, 'bytesOut':bytesOut,
+                   'bytesIn':bytesIn, 'error':error, 'source':self.source}
+            event.update(extra)
+            for hook in hooks:
+                try:
+                    hook(event)
+                except Exception as e:
+                    print(f'Instrumentation hook error: {e}')
+
+    def recordCommand(self, kind, cmd, seconds, bytesOut=0, bytesIn=0, error=False):
+        """recordCommand: Records a SCPI command grouped by its mnemonic, see record"""
+        self.record(kind, commandMnemonic(cmd), seconds, bytesOut, bytesIn, error)
+
+    def snapshot(self):
+        """snapshot:
+        Gets the statistics recorded so far
+        RETURNS:
+        A dict of kind to dict of name to LatencyHistogram.snapshot dict, plus 'since' (time.time() of the last reset)"""
+        with self.lock:
+            return summarizeHistograms(self.histograms, self.started)
+
+    def reset(self):
+        """reset:
+        Clears the statistics
+        RETURNS:
+        The snapshot taken before clearing"""
+        with self.lock:
+            (histograms, started)=(self.histograms, self.started)
+            self.histograms={}
+            self.started=time.time()
+        return summarizeHistograms(histograms, started)
+
+    def report(self):
+        """report:
+        Formats the statistics as a table, slowest total time first
+        RETURNS:
+        The table (str)"""
+        snapshot=self.snapshot()
+        rows=[]
+        for kind in eventKinds:
+            for (name, stats) in snapshot.get(kind, {}).items():
+                rows.append((stats['total'], f"{kind:7s} {name[:40]:40s} {stats['count']:7d} {stats['mean']*1000:9.3f} "
+                                             f"{stats['p50']*1000:9.3f} {stats['p99']*1000:9.3f} {stats['max']*1000:9.3f} "
+                                             f"{stats['bytesOut']:10d} {stats['bytesIn']:12d}"))
+        header=f"{'kind':7s} {'name':40s} {'count':>7s} {'mean ms':>9s} {'p50 ms':>9s} {'p99 ms':>9s} {'max ms':>9s} {'bytes out':>10s} {'bytes in':>12s}"
+        return '\n'.join([header]+[row for (total, row) in sorted(rows, key=lambda r: -r[0])])
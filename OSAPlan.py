@@ -0,0 +1,387 @@
+"""OSAPlan.py:
+Runs a measurement plan: a declarative list of sweep settings
+Plan files are JSON (a list of objects) or CSV (a header row) with the columns
+center, span, resolution, sensitivity and speed, and optionally name.
+Settings that are left out keep their previous value in plan order (the OSA's settings for
+the first point); they are filled in before the points are reordered, so every point is
+measured with the same settings in any order.
+Changing sensitivity family (tradSensitivities against rapidSensitivities), sensitivity
+or resolution costs far more than moving the center, so the points are reordered to
+minimize the cost of setting changes according to a cost model. The model has
+seconds per setting change, which can be measured on the OSA, and an OSASweepModel
+SweepTimeModel for the sweep times, which learns as the plan runs; both are saved to
+and loaded from a JSON file.
+Each finished point is recorded in a checkpoint file, so an interrupted plan resumes
+where it stopped. Estimated and actual total runtime are reported at the end.
+Depends on AQ6380Controls, OSAExport and OSASweepModel libraries
+Depends on pyvisa, pyvisa-py, numpy
+To get dependencies,
+pip install pyvisa
+pip install pyvisa-py
+pip install numpy
+To run: python OSAPlan.py plan.json or py OSAPlan.py plan.json depending on system
+    Example: "python OSAPlan.py plan.csv --address 192.168.1.177 --output results --measure"
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from AQ6380Controls import AQ6380Controls, rapidSensitivities
+from OSAExport import exportFormats, saveTrace
+from OSASweepModel import SweepTimeModel
+
+planSettings=['center', 'span', 'resolution', 'sensitivity', 'speed']
+defaultChangeCosts={'family':10.0, 'sensitivity':3.0, 'resolution':2.0, 'speed':1.0, 'span':0.5, 'center':0.1}#Seconds
+defaultSweepTime=5.0#Seconds per sweep the sweep model cannot predict yet
+
+def normalizePoint(point):
+    """normalizePoint:
+    Normalizes the settings of a plan point so equal settings compare equal
+    INPUTS:
+    point (dict): The plan point
+    RETURNS:
+    A new dict with center and span as float, resolution, sensitivity and speed as str;
+    resolution as in AQ6380Controls.resolutions, i.e. '0.02' for 0.02 or '0.020'
+    Throws exception if a setting is unknown"""
+    normalized={}
+    for (name, value) in point.items():
+        if value is None or value=='':
+            continue
+        if name in ('center', 'span'):
+            normalized[name]=float(value)
+        elif name=='resolution':
+            try:
+                normalized[name]=f'{float(value):g}'#Same text for the OSA's float and a plan's string
+            except ValueError:
+                normalized[name]=str(value).strip()
+        elif name=='sensitivity':
+            normalized[name]=str(value).strip().upper()
+        elif name=='speed':
+            normalized[name]=str(value).strip().lower().replace('x2', '2x').replace('x1', '1x')
+        elif name=='name':
+            normalized[name]=str(value)
+        else:
+            raise ValueError(f'Plan setting {name} is invalid')
+    return normalized
+
+def inheritSettings(points, current=None):
+    """inheritSettings:
+    Fills in the settings each point leaves out with the value it has in plan order
+    INPUTS:
+    points (list of dict): The normalized plan points in plan order
+    current (dict, default None): Normalized settings of the OSA before the first point
+    RETURNS:
+    A new list of points with every setting known before them filled in"""
+    settings={name:value for (name, value) in (current or {}).items() if name in planSettings}
+    filled=[]
+    for point in points:
+        settings.update({name:point[name] for name in planSettings if name in point})
+        filled.append(dict(settings, **point))
+    return filled
+
+def loadPlan(filename):
+    """loadPlan:
+    Loads a plan file
+    INPUTS:
+    filename (str): A .json file with a list of objects or a .csv file with a header row
+    RETURNS:
+    A list of normalized plan points (dicts) with left out settings filled in, see inheritSettings"""
+    with open(filename, 'r', newline='') as fp:
+        if filename.lower().endswith('.json'):
+            points=json.load(fp)
+        else:
+            points=list(csv.DictReader(fp))
+    return inheritSettings([normalizePoint(point) for point in points])
+
+def sensitivityFamily(sensitivity):
+    """sensitivityFamily:
+    Gets the family of a sensitivity
+    INPUTS:
+    sensitivity (str): The sensitivity name
+    RETURNS:
+    'rapid' for rapidSensitivities, 'trad' otherwise, None if sensitivity is None"""
+    if sensitivity is None:
+        return None
+    return 'rapid' if sensitivity in rapidSensitivities else 'trad'
+
+def sortValue(value):
+    """sortValue: Sort key that orders numbers numerically and puts them before names"""
+    try:
+        return (0, float(value), '')
+    except (TypeError, ValueError):
+        return (1, 0.0, str(value))
+
+class CostModel:
+    """class CostModel:
+        Seconds per setting change and per sweep for ordering and estimating plans"""
+    def __init__(self, changeCosts=None, sweepModel=None):
+        """initialize:
+        INPUTS:
+            changeCosts (dict, default None): Seconds per change of 'family', 'sensitivity',
+                'resolution', 'speed', 'span' and 'center', None for defaultChangeCosts
+            sweepModel (SweepTimeModel, default None): Sweep time model, None for a new one
+            """
+        self.changeCosts=dict(defaultChangeCosts)
+        self.changeCosts.update(changeCosts or {})
+        self.sweepModel=sweepModel if sweepModel is not None else SweepTimeModel()
+
+    def transitionCost(self, previous, point):
+        """transitionCost:
+        Estimates the time to change from one point's settings to another's
+        INPUTS:
+        previous (dict): The settings the OSA has, None for unknown settings
+        point (dict): The new settings
+        RETURNS:
+        Seconds"""
+        cost=0.0
+        for name in planSettings:
+            if name in point and (previous is None or previous.get(name)!=point[name]):
+                cost+=self.changeCosts.get(name, 0.0)
+        if 'sensitivity' in point and (previous is None or
+                                       sensitivityFamily(previous.get('sensitivity'))!=sensitivityFamily(point['sensitivity'])):
+            cost+=self.changeCosts.get('family', 0.0)
+        return cost
+
+    def sweepTime(self, point):
+        """sweepTime:
+        Estimates the sweep time of a point
+        INPUTS:
+        point (dict): The settings
+        RETURNS:
+        Seconds; the sweep model prediction, or defaultSweepTime if it has none"""
+        seconds=self.sweepModel.predict(point)
+        return defaultSweepTime if seconds is None else seconds
+
+    def estimate(self, points, current=None):
+        """estimate:
+        Estimates the runtime of points in the given order
+        INPUTS:
+        points (list of dict): The plan points in run order
+        current (dict, default None): The settings the OSA has, None for unknown settings
+        RETURNS:
+        (total seconds, setting change seconds)"""
+        change=0.0
+        total=0.0
+        settings=None if current is None else dict(current)
+        for point in points:
+            cost=self.transitionCost(settings, point)
+            change+=cost
+            total+=cost+self.sweepTime(point)
+            settings=dict(settings or {})
+            settings.update({name:point[name] for name in planSettings if name in point})
+        return (total, change)
+
+    def measure(self, osa, points, repeats=3):
+        """measure:
+        Measures the change cost of each setting on the OSA by changing it between values
+        used in the plan and waiting for *OPC?
+        INPUTS:
+        osa (AQ6380Controls): A connected OSA
+        points (list of dict): The plan points
+        repeats (int, default 3): Changes measured per setting
+        RETURNS:
+        The measured changeCosts dict"""
+        base={name:points[0][name] for name in planSettings if name in points[0]}
+        osa.configure(**base)
+        osa.query('*OPC?')
+        measured={}
+        for name in ['family']+planSettings:
+            if name=='family':#Change between the plan's sensitivity families
+                values=sorted({point['sensitivity'] for point in points if 'sensitivity' in point}, key=sensitivityFamily)
+                values=[values[0], values[-1]] if len(values)>1 and sensitivityFamily(values[0])!=sensitivityFamily(values[-1]) else []
+                setting='sensitivity'
+            else:
+                values=sorted({point[name] for point in points if name in point}, key=sortValue)[:2]
+                setting=name
+            if len(values)<2:
+                continue
+            times=[]
+            for idx in range(repeats*2):
+                t0=time.perf_counter()
+                osa.configure(**{setting:values[idx%2]})
+                osa.query('*OPC?')
+                times.append(time.perf_counter()-t0)
+            measured[name]=sum(times)/len(times)
+            osa.configure(**base)
+        if 'family' in measured and 'sensitivity' in measured:#Family cost is on top of the sensitivity change
+            measured['family']=max(0.0, measured['family']-measured['sensitivity'])
+        self.changeCosts.update(measured)
+        return measured
+
+    def save(self, filename):
+        """save: Saves the model and its sweep model fits as JSON to filename"""
+        with self.sweepModel.lock:
+            fits={key:dict(fit) for (key, fit) in self.sweepModel.fits.items()}
+        with open(filename, 'w') as fp:
+            json.dump({'changeCosts':self.changeCosts, 'sweepModel':{'fits':fits}}, fp, indent=2)
+
+    @classmethod
+    def load(cls, filename):
+        """load: Loads a model saved with save from filename; RETURNS: The CostModel"""
+        with open(filename, 'r') as fp:
+            data=json.load(fp)
+        return cls(data.get('changeCosts'), SweepTimeModel((data.get('sweepModel') or {}).get('fits')))
+
+def snakeOrder(ids, points, keys, reverse=False):
+    """snakeOrder:
+    Groups points by the costliest setting first and alternates the order of the cheaper
+    settings between groups, so the last settings of one group are the first of the next
+    INPUTS:
+    ids (list of int): The point numbers to order
+    points (list of dict): All plan points
+    keys (list of str): Settings from costliest to cheapest
+    reverse (bool, default False): Order this level's values in reverse
+    RETURNS:
+    The ordered point numbers"""
+    if not keys or len(ids)<=1:
+        return list(ids)
+    key=keys[0]
+    groups={}
+    for idx in ids:
+        point=points[idx]
+        value=sensitivityFamily(point.get('sensitivity')) if key=='family' else point.get(key)
+        groups.setdefault(value, []).append(idx)
+    values=sorted(groups, key=sortValue, reverse=reverse)
+    ordered=[]
+    for (count, value) in enumerate(values):
+        ordered+=snakeOrder(groups[value], points, keys[1:], reverse=count%2==1)
+    return ordered
+
+def orderPlan(points, model, current=None):
+    """orderPlan:
+    Orders plan points to minimize the estimated setting change cost
+    INPUTS:
+    points (list of dict): The plan points
+    model (CostModel): The cost model
+    current (dict, default None): The settings the OSA has
+    RETURNS:
+    The point numbers in run order; the plan order if it is not more expensive"""
+    keys=sorted(model.changeCosts, key=lambda name: model.changeCosts[name], reverse=True)
+    candidates=[list(range(len(points)))]
+    candidates.append(snakeOrder(range(len(points)), points, keys))
+    candidates.append(snakeOrder(range(len(points)), points, keys, reverse=True))
+    return min(candidates, key=lambda order: model.estimate([points[idx] for idx in order], current)[1])
+
+def planFilename(point, idx, directory, fmt):
+    """planFilename: RETURNS: The trace file of a plan point, named after its name or number"""
+    return os.path.join(directory, f"{point.get('name', f'point_{idx:04d}')}.{fmt}")
+
+def loadCheckpoint(checkpoint, points):
+    """loadCheckpoint:
+    Loads the finished points of a checkpoint file
+    INPUTS:
+    checkpoint (str): The checkpoint file
+    points (list of dict): The plan points
+    RETURNS:
+    A dict of point number (str) to result dict, empty if there is no checkpoint
+    Throws exception if the checkpoint belongs to another plan"""
+    if checkpoint is None or not os.path.exists(checkpoint):
+        return {}
+    with open(checkpoint, 'r') as fp:
+        data=json.load(fp)
+    if data.get('points')!=points:
+        raise ValueError(f'Checkpoint {checkpoint} is for a different plan')
+    return data.get('done', {})
+
+def saveCheckpoint(checkpoint, points, done):
+    """saveCheckpoint: Atomically writes the plan and its finished points to the checkpoint file"""
+    tempname=checkpoint+'.tmp'
+    with open(tempname, 'w') as fp:
+        json.dump({'points':points, 'done':done}, fp, indent=1)
+    os.replace(tempname, checkpoint)
+
+def runPlan(osa, points, directory='.', checkpoint=None, model=None, reorder=True, fmt='csv'):
+    """runPlan:
+    Runs a measurement plan, saving one trace file per point
+    INPUTS:
+    osa (AQ6380Controls): A connected OSA
+    points (list of dict): The plan points, see loadPlan
+    directory (str, default '.'): Directory for the trace files
+    checkpoint (str, default None): Checkpoint file; finished points in it are skipped, None for no checkpoint
+    model (CostModel, default None): The cost model, None for default costs and the OSA's sweepModel;
+        its sweep model is attached to the OSA while the plan runs, so every sweep teaches it
+    reorder (bool, default True): Reorder points to minimize setting changes
+    fmt (str, default 'csv'): Trace file format, one of OSAExport.exportFormats
+    RETURNS:
+    A dict with 'order' (point numbers), 'points' run, 'skipped' (finished before),
+    'estimated' and 'actual' total seconds, 'estimatedChange' and 'actualChange' seconds
+    changing settings, and 'results' by point number
+    Throws exception if a sweep fails; finished points stay in the checkpoint"""
+    if fmt not in exportFormats:
+        raise ValueError(f'Export format of {fmt} is invalid')
+    model=model or CostModel(sweepModel=osa.sweepModel)
+    osa.resyncSettings()#Settings changed from the front panel or by an earlier run are not in the shadow copy
+    current=normalizePoint({name:value for (name, value) in osa.settings.items() if name in planSettings})
+    planned=points#Checkpoints hold the plan as given; the OSA settings differ when resuming
+    points=inheritSettings(points, current)#The first point's left out settings are the OSA's
+    order=orderPlan(points, model, current) if reorder else list(range(len(points)))
+    done=loadCheckpoint(checkpoint, planned)
+    remaining=[idx for idx in order if str(idx) not in done]
+    (estimated, estimatedchange)=model.estimate([points[idx] for idx in remaining], current)
+    print(f'{len(remaining)} of {len(points)} points to run, estimated {estimated:.1f} s '
+          f'({estimatedchange:.1f} s changing settings)')
+    os.makedirs(directory, exist_ok=True)
+    actualchange=0.0
+    attached=osa.sweepModel
+    osa.sweepModel=model.sweepModel#singleSweep teaches it the sweep time of each point
+    t0=time.perf_counter()
+    try:
+        for idx in remaining:
+            point=points[idx]
+            t1=time.perf_counter()
+            osa.configure(**{name:point[name] for name in planSettings if name in point})
+            t2=time.perf_counter()
+            if not osa.singleSweep():
+                raise RuntimeError(f'Sweep of plan point {idx} failed')
+            t3=time.perf_counter()
+            (xvals, yvals)=osa.getTraceVals()
+            filename=planFilename(point, idx, directory, fmt)
+            saveTrace(filename, xvals, yvals, fmt=fmt)
+            t4=time.perf_counter()
+            actualchange+=t2-t1
+            done[str(idx)]={'file':filename, 'configure':t2-t1, 'sweep':t3-t2, 'elapsed':t4-t1, 'timestamp':time.time()}
+            if checkpoint is not None:
+                saveCheckpoint(checkpoint, planned, done)
+    finally:
+        osa.sweepModel=attached
+    actual=time.perf_counter()-t0
+    print(f'Plan complete: estimated {estimated:.1f} s, actual {actual:.1f} s')
+    return {'order':order, 'points':len(remaining), 'skipped':len(points)-len(remaining), 'estimated':estimated,
+            'actual':actual, 'estimatedChange':estimatedchange, 'actualChange':actualchange, 'results':done}
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Run an OSA measurement plan in the cheapest order')
+    parser.add_argument('plan', help='Plan file (.json or .csv)')
+    parser.add_argument('--address', default='192.168.1.177', help='OSA address')
+    parser.add_argument('--port', default='10001', help='OSA port')
+    parser.add_argument('--output', default='.', help='Directory for trace files')
+    parser.add_argument('--format', default='csv', choices=exportFormats, help='Trace file format')
+    parser.add_argument('--checkpoint', default=None, help='Checkpoint file; default plan file name with .checkpoint.json')
+    parser.add_argument('--model', default=None, help='Cost model JSON file; updated after the run')
+    parser.add_argument('--measure', action='store_true', help='Measure setting change costs on the OSA first')
+    parser.add_argument('--no-reorder', action='store_true', help='Run points in plan order')
+    parser.add_argument('--dry-run', action='store_true', help='Print the order and estimate without connecting')
+    args=parser.parse_args()
+    points=loadPlan(args.plan)
+    model=CostModel.load(args.model) if args.model and os.path.exists(args.model) else CostModel()
+    if args.dry_run:
+        order=list(range(len(points))) if args.no_reorder else orderPlan(points, model)
+        for idx in order:
+            print(idx, points[idx])
+        (planned, planchange)=model.estimate(points)
+        (total, change)=model.estimate([points[idx] for idx in order])
+        print(f'Plan order: {planned:.1f} s ({planchange:.1f} s changing settings); '
+              f'run order: {total:.1f} s ({change:.1f} s changing settings)')
+    else:
+        osa=AQ6380Controls(args.address, port=args.port)
+        osa.open()
+        try:
+            if args.measure:
+                print('Measured change costs:', model.measure(osa, points))
+            checkpoint=args.checkpoint or os.path.splitext(args.plan)[0]+'.checkpoint.json'
+            runPlan(osa, points, args.output, checkpoint, model, not args.no_reorder, args.format)
+        finally:
+            osa.close()
+            if args.model:
+                model.save(args.model)
@@ -0,0 +1,205 @@
+"""OSAPlot.py:
+Live trace plot for Tk windows
+The plot is embedded in a Tk frame and updated in place: new traces replace the
+line data and are drawn with blitting, the figure is only redrawn when the axes change.
+Traces are decimated to the plot width in pixels with min/max decimation, so the
+frame time does not grow with the trace point count. When zoomed, the visible part
+of the full resolution trace is decimated again, so zoomed regions keep full detail.
+setTrace may be called from any thread; the plot picks up the latest trace on the Tk thread.
+matplotlib is imported when the first LivePlot is created, so importing this module is fast.
+Depends on numpy, matplotlib
+To get dependencies,
+pip install numpy
+pip install matplotlib
+"""
+import threading
+import time
+import tkinter as tk
+import numpy as np
+
+def loadMatplotlib():
+    """loadMatplotlib:
+    Imports the matplotlib Tk plotting classes on first use
+    RETURNS:
+    (Figure, FigureCanvasTkAgg, NavigationToolbar2Tk)"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+    return (Figure, FigureCanvasTkAgg, NavigationToolbar2Tk)
+
+def minMaxDecimate(xvals, yvals, buckets):
+    """minMaxDecimate:
+    Reduces a trace to the minimum and maximum point of each bucket, in trace order.
+    Peaks and nulls are kept, so the decimated trace looks the same at one bucket per pixel.
+    INPUTS:
+    xvals, yvals (numpy array): The trace
+    buckets (int): Number of buckets, normally the plot width in pixels
+    RETURNS:
+    (xvals, yvals) with at most 2*buckets points; the input if it is already that small"""
+    npoints=len(yvals)
+    buckets=max(1, int(buckets))
+    if npoints<=2*buckets:
+        return (xvals, yvals)
+    size=-(-npoints//buckets)#Points per bucket, rounded up
+    buckets=-(-npoints//size)
+    padded=np.pad(yvals, (0, buckets*size-npoints), mode='edge').reshape(buckets, size)
+    start=np.arange(buckets)*size
+    imin=np.minimum(start+np.argmin(padded, axis=1), npoints-1)
+    imax=np.minimum(start+np.argmax(padded, axis=1), npoints-1)
+    idx=np.empty(2*buckets, dtype=np.intp)
+    idx[0::2]=np.minimum(imin, imax)#Keep the two points of each bucket in trace order
+    idx[1::2]=np.maximum(imin, imax)
+    return (xvals[idx], yvals[idx])
+
+class LivePlot:
+    """class LivePlot:
+        A trace plot in a Tk frame that updates in place"""
+    def __init__(self, master, refreshInterval=50, xlabel='Wavelength (nm)', ylabel='Amplitude (dBm)',
+                 title='Amplitude vs wavelength'):
+        """initialize:
+        INPUTS:
+            master (tk widget): The parent widget
+            refreshInterval (int, default 50): Milliseconds between checks for a new trace
+            xlabel, ylabel, title (str): Axis labels and title
+            """
+        (Figure, FigureCanvasTkAgg, NavigationToolbar2Tk)=loadMatplotlib()
+        self.master=master
+        self.refreshInterval=refreshInterval
+        self.frame=tk.Frame(master)
+        self.figure=Figure(figsize=(6, 3.5), dpi=100)
+        self.ax=self.figure.add_subplot(111)
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel(ylabel)
+        self.ax.set_title(title)
+        self.ax.grid(True)
+        (self.line,)=self.ax.plot([], [], animated=True)#Drawn by blitting, not by full redraws
+        self.figure.tight_layout()
+        self.canvas=FigureCanvasTkAgg(self.figure, master=self.frame)
+        self.toolbar=NavigationToolbar2Tk(self.canvas, self.frame, pack_toolbar=False)
+        self.toolbar.update()
+        self.toolbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.xvals=np.zeros(0)#Full resolution trace
+        self.yvals=np.zeros(0)
+        self.background=None
+        self.zoomed=False#True once the user zooms or pans; new traces keep the view
+        self.settingLimits=False
+        self.pending=None#Latest trace from setTrace, picked up on the Tk thread
+        self.pendingLock=threading.Lock()
+        self.frames=0
+        self.lastFrameTime=0.0#Seconds to decimate and draw the last trace
+        self.canvas.mpl_connect('draw_event', self.onDraw)
+        self.ax.callbacks.connect('xlim_changed', self.onXLimits)
+        self.master.after(self.refreshInterval, self.refresh)
+
+    def pack(self, **kwargs):
+        """pack: Packs the plot frame, see tkinter pack"""
+        self.frame.pack(**kwargs)
+
+    def grid(self, **kwargs):
+        """grid: Places the plot frame in a grid, see tkinter grid"""
+        self.frame.grid(**kwargs)
+
+    def setTrace(self, xvals, yvals):
+        """setTrace:
+        Hands a new trace to the plot; only the latest trace is drawn if several arrive between refreshes
+        Safe to call from any thread
+        INPUTS:
+        xvals, yvals (numpy array or list): The trace, xvals ascending"""
+        with self.pendingLock:
+            self.pending=(np.asarray(xvals), np.asarray(yvals))
+
+    def resetView(self):
+        """resetView: Zooms out to the whole trace; new traces rescale the axes again"""
+        self.zoomed=False
+        self.autoscale(force=True)
+        self.redecimate()
+        self.canvas.draw_idle()
+
+    def refresh(self):
+        """refresh: Draws the pending trace if there is one and schedules the next refresh"""
+        with self.pendingLock:
+            pending=self.pending
+            self.pending=None
+        if pending is not None:
+            self.drawTrace(*pending)
+        self.master.after(self.refreshInterval, self.refresh)
+
+    def plotWidth(self):
+        """plotWidth: RETURNS: The width of the axes in pixels"""
+        return max(1, int(self.ax.bbox.width))
+
+    def visibleTrace(self):
+        """visibleTrace:
+        Gets the part of the full resolution trace inside the x limits, decimated to the plot width
+        RETURNS:
+        (xvals, yvals)"""
+        if len(self.xvals)==0:
+            return (self.xvals, self.yvals)
+        (xmin, xmax)=self.ax.get_xlim()
+        first=max(0, np.searchsorted(self.xvals, xmin)-1)#One point beyond each edge so the line reaches the border
+        last=min(len(self.xvals), np.searchsorted(self.xvals, xmax, side='right')+1)
+        return minMaxDecimate(self.xvals[first:last], self.yvals[first:last], self.plotWidth())
+
+    def redecimate(self):
+        """redecimate: Replaces the line data with the visible trace"""
+        self.line.set_data(*self.visibleTrace())
+
+    def autoscale(self, force=False):
+        """autoscale:
+        Sets the axis limits to the trace if the view is not zoomed
+        INPUTS:
+        force (bool, default False): Set the limits even if the trace still fits
+        RETURNS:
+        True if the limits changed and the figure needs a full redraw"""
+        if self.zoomed or len(self.xvals)==0:
+            return False
+        xlimits=(float(self.xvals[0]), float(self.xvals[-1]))
+        finite=self.yvals[np.isfinite(self.yvals)]
+        if len(finite)==0:
+            return False
+        (ymin, ymax)=(float(finite.min()), float(finite.max()))
+        (oldymin, oldymax)=self.ax.get_ylim()
+        changed=force or xlimits!=tuple(self.ax.get_xlim()) or ymin<oldymin or ymax>oldymax
+        if not changed:
+            return False
+        margin=max(0.05*(ymax-ymin), 1.0)
+        self.settingLimits=True#Not a user zoom
+        try:
+            if xlimits[0]<xlimits[1]:
+                self.ax.set_xlim(*xlimits)
+            self.ax.set_ylim(ymin-margin, ymax+margin)
+        finally:
+            self.settingLimits=False
+        return True
+
+    def drawTrace(self, xvals, yvals):
+        """drawTrace:
+        Shows a new trace, by blitting the line if the axes did not change
+        INPUTS:
+        xvals, yvals (numpy array): The trace"""
+        t0=time.perf_counter()
+        self.xvals=xvals
+        self.yvals=yvals
+        if self.autoscale() or self.background is None:
+            self.redecimate()
+            self.canvas.draw()#Full redraw; onDraw draws the line and saves the background
+        else:
+            self.redecimate()
+            self.canvas.restore_region(self.background)
+            self.ax.draw_artist(self.line)
+            self.canvas.blit(self.ax.bbox)
+        self.frames+=1
+        self.lastFrameTime=time.perf_counter()-t0
+
+    def onDraw(self, event):
+        """onDraw: Saves the background after a full redraw and draws the line on it"""
+        self.background=self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.line)
+        self.canvas.blit(self.ax.bbox)
+
+    def onXLimits(self, ax):
+        """onXLimits: Decimates the trace again for a new zoom or pan"""
+        if not self.settingLimits and len(self.xvals)>0:#Zoomed unless the whole trace is in view
+            (xmin, xmax)=ax.get_xlim()
+            self.zoomed=xmin>self.xvals[0] or xmax<self.xvals[-1]
+        self.redecimate()
@@ -0,0 +1,177 @@
+"""OSASegments.py:
+Segmented wide-span sweeps
+A wavelength range is split into overlapping tiles that are swept in parallel across
+the OSAs of an OSAFleet, or in order on one AQ6380Controls OSA. The tiles are then
+resampled onto one evenly spaced wavelength axis and stitched into a continuous trace.
+In the overlaps the tiles are either blended with linear weights in mW ('blend') or
+cut at the middle of the overlap ('cut'), which avoids the sweep edges of each tile.
+With N OSAs a range takes about 1/N of the single instrument sweep time.
+Depends on AQ6380Controls and OSAFleet libraries
+Depends on pyvisa, pyvisa-py, numpy
+To get dependencies,
+pip install pyvisa
+pip install pyvisa-py
+pip install numpy
+To run: python OSASegments.py start stop [addresses] or py OSASegments.py start stop [addresses] depending on system
+    Example: "python OSASegments.py 1520 1620 192.168.1.177 192.168.1.178 --output scan.csv"
+"""
+import argparse
+import time
+import numpy as np
+from OSAFleet import OSAFleet, acquire
+from OSAExport import saveTrace
+
+stitchMethods=['blend', 'cut']
+defaultOverlapFraction=0.05#Overlap as a fraction of the tile span when not given
+
+def planSegments(start, stop, segments, overlap=None):
+    """planSegments:
+    Splits a wavelength range into equal, overlapping tiles
+    INPUTS:
+    start, stop (float): The range in nm
+    segments (int): Number of tiles
+    overlap (float, default None): Overlap of neighbouring tiles in nm, None for 5% of the tile span
+    RETURNS:
+    A list of (center, span) in nm
+    Throws exception if the range or overlap is invalid"""
+    start=float(start)
+    stop=float(stop)
+    segments=int(segments)
+    if stop<=start or segments<1:
+        raise ValueError(f'Segmented range {start}-{stop} nm in {segments} segments is invalid')
+    if overlap is None:
+        overlap=defaultOverlapFraction*(stop-start)/segments
+    span=(stop-start+(segments-1)*overlap)/segments
+    if segments>1 and overlap>=span:
+        raise ValueError(f'Overlap of {overlap} nm is not smaller than the segment span of {span} nm')
+    return [(start+span/2+idx*(span-overlap), span) for idx in range(segments)]
+
+def segmentWeights(grid, tiles, method='blend'):
+    """segmentWeights:
+    Gets the weight of each tile at each wavelength of the stitched axis
+    INPUTS:
+    grid (numpy array): The stitched wavelength axis
+    tiles (list of (start, stop)): The wavelength range of each tile, in increasing order
+    method (str, default 'blend'): 'blend' for linear weights in the overlaps, 'cut' for the middle of the overlaps
+    RETURNS:
+    A (tiles, points) numpy array of weights"""
+    weights=np.zeros((len(tiles), len(grid)))
+    for (idx, (tilestart, tilestop)) in enumerate(tiles):
+        weight=((grid>=tilestart)&(grid<=tilestop)).astype(np.float64)
+        if idx>0 and tiles[idx-1][1]>tilestart:#Overlap with the previous tile
+            (low, high)=(tilestart, tiles[idx-1][1])
+            if method=='blend':
+                weight*=np.clip((grid-low)/(high-low), 0, 1)
+            else:
+                weight[grid<(low+high)/2]=0
+        if idx<len(tiles)-1 and tiles[idx+1][0]<tilestop:#Overlap with the next tile
+            (low, high)=(tiles[idx+1][0], tilestop)
+            if method=='blend':
+                weight*=np.clip((high-grid)/(high-low), 0, 1)
+            else:
+                weight[grid>=(low+high)/2]=0
+        weights[idx]=weight
+    return weights
+
+def stitchSegments(traces, start=None, stop=None, step=None, method='blend'):
+    """stitchSegments:
+    Resamples tile traces onto one evenly spaced axis and stitches them
+    INPUTS:
+    traces (list of (xvals, yvals)): The tiles in nm and dBm
+    start, stop (float, default None): The stitched range in nm, None for the range of the tiles
+    step (float, default None): Wavelength step in nm, None for the finest tile step
+    method (str, default 'blend'): 'blend' or 'cut', see segmentWeights
+    RETURNS:
+    (xvals, yvals) numpy arrays; wavelengths not covered by any tile are NaN
+    Throws exception if method is invalid or there are no traces"""
+    if method not in stitchMethods:
+        raise ValueError(f'Stitch method of {method} is invalid')
+    traces=sorted([(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)) for (x, y) in traces if len(x)>1],
+                  key=lambda trace: trace[0][0])
+    if not traces:
+        raise ValueError('No traces to stitch')
+    if start is None:
+        start=traces[0][0][0]
+    if stop is None:
+        stop=max(x[-1] for (x, y) in traces)
+    if step is None:
+        step=min((x[-1]-x[0])/(len(x)-1) for (x, y) in traces)
+    grid=np.linspace(start, stop, int(round((stop-start)/step))+1)
+    tiles=[(x[0], x[-1]) for (x, y) in traces]
+    weights=segmentWeights(grid, tiles, method)
+    total=np.zeros(len(grid))
+    for ((x, y), weight) in zip(traces, weights):
+        covered=weight>0
+        if covered.any():#Average in mW; dBm values of neighbouring tiles are not additive
+            total[covered]+=weight[covered]*10**(np.interp(grid[covered], x, y)/10)
+    weightsum=weights.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        yvals=np.where(weightsum>0, 10*np.log10(total/weightsum), np.nan)
+    return (grid, yvals)
+
+def segmentedSweep(target, start, stop, segments=None, overlap=None, step=None, method='blend', **settings):
+    """segmentedSweep:
+    Sweeps a wavelength range in tiles and stitches them into one trace
+    INPUTS:
+    target (OSAFleet or AQ6380Controls): Tiles are swept in parallel across the healthy OSAs
+        of a fleet (see OSAFleet.available), or in order on one OSA
+    start, stop (float): The range in nm
+    segments (int, default None): Number of tiles, None for one per healthy OSA
+    overlap (float, default None): Overlap of neighbouring tiles in nm, None for 5% of the tile span
+    step (float, default None): Stitched wavelength step in nm, None for the finest tile step
+    method (str, default 'blend'): 'blend' or 'cut', see segmentWeights
+    settings: Other configure settings (sensitivity, speed, resolution)
+    RETURNS:
+    (xvals, yvals, tiles) where tiles is a list of dicts with 'address', 'center', 'span',
+    'points' and 'elapsed' (seconds) for each tile
+    Throws exception if a tile sweep fails or no OSA of the fleet is open"""
+    fleet=isinstance(target, OSAFleet)
+    addresses=target.available() if fleet else [None]
+    if len(addresses)==0:
+        raise RuntimeError('No OSA of the fleet is open')
+    if segments is None:
+        segments=len(addresses)
+    plan=planSegments(start, stop, segments, overlap)
+    tiles=[{'address':addresses[idx%len(addresses)], 'center':center, 'span':span} for (idx, (center, span)) in enumerate(plan)]
+    if fleet:#One job per tile; the fleet runs one job at a time per OSA and all OSAs at once
+        futures=[target.submit(tile['address'], acquire, round(tile['center'], 6), round(tile['span'], 6), **settings) for tile in tiles]
+        results=[future.result() for future in futures]
+    else:
+        results=[]
+        for tile in tiles:
+            t0=time.perf_counter()
+            result=acquire(target, round(tile['center'], 6), round(tile['span'], 6), **settings)
+            results.append({'address':None, 'result':result, 'error':None, 'elapsed':time.perf_counter()-t0})
+    for (tile, result) in zip(tiles, results):
+        if result['error'] is not None:
+            raise RuntimeError(f"Segment at {tile['center']:.3f} nm on {tile['address']} failed: {result['error']}")
+        tile['points']=len(result['result'][0])
+        tile['elapsed']=result['elapsed']
+    (xvals, yvals)=stitchSegments([result['result'] for result in results], float(start), float(stop), step, method)
+    return (xvals, yvals, tiles)
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Segmented wide-span sweep across one or more OSAs')
+    parser.add_argument('start', type=float, help='Start wavelength (nm)')
+    parser.add_argument('stop', type=float, help='Stop wavelength (nm)')
+    parser.add_argument('addresses', nargs='*', default=['192.168.1.177'], help='OSA addresses as ip or ip:port')
+    parser.add_argument('--segments', type=int, default=None, help='Number of tiles; default one per OSA')
+    parser.add_argument('--overlap', type=float, default=None, help='Tile overlap (nm)')
+    parser.add_argument('--method', default='blend', choices=stitchMethods, help='Overlap stitching')
+    parser.add_argument('--resolution', default=None, help='Resolution (nm)')
+    parser.add_argument('--sensitivity', default=None, help='Sensitivity')
+    parser.add_argument('--output', default='segmented.csv', help='Output trace file (.csv, .npy, .npz or .aqb)')
+    args=parser.parse_args()
+    settings={name:value for (name, value) in (('resolution', args.resolution), ('sensitivity', args.sensitivity)) if value is not None}
+    fleet=OSAFleet(args.addresses)
+    for (address, error) in fleet.openAll().items():
+        print(f'{address}: {"opened" if error is None else f"failed: {error}"}')
+    try:
+        t0=time.perf_counter()
+        (xvals, yvals, tiles)=segmentedSweep(fleet, args.start, args.stop, args.segments, args.overlap, method=args.method, **settings)
+        for tile in tiles:
+            print(f"{tile['address']}: {tile['center']:.3f} nm span {tile['span']:.3f} nm, {tile['points']} points in {tile['elapsed']:.3f} s")
+        print(f'{len(xvals)} points in {time.perf_counter()-t0:.3f} s')
+        saveTrace(args.output, xvals, yvals)
+    finally:
+        fleet.closeAll()
@@ -0,0 +1,505 @@
+"""OSASimulator.py:
+A local stand-in for the AQ63xx OSA socket interface for offline testing and benchmarking
+Speaks the same newline terminated SCPI protocol as the instrument on port 10001:
+the open "user"/password handshake, CFORM1, :sens settings, :init and :stat:oper:even?
+with sweep times that depend on sensitivity, :calc peak queries
+and :trac:x?/:trac:y? in ascii and binary (REAL,64/REAL,32) formats
+Trace data is taken from a two column wavelength (nm), power (dBm) CSV file such as test1.csv
+Depends on AQ6380Controls library
+Depends on numpy
+To get dependencies,
+pip install numpy
+To run: python OSASimulator.py or py OSASimulator.py depending on system
+    Options: --host, --port, --csv, --latency, --jitter, --timescale, --shared
+    Example: "python OSASimulator.py --port 10001 --csv test1.csv --latency 0.002 --jitter 0.001"
+Then connect to the simulator with osaaddr='127.0.0.1'
+"""
+import argparse
+import os
+import random
+import socketserver
+import threading
+import time
+import numpy as np
+from AQ6380Controls import sensitivities, dBmFromSensitivity, traceFormatTypes
+
+simaddr='127.0.0.1'#Address to listen on
+simport=10001#Port to listen on, same as the instrument
+simcsv=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test1.csv')#Default spectrum
+traceNames=['TRA', 'TRB', 'TRC', 'TRD', 'TRE', 'TRF', 'TRG']
+#Sweep time in seconds for a 10001 point sweep by sensitivity at 1x speed
+sweepTimes={'NORM':0.2, 'MID':0.5, 'HIGH1':2.0, 'HIGH2':5.0, 'HIGH3':15.0,
+            'RAPID1':0.05, 'RAPID2':0.08, 'RAPID3':0.12, 'RAPID4':0.2, 'RAPID5':0.35, 'RAPID6':0.5,
+            'NHLD':0.2, 'NAUT':0.5}
+maxSamplingPoints=200001
+dBmSensitivityNames=set(sensitivities)-{'NHLD', 'NAUT'}#Sensitivities with a noise floor from dBmFromSensitivity
+
+def loadSpectrum(filename):
+    """loadSpectrum:
+    Loads a two column wavelength (nm), power (dBm) CSV file
+    INPUTS:
+    filename (str): The CSV file name
+    RETURNS:
+    (xvals, yvals) numpy arrays sorted by wavelength"""
+    data=np.loadtxt(filename, delimiter=',', ndmin=2)
+    order=np.argsort(data[:, 0])
+    return (data[order, 0], data[order, 1])
+
+def syntheticSpectrum():
+    """syntheticSpectrum:
+    Builds a spectrum with a few lorentzian channels, used when no CSV file is given
+    RETURNS:
+    (xvals, yvals) numpy arrays, wavelength in nm and power in dBm"""
+    xvals=np.linspace(1500, 1650, 150001)
+    linear=np.full(xvals.shape, 1e-9)#-90 dBm background in mW
+    for (center, power) in [(1550.12, 0.0), (1551.72, -3.0), (1608.0, -5.0), (1610.5, -20.0)]:
+        linear+=10**(power/10)/(1+((xvals-center)/0.01)**2)
+    return (xvals, 10*np.log10(linear))
+
+def nodeMatches(nodes, pattern):
+    """nodeMatches:
+    Checks if SCPI header nodes match a pattern of short form mnemonics
+    Long forms match because they start with the short form
+    INPUTS:
+    nodes (list of str): The lower case header nodes, i.e. ['sense', 'wav', 'cent']
+    pattern (str): The short form pattern, i.e. 'sens:wav:cent'
+    RETURNS:
+    True if the nodes match the pattern"""
+    shortnodes=pattern.split(':')
+    if len(nodes)!=len(shortnodes):
+        return False
+    for (node, short) in zip(nodes, shortnodes):
+        if not node.startswith(short):
+            return False
+    return True
+
+def parseLength(value):
+    """parseLength:
+    Parses a SCPI wavelength parameter to meters
+    INPUTS:
+    value (str): The value, i.e. '1608nm', '1.608E-06' or '1608'
+    RETURNS:
+    The value in meters (float)"""
+    value=value.strip().lower()
+    if value.endswith('nm'):
+        return float(value[:-2])*1e-9
+    if value.endswith('um'):
+        return float(value[:-2])*1e-6
+    if value.endswith('m'):
+        return float(value[:-1])
+    number=float(value)
+    return number if number<1e-3 else number*1e-9#Bare numbers are taken as nm
+
+def blockResponse(values, fmt):
+    """blockResponse:
+    Encodes values as an IEEE 488.2 definite length block
+    INPUTS:
+    values (numpy array): The values to encode
+    fmt (str): 'REAL64' or 'REAL32'
+    RETURNS:
+    The block as bytes"""
+    data=np.asarray(values, dtype=traceFormatTypes[fmt]).tobytes()
+    length=str(len(data))
+    return f'#{len(length)}{length}'.encode('ascii')+data
+
+def asciiResponse(values, precision):
+    """asciiResponse:
+    Encodes values as a comma separated string
+    INPUTS:
+    values (numpy array): The values to encode
+    precision (str): printf format of a value, i.e. '%.8E'
+    RETURNS:
+    The response as bytes"""
+    return ','.join(precision % v for v in values).encode('ascii')
+
+class SimulatedOSA:
+    """class SimulatedOSA:
+        The state of one simulated OSA"""
+    def __init__(self, spectrum, timeScale=1.0):
+        """initialize:
+        INPUTS:
+            spectrum (tuple): (xvals, yvals) source spectrum, wavelength in nm and power in dBm
+            timeScale (float, default 1.0): Multiplier for sweep times, i.e. 0.01 for fast tests
+            """
+        self.spectrum=spectrum
+        self.timeScale=timeScale
+        self.lock=threading.RLock()#Held while executing commands, for shared instruments
+        self.center=1608e-9#Sweep settings in meters
+        self.span=10e-9
+        self.resolution=0.02e-9
+        self.sensitivity='MID'
+        self.speed='1x'
+        self.samplingPoints=None#None for auto sampling
+        self.sweepMode=1
+        self.dataFormat='ASCII'
+        self.activeTrace='TRA'
+        self.traces={name:(np.zeros(0), np.zeros(0)) for name in traceNames}#Wavelength in m, power in dBm
+        self.traceAttributes={name:('WRIT' if name=='TRA' else 'FIX') for name in traceNames}
+        self.sweepEnd=None#perf_counter time the running sweep finishes, None if no sweep running
+        self.sweepSettings=None
+        self.eventRegister=0#Bit 0 set when a sweep completes
+        self.calcCategory='filp'
+        self.calcResult=''
+        self.sweepCount=0
+
+    def start(self):
+        """start: Start wavelength in meters"""
+        return self.center-self.span/2
+
+    def stop(self):
+        """stop: Stop wavelength in meters"""
+        return self.center+self.span/2
+
+    def numPoints(self):
+        """numPoints: Number of sampling points for the current settings"""
+        if self.samplingPoints is not None:
+            return self.samplingPoints
+        npoints=int(round(self.span/(self.resolution/5)))+1#Auto: 5 samples per resolution
+        return max(101, min(npoints, maxSamplingPoints))
+
+    def sweepDuration(self):
+        """sweepDuration:
+        Returns the duration of a sweep with the current settings in seconds"""
+        duration=sweepTimes.get(self.sensitivity, 1.0)*self.numPoints()/10001
+        if self.speed=='2x' and self.sensitivity not in ('NHLD', 'NAUT') and not self.sensitivity.startswith('RAPID'):
+            duration/=2
+        return duration*self.timeScale
+
+    def startSweep(self):
+        """startSweep: Starts a sweep with the current settings"""
+        self.sweepSettings=(self.start(), self.stop(), self.numPoints(), self.sensitivity, self.speed)
+        self.sweepEnd=time.perf_counter()+self.sweepDuration()
+
+    def update(self):
+        """update:
+        Finishes the running sweep if its time is up and fills the write traces"""
+        if self.sweepEnd is None or time.perf_counter()<self.sweepEnd:
+            return
+        (start, stop, npoints, sens, speed)=self.sweepSettings
+        xvals=np.linspace(start, stop, npoints)
+        noisefloor=dBmFromSensitivity(sens if sens in dBmSensitivityNames else 'MID', speed)
+        signal=np.interp(xvals*1e9, self.spectrum[0], self.spectrum[1], left=-200, right=-200)
+        linear=10**(signal/10)+10**(noisefloor/10)*np.random.exponential(1.0, npoints)#Noise floor
+        for (name, attribute) in self.traceAttributes.items():#Sweep updates the write traces
+            if attribute.startswith('WRIT'):
+                self.traces[name]=(xvals, 10*np.log10(linear))
+        self.sweepCount+=1
+        self.eventRegister|=1
+        if self.sweepMode==2:#Repeat mode; start the next sweep
+            self.startSweep()
+        else:
+            self.sweepEnd=None
+
+    def waitForSweep(self):
+        """waitForSweep: Blocks until the running sweep is complete, used by *OPC?"""
+        while True:
+            with self.lock:
+                self.update()
+                if self.sweepEnd is None or self.sweepMode==2:
+                    return
+                remaining=self.sweepEnd-time.perf_counter()
+            time.sleep(max(remaining, 0))
+
+    def peak(self, trace='TRA'):
+        """peak: Returns (wavelength in m, power in dBm) of the trace peak"""
+        (xvals, yvals)=self.traces[trace]
+        if len(yvals)==0:
+            return (0.0, -210.0)
+        idx=int(np.argmax(yvals))
+        return (xvals[idx], yvals[idx])
+
+    def calculate(self):
+        """calculate: Runs the selected analysis on trace TRA and stores the :calc:data? response"""
+        (xvals, yvals)=self.traces[self.activeTrace]
+        (peakx, peaky)=self.peak(self.activeTrace)
+        cat=self.calcCategory
+        if cat.startswith('filp'):#Peak wavelength, peak power
+            self.calcResult=f'{peakx:+.8E},{peaky:+.3f}'
+        elif cat.startswith('swth'):#-3 dB threshold width: center wavelength, width
+            above=np.nonzero(yvals>=peaky-3)[0] if len(yvals) else np.zeros(0, dtype=int)
+            if len(above)==0:
+                self.calcResult='+0.00000000E+000,+0.00000000E+000'
+            else:
+                (left, right)=(xvals[above[0]], xvals[above[-1]])
+                self.calcResult=f'{(left+right)/2:+.8E},{right-left:+.8E}'
+        elif cat.startswith('pow'):#Total power in dBm
+            total=np.sum(10**(yvals/10)) if len(yvals) else 0
+            self.calcResult=f'{10*np.log10(total) if total>0 else -210.0:+.3f}'
+        elif cat.startswith('smsr'):#Peak, second peak and suppression ratio
+            if len(yvals)<3:
+                self.calcResult='+0.00000000E+000,-210.000,+0.00000000E+000,-210.000,+0.000,+0.00000000E+000'
+            else:
+                local=np.nonzero((yvals[1:-1]>yvals[:-2])&(yvals[1:-1]>=yvals[2:]))[0]+1
+                local=local[np.abs(xvals[local]-peakx)>self.resolution]#Exclude the main mode
+                idx2=local[np.argmax(yvals[local])] if len(local) else 0
+                self.calcResult=(f'{peakx:+.8E},{peaky:+.3f},{xvals[idx2]:+.8E},{yvals[idx2]:+.3f},'
+                                 f'{peaky-yvals[idx2]:+.3f},{xvals[idx2]-peakx:+.8E}')
+        else:
+            self.calcResult=''
+
+    def traceResponse(self, axis, trace):
+        """traceResponse:
+        Returns the :trac:x?/:trac:y? response for a trace in the selected data format
+        INPUTS:
+        axis (str): 'x' or 'y'
+        trace (str): The trace name, optionally with a 1-based inclusive point range, i.e. 'TRA,1,1'
+        RETURNS:
+        The response as bytes"""
+        args=[arg.strip() for arg in trace.split(',')]
+        (xvals, yvals)=self.traces.get(args[0].upper(), self.traces['TRA'])
+        values=xvals if axis=='x' else yvals
+        if len(args)==3:#Point range
+            values=values[max(int(args[1]), 1)-1:int(args[2])]
+        if self.dataFormat=='ASCII':
+            return asciiResponse(values, '%+.8E' if axis=='x' else '%+.3f')
+        return blockResponse(values, self.dataFormat)
+
+    def execute(self, cmd):
+        """execute:
+        Executes one SCPI command (no semicolons)
+        INPUTS:
+        cmd (str): The command
+        RETURNS:
+        The response as bytes for queries, None for commands"""
+        cmd=cmd.strip()
+        if len(cmd)==0:
+            return None
+        parts=cmd.split(None, 1)
+        header=parts[0].lower()
+        arg=parts[1].strip() if len(parts)>1 else ''
+        isquery=header.endswith('?')
+        nodes=[n for n in header.rstrip('?').split(':') if n]
+        self.update()
+        if header=='*idn?':
+            return b'YOKOGAWA,AQ6380,SIMULATOR,01.00'
+        if header=='*opc?':
+            self.lock.release()#Let other clients of a shared OSA run while blocked
+            try:
+                self.waitForSweep()
+            finally:
+                self.lock.acquire()
+            return b'1'
+        if header=='*cls':
+            self.eventRegister=0
+            return None
+        if header=='*rst':
+            self.__init__(self.spectrum, self.timeScale)
+            return None
+        if header.startswith('cform'):
+            return b'1' if isquery else None
+        if nodes and nodes[0].startswith('sens'):
+            nodes=nodes[1:]#[:SENSe] is optional
+        if nodeMatches(nodes, 'wav:cent'):
+            if isquery:
+                return f'{self.center:+.8E}'.encode('ascii')
+            self.center=parseLength(arg)
+        elif nodeMatches(nodes, 'wav:span'):
+            if isquery:
+                return f'{self.span:+.8E}'.encode('ascii')
+            self.span=parseLength(arg)
+        elif nodeMatches(nodes, 'wav:star'):
+            if isquery:
+                return f'{self.start():+.8E}'.encode('ascii')
+            (start, stop)=(parseLength(arg), self.stop())
+            (self.center, self.span)=((start+stop)/2, stop-start)
+        elif nodeMatches(nodes, 'wav:stop'):
+            if isquery:
+                return f'{self.stop():+.8E}'.encode('ascii')
+            (start, stop)=(self.start(), parseLength(arg))
+            (self.center, self.span)=((start+stop)/2, stop-start)
+        elif nodeMatches(nodes, 'sens'):
+            if isquery:
+                return str(sensitivities.index(self.sensitivity)).encode('ascii')
+            name=arg.upper()
+            if name.isdigit():
+                name=sensitivities[int(name)]
+            if name in sensitivities:
+                self.sensitivity=name
+        elif nodeMatches(nodes, 'swe:spe'):
+            if isquery:
+                return b'1' if self.speed=='2x' else b'0'
+            self.speed='2x' if arg.lower() in ('2x', 'x2', '1') else '1x'
+        elif nodeMatches(nodes, 'band') or nodeMatches(nodes, 'band:res') or nodeMatches(nodes, 'bwid') or nodeMatches(nodes, 'bwid:res'):
+            if isquery:
+                return f'{self.resolution:+.8E}'.encode('ascii')
+            self.resolution=parseLength(arg)
+        elif nodeMatches(nodes, 'swe:poin'):
+            if isquery:
+                return str(self.numPoints()).encode('ascii')
+            self.samplingPoints=max(101, min(int(float(arg)), maxSamplingPoints))
+        elif nodeMatches(nodes, 'swe:poin:auto'):
+            if isquery:
+                return b'1' if self.samplingPoints is None else b'0'
+            if arg.lower() in ('1', 'on'):
+                self.samplingPoints=None
+        elif nodeMatches(nodes, 'init:smod'):
+            if isquery:
+                return str(self.sweepMode).encode('ascii')
+            self.sweepMode=int(float(arg))
+        elif nodeMatches(nodes, 'init'):
+            self.startSweep()
+        elif nodeMatches(nodes, 'abor'):
+            self.sweepEnd=None
+        elif nodeMatches(nodes, 'stat:oper:even'):
+            value=self.eventRegister
+            self.eventRegister=0#Event register is cleared on read
+            return str(value).encode('ascii')
+        elif nodeMatches(nodes, 'stat:oper:cond'):
+            return b'0' if self.sweepEnd is not None else b'1'
+        elif nodeMatches(nodes, 'form:data') or nodeMatches(nodes, 'form'):
+            if isquery:
+                return {'ASCII':b'ASCII', 'REAL64':b'REAL,64', 'REAL32':b'REAL,32'}[self.dataFormat]
+            value=arg.upper().replace(' ', '')
+            if value.startswith('REAL'):
+                self.dataFormat='REAL32' if value.endswith('32') else 'REAL64'
+            else:
+                self.dataFormat='ASCII'
+        elif nodeMatches(nodes, 'trac:copy'):
+            (source, destination)=[t.strip().upper() for t in arg.split(',')]
+            if source in traceNames and destination in traceNames:
+                self.traces[destination]=self.traces[source]
+                self.traceAttributes[destination]='FIX'
+        elif len(nodes)>=2 and nodeMatches(nodes[:2], 'trac:attr'):
+            trace=nodes[2].upper() if len(nodes)>2 else 'TRA'
+            if isquery:
+                return self.traceAttributes.get(trace, 'WRIT').encode('ascii')
+            if trace in traceNames:
+                self.traceAttributes[trace]=arg.upper()[:4]
+        elif nodeMatches(nodes, 'trac:act'):
+            if isquery:
+                return self.activeTrace.encode('ascii')
+            if arg.upper() in traceNames:
+                self.activeTrace=arg.upper()
+        elif nodeMatches(nodes, 'trac:x') or nodeMatches(nodes, 'trac:data:x'):
+            return self.traceResponse('x', arg or 'TRA')
+        elif nodeMatches(nodes, 'trac:y') or nodeMatches(nodes, 'trac:data:y'):
+            return self.traceResponse('y', arg or 'TRA')
+        elif nodeMatches(nodes, 'trac:snum') or nodeMatches(nodes, 'trac:data:snum'):
+            return str(len(self.traces.get(arg.upper() or 'TRA', self.traces['TRA'])[0])).encode('ascii')
+        elif nodeMatches(nodes, 'calc:cat'):
+            if isquery:
+                return self.calcCategory.upper().encode('ascii')
+            self.calcCategory=arg.lower()
+        elif nodeMatches(nodes, 'calc'):
+            self.calculate()
+        elif nodeMatches(nodes, 'calc:data'):
+            return self.calcResult.encode('ascii')
+        elif nodeMatches(nodes, 'calc:mark:max'):
+            pass
+        elif isquery:#Unknown query; answer so the client does not hang
+            return b'0'
+        return None
+
+    def executeLine(self, line):
+        """executeLine:
+        Executes a line of semicolon separated SCPI commands
+        INPUTS:
+        line (str): The line received from the client
+        RETURNS:
+        The response as bytes without terminator, None if no command was a query"""
+        responses=[]
+        with self.lock:
+            for cmd in line.split(';'):
+                response=self.execute(cmd)
+                if response is not None:
+                    responses.append(response)
+        if len(responses)==0:
+            return None
+        return b';'.join(responses)
+
+class OSASimulatorHandler(socketserver.StreamRequestHandler):
+    """class OSASimulatorHandler:
+        Handles one client connection"""
+    rbufsize=1<<16
+    def handle(self):
+        """handle: Runs the login handshake and then executes commands until the client disconnects"""
+        server=self.server
+        osa=server.sharedOSA if server.sharedOSA is not None else SimulatedOSA(server.spectrum, server.timeScale)
+        authenticated=False
+        username=None
+        while True:
+            line=self.rfile.readline()
+            if not line:#Client disconnected
+                return
+            line=line.decode('ascii', errors='replace').strip()
+            if not authenticated:#Login handshake
+                if username is None and line.lower().startswith('open'):
+                    username=line[4:].strip().strip('"')
+                    self.respond(b'AUTHENTICATE CRAM-MD5.')
+                elif username is not None:
+                    authenticated=True#Any password is accepted
+                    self.respond(b'ready')
+                continue
+            response=osa.executeLine(line)
+            if response is not None:
+                self.respond(response)
+
+    def respond(self, response):
+        """respond:
+        Sends a response after the injected latency and jitter
+        INPUTS:
+        response (bytes): The response without terminator"""
+        delay=self.server.latency
+        if self.server.jitter>0:
+            delay+=random.uniform(0, self.server.jitter)
+        if delay>0:
+            time.sleep(delay)
+        self.wfile.write(response+b'\n')
+
+class OSASimulatorServer(socketserver.ThreadingTCPServer):
+    """class OSASimulatorServer:
+        Threaded TCP server, one thread per client"""
+    allow_reuse_address=True
+    daemon_threads=True
+    def __init__(self, address=simaddr, port=simport, spectrum=None, latency=0.0, jitter=0.0, timeScale=1.0, shared=False):
+        """initialize:
+        INPUTS:
+            address (str, default simaddr): The address to listen on
+            port (int, default simport): The port to listen on, 0 for any free port
+            spectrum (tuple, default None): (xvals, yvals) source spectrum, None for a synthetic spectrum
+            latency (float, default 0.0): Delay added to every response in seconds
+            jitter (float, default 0.0): Maximum random delay added to every response in seconds
+            timeScale (float, default 1.0): Multiplier for sweep times
+            shared (bool, default False): All clients share one instrument state if True,
+                otherwise every connection gets its own simulated OSA
+            """
+        self.spectrum=spectrum if spectrum is not None else syntheticSpectrum()
+        self.latency=latency
+        self.jitter=jitter
+        self.timeScale=timeScale
+        self.sharedOSA=SimulatedOSA(self.spectrum, timeScale) if shared else None
+        super().__init__((address, int(port)), OSASimulatorHandler)
+
+def startSimulator(address=simaddr, port=0, csvfile=None, **kwargs):
+    """startSimulator:
+    Starts a simulator server in a background thread
+    INPUTS:
+    address (str, default simaddr): The address to listen on
+    port (int, default 0): The port to listen on, 0 for any free port
+    csvfile (str, default None): Spectrum CSV file, None for a synthetic spectrum
+    kwargs: Other OSASimulatorServer options (latency, jitter, timeScale, shared)
+    RETURNS:
+    The running OSASimulatorServer; its port is server.server_address[1]
+    Call server.shutdown() to stop it"""
+    spectrum=loadSpectrum(csvfile) if csvfile is not None else None
+    server=OSASimulatorServer(address, port, spectrum, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='AQ63xx OSA socket simulator')
+    parser.add_argument('--host', default=simaddr, help='Address to listen on')
+    parser.add_argument('--port', type=int, default=simport, help='Port to listen on')
+    parser.add_argument('--csv', default=simcsv if os.path.exists(simcsv) else None, help='Spectrum CSV file (wavelength nm, dBm)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Delay added to every response (s)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Maximum random delay added to every response (s)')
+    parser.add_argument('--timescale', type=float, default=1.0, help='Multiplier for sweep times')
+    parser.add_argument('--shared', action='store_true', help='All clients share one instrument state')
+    args=parser.parse_args()
+    spectrum=loadSpectrum(args.csv) if args.csv else None
+    server=OSASimulatorServer(args.host, args.port, spectrum, args.latency, args.jitter, args.timescale, args.shared)
+    print(f'OSA simulator listening on {args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
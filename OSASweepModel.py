@@ -0,0 +1,241 @@
+"""OSASweepModel.py:
+Learned sweep time model and fastest sensitivity selection
+SweepTimeModel learns how long sweeps take from completed sweeps, per sensitivity and
+speed, as a linear function of span/resolution (the number of resolution elements swept).
+Settings that were never swept are predicted from the learned ones using the typical
+time ratios between sensitivities in sensitivityTimeFactors.
+autoConfigure picks the fastest sensitivity and speed whose noise floor (dBmFromSensitivity)
+is at least a margin below the measured signal, i.e. RAPID3 instead of HIGH3 for a strong
+laser line, and writes it to the OSA.
+Attach a model to an OSA so every singleSweep teaches it and its first poll is timed from it:
+    model=SweepTimeModel.load('sweepmodel.json')
+    osa.sweepModel=model
+    autoConfigure(osa, model, margin=40)
+Depends on AQ6380Controls library
+Depends on pyvisa, pyvisa-py, numpy
+To get dependencies,
+pip install pyvisa
+pip install pyvisa-py
+pip install numpy
+To run: python OSASweepModel.py span resolution or py OSASweepModel.py span resolution depending on system
+    Prints predicted sweep times and noise floors of every sensitivity
+    Example: "python OSASweepModel.py 100 0.02 --model sweepmodel.json --signal -20 --margin 40"
+"""
+import argparse
+import json
+import os
+import threading
+from AQ6380Controls import fixedSensitivities, rapidSensitivities, tradSensitivities, dBmFromSensitivity
+
+sensitivityTimeFactors={'NORM':1.0, 'MID':2.5, 'HIGH1':10.0, 'HIGH2':25.0, 'HIGH3':75.0,
+                        'RAPID1':0.25, 'RAPID2':0.4, 'RAPID3':0.6, 'RAPID4':1.0, 'RAPID5':1.75, 'RAPID6':2.5}#Typical sweep time relative to NORM 1x
+fastSpeedFactor=0.5#Sweep time of 2x speed relative to 1x for traditional sensitivities
+probeSensitivity='RAPID1'#Fastest sensitivity; used to measure the signal when it is not known
+
+def sweepSpeedOf(sensitivity, speed):
+    """sweepSpeedOf: RETURNS: The speed that applies to a sensitivity; rapid sensitivities have no 2x speed"""
+    if sensitivity in rapidSensitivities or speed is None:
+        return '1x'
+    return str(speed).lower().replace('x2', '2x').replace('x1', '1x')
+
+def timeFactor(sensitivity, speed):
+    """timeFactor: RETURNS: The typical sweep time of a sensitivity and speed relative to NORM 1x"""
+    factor=sensitivityTimeFactors.get(sensitivity, 1.0)
+    if sweepSpeedOf(sensitivity, speed)=='2x':
+        factor*=fastSpeedFactor
+    return factor
+
+def sweepElements(span, resolution):
+    """sweepElements: RETURNS: The number of resolution elements in a span, the size feature of the model"""
+    return float(span)/float(resolution)
+
+class SweepTimeModel:
+    """class SweepTimeModel:
+        Sweep time as a + b*span/resolution, fitted per sensitivity and speed from completed sweeps"""
+    def __init__(self, fits=None):
+        """initialize:
+        INPUTS:
+            fits (dict, default None): Saved sums by 'sensitivity speed' key, see save
+            """
+        self.lock=threading.Lock()
+        self.fits={key:dict(value) for (key, value) in (fits or {}).items()}#key: {'n', 'x', 'y', 'xx', 'xy'} sums
+
+    @staticmethod
+    def key(sensitivity, speed):
+        """key: RETURNS: The fits key of a sensitivity and speed"""
+        sensitivity=str(sensitivity).upper()
+        return f'{sensitivity} {sweepSpeedOf(sensitivity, speed)}'
+
+    def observe(self, settings, seconds):
+        """observe:
+        Adds a completed sweep
+        INPUTS:
+        settings (dict): 'sensitivity', 'speed', 'span' (nm) and 'resolution' (nm), i.e. AQ6380Controls.settings
+        seconds (float): The sweep duration
+        RETURNS:
+        True if the sweep was added, False if its settings are incomplete"""
+        try:
+            x=sweepElements(settings['span'], settings['resolution'])
+            key=self.key(settings['sensitivity'], settings.get('speed'))
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):#Settings not known, i.e. set from the front panel
+            return False
+        with self.lock:
+            fit=self.fits.setdefault(key, {'n':0, 'x':0.0, 'y':0.0, 'xx':0.0, 'xy':0.0})
+            fit['n']+=1
+            fit['x']+=x
+            fit['y']+=seconds
+            fit['xx']+=x*x
+            fit['xy']+=x*seconds
+        return True
+
+    def fitted(self, key, x):
+        """fitted:
+        Predicts from the fit of one key
+        INPUTS:
+        key (str): The fits key
+        x (float): Resolution elements
+        RETURNS:
+        Seconds, None if the key was never swept"""
+        fit=self.fits.get(key)
+        if fit is None or fit['n']==0:
+            return None
+        n=fit['n']
+        variance=n*fit['xx']-fit['x']**2
+        if n<2 or variance<=1e-9*max(fit['xx']*n, 1.0):#One span only; scale with the size
+            return fit['y']/fit['x']*x if fit['x']>0 else fit['y']/n
+        slope=(n*fit['xy']-fit['x']*fit['y'])/variance
+        intercept=(fit['y']-slope*fit['x'])/n
+        if slope<0 or intercept<0:#Noisy fit; fall back to proportional scaling
+            return fit['y']/fit['x']*x if fit['x']>0 else fit['y']/n
+        return intercept+slope*x
+
+    def predict(self, settings):
+        """predict:
+        Predicts the duration of a sweep
+        INPUTS:
+        settings (dict): 'sensitivity', 'speed', 'span' (nm) and 'resolution' (nm)
+        RETURNS:
+        Seconds, None if the settings are incomplete or nothing was learned yet"""
+        try:
+            x=sweepElements(settings['span'], settings['resolution'])
+            sensitivity=str(settings['sensitivity']).upper()
+            speed=settings.get('speed')
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            return None
+        with self.lock:
+            seconds=self.fitted(self.key(sensitivity, speed), x)
+            if seconds is not None:
+                return seconds
+            #Scale the other sensitivities by their typical time ratio, weighted by their sweep counts
+            (total, weight)=(0.0, 0)
+            for (key, fit) in self.fits.items():
+                (othersens, otherspeed)=key.split(' ')
+                estimate=self.fitted(key, x)
+                if estimate is not None:
+                    total+=estimate/timeFactor(othersens, otherspeed)*fit['n']
+                    weight+=fit['n']
+        if weight==0:
+            return None
+        return total/weight*timeFactor(sensitivity, speed)
+
+    def save(self, filename):
+        """save: Saves the model as JSON to filename"""
+        with self.lock:
+            with open(filename, 'w') as fp:
+                json.dump({'fits':self.fits}, fp, indent=2)
+
+    @classmethod
+    def load(cls, filename):
+        """load: Loads a model saved with save from filename, or a new model if the file does not exist; RETURNS: The SweepTimeModel"""
+        if not os.path.exists(filename):
+            return cls()
+        with open(filename, 'r') as fp:
+            return cls(json.load(fp).get('fits'))
+
+def candidateSettings(candidates=None):
+    """candidateSettings:
+    Lists sensitivity and speed pairs
+    INPUTS:
+    candidates (list of str, default None): Sensitivities to consider, None for fixedSensitivities
+    RETURNS:
+    A list of (sensitivity, speed); traditional sensitivities at 1x and 2x"""
+    pairs=[]
+    for sensitivity in candidates or fixedSensitivities:
+        sensitivity=sensitivity.upper()
+        pairs.append((sensitivity, '1x'))
+        if sensitivity in tradSensitivities:
+            pairs.append((sensitivity, '2x'))
+    return pairs
+
+def chooseSensitivity(model, signal, margin, span, resolution, candidates=None):
+    """chooseSensitivity:
+    Picks the fastest sensitivity and speed whose noise floor is at least margin below the signal
+    INPUTS:
+    model (SweepTimeModel): The model, None to rank by sensitivityTimeFactors only
+    signal (float): The signal power in dBm, i.e. the weakest peak that must be measured
+    margin (float): Required dB between the signal and the noise floor
+    span, resolution (float): The sweep span and resolution in nm
+    candidates (list of str, default None): Sensitivities to consider, None for fixedSensitivities
+    RETURNS:
+    A dict with 'sensitivity', 'speed', 'floor' (dBm), 'predicted' (seconds, None if unknown)
+    and 'met' (False if no candidate meets the margin; the lowest noise floor is picked then)"""
+    settings={'span':span, 'resolution':resolution}
+    options=[]
+    for (sensitivity, speed) in candidateSettings(candidates):
+        floor=dBmFromSensitivity(sensitivity, speed)
+        predicted=model.predict(dict(settings, sensitivity=sensitivity, speed=speed)) if model is not None else None
+        rank=predicted if predicted is not None else timeFactor(sensitivity, speed)
+        options.append({'sensitivity':sensitivity, 'speed':speed, 'floor':floor, 'predicted':predicted, 'rank':rank})
+    passing=[option for option in options if option['floor']<=signal-margin]
+    if passing:
+        best=min(passing, key=lambda option: (option['rank'], option['floor']))
+        best['met']=True
+    else:
+        best=min(options, key=lambda option: (option['floor'], option['rank']))
+        best['met']=False
+    del best['rank']
+    return best
+
+def autoConfigure(osa, model, margin, signal=None, candidates=None):
+    """autoConfigure:
+    Sets the fastest sensitivity and speed that keep the noise floor margin below the signal
+    INPUTS:
+    osa (AQ6380Controls): A connected OSA with span and resolution set through configure
+    model (SweepTimeModel): The model, None to rank by sensitivityTimeFactors only
+    margin (float): Required dB between the signal and the noise floor
+    signal (float, default None): The signal in dBm, None for the peak power of the last sweep,
+        or of a probe sweep at probeSensitivity if this OSA has not swept yet
+    candidates (list of str, default None): Sensitivities to consider, None for fixedSensitivities
+    RETURNS:
+    The chooseSensitivity dict with 'signal' (dBm) added
+    Throws exception if span or resolution are unknown or the probe sweep fails"""
+    if 'span' not in osa.settings or 'resolution' not in osa.settings:
+        raise ValueError('Set span and resolution with configure before choosing a sensitivity')
+    if signal is None:
+        if osa.sweepCount==0:
+            osa.configure(sensitivity=probeSensitivity)
+            if not osa.singleSweep():
+                raise RuntimeError('Probe sweep failed or was cancelled')
+        signal=osa.analyze(['peak']).peakPower
+    choice=chooseSensitivity(model, signal, margin, osa.settings['span'], osa.settings['resolution'], candidates)
+    osa.configure(sensitivity=choice['sensitivity'], speed=choice['speed'] if choice['sensitivity'] in tradSensitivities else None)
+    choice['signal']=signal
+    return choice
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Predicted sweep time and noise floor of each sensitivity')
+    parser.add_argument('span', type=float, help='Span (nm)')
+    parser.add_argument('resolution', type=float, help='Resolution (nm)')
+    parser.add_argument('--model', default='sweepmodel.json', help='Model file saved by SweepTimeModel.save')
+    parser.add_argument('--signal', type=float, default=None, help='Signal power (dBm) to pick a sensitivity for')
+    parser.add_argument('--margin', type=float, default=40.0, help='Required noise floor margin below the signal (dB)')
+    args=parser.parse_args()
+    model=SweepTimeModel.load(args.model)
+    for (sensitivity, speed) in candidateSettings():
+        predicted=model.predict({'sensitivity':sensitivity, 'speed':speed, 'span':args.span, 'resolution':args.resolution})
+        print(f"{sensitivity:7s} {speed} {dBmFromSensitivity(sensitivity, speed):4d} dBm "
+              f"{'unknown' if predicted is None else f'{predicted:.3f} s'}")
+    if args.signal is not None:
+        choice=chooseSensitivity(model, args.signal, args.margin, args.span, args.resolution)
+        print(f"Fastest with {args.margin} dB margin: {choice['sensitivity']} {choice['speed']}"
+              f"{'' if choice['met'] else ' (margin not met)'}")
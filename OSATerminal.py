@@ -4,15 +4,18 @@ raw SCPI commands to/from the OSA
 Depends on AQ6380Controls library
 Depends on pyvisa
 Depends on pyvisa-py as visa interface
+Depends on numpy
 To get dependencies,
 pip install pyvisa
 pip install pyvisa-py
+pip install numpy
 To run: python OSATerminal.py or py OSATerminal.py depending on system
 """
 from AQ6380Controls import AQ6380Controls
 osaaddr='192.168.1.177'
+osaport='10001'#OSA port; the OSABroker.py port (i.e. '10101') shares one connection with other tools
 if __name__=='__main__':
-    osa=AQ6380Controls(osaaddr)#Set up AQ6380Controls object
+    osa=AQ6380Controls(osaaddr, port=osaport)#Set up AQ6380Controls object
     osa.open()
     while True:
         #Poll command line for command and then send it to the OSA
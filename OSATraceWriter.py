@@ -0,0 +1,240 @@
+"""OSATraceWriter.py:
+Background writer that saves traces to CSV files while the OSA keeps sweeping
+Traces are handed over through a bounded queue and written by a separate thread
+Modes:
+    'overwrite': Only the latest trace is kept; the file is replaced atomically. The format is taken
+                 from the file extension: .csv, .npy, .npz or .aqb (see OSAExport)
+    'append': Every trace is appended to one file
+    'rotate': Like append, but a new numbered file is started after a size or age limit
+    'archive': Every trace is appended to a binary sweep archive (see OSAArchive); when the number
+               of points changes a new numbered archive is started, i.e. name_0001.aqd
+In append and rotate modes each trace starts with a comment line
+"# sweep N timestamp" that np.loadtxt skips
+When the queue is full the drop policy decides what happens:
+    'block': Wait for the writer (backpressure on acquisition)
+    'dropNewest': Discard the new trace
+    'dropOldest': Discard the oldest queued trace
+"""
+import os
+import queue
+import threading
+import time
+from OSAArchive import SweepArchive
+from OSAExport import formatCsv, exportFormat, saveTrace
+
+writeModes=['overwrite', 'append', 'rotate', 'archive']
+dropPolicies=['block', 'dropNewest', 'dropOldest']
+
+class TraceWriter(threading.Thread):
+    """class TraceWriter:
+        Writes queued traces to disk in a background thread"""
+    def __init__(self, filename, mode='overwrite', queueSize=8, dropPolicy='block', rotateBytes=None, rotateSeconds=None,
+                 precision=None):
+        """initialize:
+        INPUTS:
+            filename (str): The CSV file; in rotate mode files are named name_0001.csv, name_0002.csv...
+                from the first number not used yet
+                in archive mode the archive name
+            mode (str, default 'overwrite'): 'overwrite', 'append', 'rotate' or 'archive'
+            queueSize (int, default 8): Number of traces that can wait to be written
+            dropPolicy (str, default 'block'): 'block', 'dropNewest' or 'dropOldest'
+            rotateBytes (int, default None): Start a new file after this many bytes (rotate mode)
+            rotateSeconds (float, default None): Start a new file after this many seconds (rotate mode)
+            precision (int or (int, int), default None): CSV decimals for x and y, None for the shortest exact repr
+            Throws exception if mode or dropPolicy is invalid, or the overwrite mode file extension is unknown
+            """
+        super().__init__(daemon=True)
+        if mode not in writeModes:
+            raise ValueError(f'Write mode of {mode} is invalid')
+        if dropPolicy not in dropPolicies:
+            raise ValueError(f'Drop policy of {dropPolicy} is invalid')
+        if mode=='overwrite':
+            exportFormat(filename)
+        self.filename=filename
+        self.mode=mode
+        self.dropPolicy=dropPolicy
+        self.rotateBytes=rotateBytes
+        self.rotateSeconds=rotateSeconds
+        self.precision=precision
+        self.queue=queue.Queue(maxsize=queueSize)
+        self.statsLock=threading.Lock()
+        self.received=0#Traces handed to put
+        self.written=0
+        self.dropped=0
+        self.errors=0
+        self.bytesWritten=0
+        self.startTime=time.perf_counter()
+        self.fileIndex=0
+        self.fp=None
+        self.fileBytes=0
+        self.fileOpened=0.0
+        self.currentFile=None
+        self.archive=None
+        self.closing=False#Sentinel queued by close
+
+    def put(self, xvals, yvals, timestamp=None, settings=None):
+        """put:
+        Queues a trace for writing
+        INPUTS:
+        xvals, yvals (numpy array): The trace; it must not be modified afterwards
+        timestamp (float, default None): Acquisition time (time.time()), None for now
+        settings (dict, default None): Sweep settings for the archive index, i.e. AQ6380Controls.settings
+        RETURNS:
+        True if the trace was queued, False if it was dropped"""
+        item=(xvals, yvals, time.time() if timestamp is None else timestamp, dict(settings or {}))
+        with self.statsLock:
+            self.received+=1
+        if self.dropPolicy=='block':
+            self.queue.put(item)
+            return True
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except queue.Full:
+                if self.dropPolicy=='dropNewest':
+                    with self.statsLock:
+                        self.dropped+=1
+                    return False
+                try:#dropOldest: remove one waiting trace and try again
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    with self.statsLock:
+                        self.dropped+=1
+                except queue.Empty:
+                    pass
+
+    def openFile(self):
+        """openFile: Opens the next output file for append or rotate mode"""
+        if self.fp is not None:
+            self.fp.close()
+        if self.mode=='rotate':#Next unused number, so files of an earlier run are kept
+            (base, ext)=os.path.splitext(self.filename)
+            while True:
+                self.fileIndex+=1
+                self.currentFile=f'{base}_{self.fileIndex:04d}{ext}'
+                if not os.path.exists(self.currentFile):
+                    break
+            self.fp=open(self.currentFile, 'w')
+        else:
+            self.currentFile=self.filename
+            self.fp=open(self.currentFile, 'a')
+        self.fileBytes=0
+        self.fileOpened=time.time()
+
+    def openArchive(self, points):
+        """openArchive:
+        Opens the archive for traces of a number of points; the first archive that is new
+        or has that number of points, trying name, name_0001, name_0002...
+        INPUTS:
+        points (int): Points per trace"""
+        if self.archive is not None:
+            self.archive.close()
+            print(f'Trace has {points} points; archive {self.archive.dataFile} has {self.archive.points}, starting a new archive')
+        base=os.path.splitext(self.filename)[0]#tracedata.csv -> tracedata.aqd
+        while True:
+            name=base if self.fileIndex==0 else f'{base}_{self.fileIndex:04d}'
+            archive=SweepArchive(name, 'a')
+            if archive.points in (None, points):
+                break
+            archive.close()
+            self.fileIndex+=1
+        self.archive=archive
+        self.currentFile=archive.dataFile
+
+    def needsRotation(self):
+        """needsRotation: True if the current rotate mode file is over its size or age limit"""
+        if self.rotateBytes is not None and self.fileBytes>=self.rotateBytes:
+            return True
+        if self.rotateSeconds is not None and time.time()-self.fileOpened>=self.rotateSeconds:
+            return True
+        return False
+
+    def writeTrace(self, xvals, yvals, timestamp, settings):
+        """writeTrace:
+        Writes one trace according to the mode
+        INPUTS:
+        xvals, yvals (numpy array): The trace
+        timestamp (float): Acquisition time
+        settings (dict): Sweep settings
+        RETURNS:
+        The number of bytes written"""
+        if self.mode=='archive':
+            if self.archive is None or self.archive.points not in (None, len(yvals)):
+                self.openArchive(len(yvals))
+            self.archive.append(xvals, yvals, timestamp, settings)
+            return len(yvals)*self.archive.dtype.itemsize
+        if self.mode=='overwrite':#Write to a temporary file and replace; readers never see half a trace
+            tempname=self.filename+'.tmp'
+            nbytes=saveTrace(tempname, xvals, yvals, fmt=exportFormat(self.filename), precision=self.precision)
+            os.replace(tempname, self.filename)
+            self.currentFile=self.filename
+            return nbytes
+        text=formatCsv(xvals, yvals, self.precision)
+        if self.fp is None or (self.mode=='rotate' and self.needsRotation()):
+            self.openFile()
+        header=f'# sweep {self.written+1} {time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(timestamp))}.{int(timestamp%1*1000):03d}\n'
+        self.fp.write(header)
+        self.fp.write(text)
+        self.fp.flush()
+        self.fileBytes+=len(header)+len(text)
+        return len(header)+len(text)
+
+    def run(self):
+        """run: Writer thread; writes traces until close is called"""
+        while True:
+            item=self.queue.get()
+            try:
+                if item is None:#Sentinel from close
+                    return
+                nbytes=self.writeTrace(*item)
+                with self.statsLock:
+                    self.written+=1
+                    self.bytesWritten+=nbytes
+            except Exception as e:
+                print(f'Trace write error: {e}')
+                with self.statsLock:
+                    self.errors+=1
+            finally:
+                self.queue.task_done()
+
+    def close(self, timeout=None):
+        """close:
+        Writes the remaining queued traces and stops the writer thread
+        INPUTS:
+        timeout (float, default None): Seconds to wait for the writer, None to wait until done
+        Throws TimeoutError if the writer is still running after timeout; the files are left open
+        for it and close can be called again"""
+        if not self.closing:
+            self.closing=True
+            self.queue.put(None)
+        self.join(timeout)
+        if self.is_alive():#Still writing; closing the files now would cut a trace short
+            raise TimeoutError(f'Trace writer did not finish within {timeout} s, {self.queue.qsize()} traces queued')
+        if self.fp is not None:
+            self.fp.close()
+            self.fp=None
+        if self.archive is not None:
+            self.archive.close()
+            self.archive=None
+
+    def stats(self):
+        """stats:
+        Gets writer statistics
+        RETURNS:
+        A dict with 'received', 'written', 'dropped', 'errors', 'queueDepth',
+        'bytesWritten', 'elapsed' (seconds), 'tracesPerSecond' and 'file'"""
+        with self.statsLock:
+            elapsed=time.perf_counter()-self.startTime
+            return {'received':self.received, 'written':self.written, 'dropped':self.dropped, 'errors':self.errors,
+                    'queueDepth':self.queue.qsize(), 'bytesWritten':self.bytesWritten, 'elapsed':elapsed,
+                    'tracesPerSecond':self.received/elapsed if elapsed>0 else 0.0, 'file':self.currentFile}
+
+    def statsLine(self):
+        """statsLine:
+        Gets writer statistics as one line of text
+        RETURNS:
+        The stats line (str)"""
+        s=self.stats()
+        return (f"{s['tracesPerSecond']:.2f} sweeps/s, queue {s['queueDepth']}/{self.queue.maxsize}, "
+                f"{s['written']} written, {s['dropped']} dropped, {s['bytesWritten']/1e6:.1f} MB written")
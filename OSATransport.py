@@ -0,0 +1,350 @@
+"""OSATransport.py:
+Connection backends for AQ6380Controls
+The OSA remote protocol is newline terminated SCPI text over TCP (port 10001), with
+trace data as IEEE 488.2 definite length blocks (#NLLLL<data>). Two backends speak it:
+    'pyvisa': pyvisa/pyvisa-py TCPIP SOCKET resource, as in AQ63XX_Python_visa_SOCKET.py
+    'socket': A plain TCP socket with a large receive buffer and TCP_NODELAY. Replies are
+              read in large chunks; binary blocks are received in one pass straight into a
+              preallocated buffer of the block length.
+Both offer open, close, write, query, queryBlock, queryBlocks (compound queries), a timeout in milliseconds and
+timeoutErrors, so AQ6380Controls works the same over either of them.
+Depends on pyvisa, pyvisa-py for the 'pyvisa' backend only
+To get dependencies,
+pip install pyvisa
+pip install pyvisa-py
+"""
+import socket
+
+transports=['pyvisa', 'socket']#Connection backends, see createTransport
+receiveBufferSize=4<<20#Socket receive buffer in bytes; holds a whole 200k point REAL64 trace
+receiveChunkSize=1<<16#Bytes read per recv for text replies
+pyvisa=None#Loaded on first use, see loadPyvisa
+
+def loadPyvisa():
+    """loadPyvisa:
+    Imports pyvisa on first use
+    RETURNS:
+    The pyvisa module"""
+    global pyvisa
+    if pyvisa is None:
+        import pyvisa as visamodule
+        pyvisa=visamodule
+    return pyvisa
+
+def createTransport(name, resourceManager=None):
+    """createTransport:
+    Creates an unconnected transport
+    INPUTS:
+    name (str): One of transports
+    resourceManager (function, default None): 'pyvisa' only; returns the pyvisa.ResourceManager to use,
+        None for a new one
+    RETURNS:
+    A PyvisaTransport or SocketTransport
+    Throws exception if name is invalid"""
+    if name=='pyvisa':
+        return PyvisaTransport(resourceManager)
+    if name=='socket':
+        return SocketTransport()
+    raise ValueError(f'Transport of {name} is invalid, use one of {transports}')
+
+class PyvisaTransport:
+    """class PyvisaTransport:
+        Connection through a pyvisa TCPIP SOCKET resource"""
+    name='pyvisa'
+    def __init__(self, resourceManager=None):
+        """initialize:
+        INPUTS:
+            resourceManager (function, default None): Returns the pyvisa.ResourceManager, None for a new one
+            """
+        self.resourceManager=resourceManager
+        self.resource=None
+        self.timeoutErrors=()#Exceptions raised when a read times out; set on open
+
+    def open(self, address, port, timeout=5000):
+        """open:
+        Opens the resource; the caller signs in
+        INPUTS:
+        address (str), port (str or int): The OSA address
+        timeout (int, default 5000): Connect timeout in ms"""
+        visa=loadPyvisa()
+        manager=self.resourceManager() if self.resourceManager is not None else visa.ResourceManager()
+        self.resource=manager.open_resource(f'TCPIP::{address}::{port}::SOCKET', open_timeout=timeout)
+        self.resource.read_termination='\n'
+        self.resource.write_termination='\n'
+        self.timeoutErrors=(visa.errors.VisaIOError,)
+        self.setNoDelay()
+
+    def setNoDelay(self):
+        """setNoDelay:
+        Turns off small packet coalescing on the connection so a short command
+        is sent without waiting for the OSA to acknowledge the previous one"""
+        try:
+            self.resource.set_visa_attribute(loadPyvisa().constants.VI_ATTR_TCPIP_NODELAY, True)
+        except Exception:#pyvisa-py cannot set this attribute; set it on its socket
+            session=getattr(self.resource.visalib, 'sessions', {}).get(self.resource.session)
+            interface=getattr(session, 'interface', None)
+            if interface is not None:
+                interface.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def close(self):
+        """close: Closes the resource"""
+        if self.resource is not None:
+            self.resource.close()
+        self.resource=None
+
+    @property
+    def timeout(self):
+        """timeout: The read timeout in ms"""
+        return self.resource.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.resource.timeout=value
+
+    def write(self, cmd):
+        """write: Sends a command RETURNS: The number of bytes sent"""
+        return self.resource.write(cmd)
+
+    def query(self, cmd):
+        """query: Sends a command RETURNS: The reply line without its terminator (str)"""
+        return self.resource.query(cmd)
+
+    def queryBlock(self, cmd):
+        """queryBlock:
+        Sends a query that returns an IEEE 488.2 block
+        INPUTS:
+        cmd (str): The command
+        RETURNS:
+        (data, received) where data is the block data (bytes), or the reply (str) if it is not a block,
+        and received is the number of bytes read"""
+        self.resource.write(cmd)
+        start=self.resource.read_bytes(1)#'#'
+        if start!=b'#':#Not a block; ascii response, read rest of line unless this was its terminator
+            raw=start if start==b'\n' else start+self.resource.read_raw()
+            return (raw.decode('ascii').rstrip('\r\n'), len(raw))
+        ndigits=int(self.resource.read_bytes(1))
+        if ndigits==0:
+            raise ValueError('Indefinite length blocks are not supported')
+        length=int(self.resource.read_bytes(ndigits))
+        data=self.resource.read_bytes(length)#Read whole block
+        if self.readSeparator()!=b'\n':#Terminator
+            raise ValueError('Unexpected data after block')
+        return (data, 2+ndigits+length+1)
+
+    def readSeparator(self):
+        """readSeparator:
+        Reads the byte after a block; a carriage return ahead of the terminator is skipped
+        RETURNS:
+        b';' between replies, the newline at the end of the line, otherwise the unexpected byte"""
+        end=self.resource.read_bytes(1)
+        if end==b'\r':
+            end=self.resource.read_bytes(1)
+        return end
+
+    def queryBlocks(self, cmd, count):
+        """queryBlocks:
+        Sends a compound query whose replies are IEEE 488.2 blocks separated by ';'
+        INPUTS:
+        cmd (str): The command
+        count (int): The number of replies
+        RETURNS:
+        (replies, received) where replies is a list of the block data (bytes) of each reply, and from
+        the first reply that is not a block on, the rest of the line split at ';' (str),
+        and received is the number of bytes read"""
+        self.resource.write(cmd)
+        (replies, received)=([], 0)
+        while len(replies)<count:
+            start=self.resource.read_bytes(1)#'#'
+            if start!=b'#':#Not a block; ascii responses, read rest of line unless this was its terminator
+                raw=start if start==b'\n' else start+self.resource.read_raw()
+                replies.extend(raw.decode('ascii').rstrip('\r\n').split(';'))
+                return (replies, received+len(raw))
+            ndigits=int(self.resource.read_bytes(1))
+            if ndigits==0:
+                raise ValueError('Indefinite length blocks are not supported')
+            length=int(self.resource.read_bytes(ndigits))
+            replies.append(self.resource.read_bytes(length))#Read whole block
+            separator=self.readSeparator()
+            if separator not in (b';', b'\n'):
+                raise ValueError('Unexpected data after block')
+            received+=2+ndigits+length+1
+            if separator==b'\n' and len(replies)<count:#Line ended early
+                break
+        return (replies, received)
+
+class SocketTransport:
+    """class SocketTransport:
+        Connection through a plain TCP socket"""
+    name='socket'
+    timeoutErrors=(socket.timeout,)
+    def __init__(self, bufferSize=receiveBufferSize, chunkSize=receiveChunkSize):
+        """initialize:
+        INPUTS:
+            bufferSize (int, default receiveBufferSize): Socket receive buffer in bytes
+            chunkSize (int, default receiveChunkSize): Bytes read per recv for text replies
+            """
+        self.bufferSize=bufferSize
+        self.chunkSize=chunkSize
+        self.sock=None
+        self.pending=bytearray()#Received bytes not yet returned
+        self.timeoutms=2000#Read timeout in ms; the pyvisa default
+
+    def open(self, address, port, timeout=5000):
+        """open:
+        Connects the socket; the caller signs in
+        INPUTS:
+        address (str), port (str or int): The OSA address
+        timeout (int, default 5000): Connect timeout in ms"""
+        sock=socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.bufferSize)#Before connect so the window scales
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(timeout/1000)
+            sock.connect((address, int(port)))
+            sock.settimeout(self.timeoutms/1000)
+        except Exception:
+            sock.close()
+            raise
+        self.sock=sock
+        self.pending=bytearray()
+
+    def close(self):
+        """close: Closes the socket"""
+        if self.sock is not None:
+            self.sock.close()
+        self.sock=None
+        self.pending=bytearray()
+
+    @property
+    def timeout(self):
+        """timeout: The read timeout in ms"""
+        return self.timeoutms
+
+    @timeout.setter
+    def timeout(self, value):
+        self.timeoutms=value
+        if self.sock is not None:
+            self.sock.settimeout(value/1000 if value is not None else None)
+
+    def receive(self):
+        """receive:
+        Reads the next chunk into the pending bytes
+        Throws ConnectionError if the OSA closed the connection"""
+        chunk=self.sock.recv(self.chunkSize)
+        if not chunk:
+            raise ConnectionError('OSA closed the connection')
+        self.pending+=chunk
+
+    def readLine(self):
+        """readLine: RETURNS: The next reply line without its terminator (bytes)"""
+        start=0
+        while True:
+            end=self.pending.find(b'\n', start)
+            if end>=0:
+                line=bytes(self.pending[:end])
+                del self.pending[:end+1]
+                return line.rstrip(b'\r')
+            start=len(self.pending)
+            self.receive()
+
+    def readExactly(self, count):
+        """readExactly: RETURNS: The next count bytes (bytes)"""
+        while len(self.pending)<count:
+            self.receive()
+        data=bytes(self.pending[:count])
+        del self.pending[:count]
+        return data
+
+    def readInto(self, buffer):
+        """readInto:
+        Fills a preallocated buffer with the next bytes; pending bytes are copied first and the
+        rest is received directly into the buffer without intermediate chunks
+        INPUTS:
+        buffer (bytearray): The buffer
+        Throws ConnectionError if the OSA closed the connection"""
+        view=memoryview(buffer)
+        filled=min(len(self.pending), len(buffer))
+        view[:filled]=self.pending[:filled]
+        del self.pending[:filled]
+        while filled<len(buffer):
+            count=self.sock.recv_into(view[filled:])
+            if count==0:
+                raise ConnectionError('OSA closed the connection')
+            filled+=count
+
+    def write(self, cmd):
+        """write: Sends a command RETURNS: The number of bytes sent"""
+        data=(cmd+'\n').encode('ascii')
+        self.sock.sendall(data)
+        return len(data)
+
+    def query(self, cmd):
+        """query: Sends a command RETURNS: The reply line without its terminator (str)"""
+        self.write(cmd)
+        return self.readLine().decode('ascii')
+
+    def queryBlock(self, cmd):
+        """queryBlock:
+        Sends a query that returns an IEEE 488.2 block
+        INPUTS:
+        cmd (str): The command
+        RETURNS:
+        (data, received) where data is the block data (bytearray), or the reply (str) if it is not a block,
+        and received is the number of bytes read"""
+        self.write(cmd)
+        start=self.readExactly(1)#'#'
+        if start!=b'#':#Not a block; ascii response, read rest of line unless this was its terminator
+            data=(b'' if start==b'\n' else start+self.readLine()).decode('ascii').rstrip('\r')
+            return (data, len(data)+1)
+        ndigits=int(self.readExactly(1))
+        if ndigits==0:
+            raise ValueError('Indefinite length blocks are not supported')
+        length=int(self.readExactly(ndigits))
+        data=bytearray(length)
+        self.readInto(data)#Single pass into the preallocated block
+        if self.readLine():#Terminator
+            raise ValueError('Unexpected data after block')
+        return (data, 2+ndigits+length+1)
+
+    def queryBlocks(self, cmd, count):
+        """queryBlocks:
+        Sends a compound query whose replies are IEEE 488.2 blocks separated by ';'
+        INPUTS:
+        cmd (str): The command
+        count (int): The number of replies
+        RETURNS:
+        (replies, received) where replies is a list of the block data (bytearray) of each reply, and from
+        the first reply that is not a block on, the rest of the line split at ';' (str),
+        and received is the number of bytes read"""
+        self.write(cmd)
+        (replies, received)=([], 0)
+        while len(replies)<count:
+            start=self.readExactly(1)#'#'
+            if start!=b'#':#Not a block; ascii responses, read rest of line
+                data=(b'' if start==b'\n' else start+self.readLine()).decode('ascii').rstrip('\r')
+                replies.extend(data.split(';'))
+                return (replies, received+len(data)+1)
+            ndigits=int(self.readExactly(1))
+            if ndigits==0:
+                raise ValueError('Indefinite length blocks are not supported')
+            length=int(self.readExactly(ndigits))
+            data=bytearray(length)
+            self.readInto(data)#Single pass into the preallocated block
+            replies.append(data)
+            separator=self.readSeparator()
+            if separator not in (b';', b'\n'):
+                raise ValueError('Unexpected data after block')
+            received+=2+ndigits+length+1
+            if separator==b'\n' and len(replies)<count:#Line ended early
+                break
+        return (replies, received)
+
+    def readSeparator(self):
+        """readSeparator:
+        Reads the byte after a block; a carriage return ahead of the terminator is skipped
+        RETURNS:
+        b';' between replies, the newline at the end of the line, otherwise the unexpected byte"""
+        end=self.readExactly(1)
+        if end==b'\r':
+            end=self.readExactly(1)
+        return end
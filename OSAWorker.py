@@ -0,0 +1,193 @@
+"""OSAWorker.py:
+Single I/O worker thread that owns an AQ6380Controls session for a GUI
+Commands are queued by priority and run one at a time, so requests made while the
+OSA is busy wait their turn instead of being dropped, and the GUI thread never blocks.
+Commands with the same key that are still waiting are coalesced: the later request
+shares the result of the queued one (i.e. several plot and save requests share one
+trace download). Results are handed back to the Tk thread by an after() poll.
+Priorities:
+    'urgent': Connecting
+    'interactive': Button actions such as a single sweep
+    'data': Trace downloads
+    'background': Repeat sweep steps, which let every other command go first
+Depends on AQ6380Controls library
+"""
+import itertools
+import queue
+import threading
+
+priorities={'urgent':0, 'interactive':1, 'data':2, 'background':3}
+
+class OSACommand:
+    """class OSACommand:
+        A queued worker command and the callbacks waiting for its result"""
+    def __init__(self, name, func, args, priority, key):
+        """initialize:
+        INPUTS:
+            name (str): Name for messages
+            func (function): Called in the worker as func(osa, *args)
+            args (tuple): The arguments
+            priority (str): A key of priorities
+            key (str): Coalescing key, None to never coalesce
+            """
+        self.name=name
+        self.func=func
+        self.args=args
+        self.priority=priority
+        self.key=key
+        self.callbacks=[]#(callback, errback) pairs; one per coalesced request
+        self.state='queued'#queued, running, done, failed or cancelled
+        self.cancelled=threading.Event()
+
+    def cancel(self):
+        """cancel: Marks the command cancelled; a queued command is skipped, see OSAWorker.cancel for running ones"""
+        self.cancelled.set()
+
+class OSAWorker(threading.Thread):
+    """class OSAWorker:
+        Runs queued commands on one OSA session in a background thread"""
+    def __init__(self, osa, master, pollInterval=20):
+        """initialize:
+        INPUTS:
+            osa (AQ6380Controls): The OSA; only the worker should use it once started
+            master (tk widget): Widget whose after() delivers results on the Tk thread
+            pollInterval (int, default 20): Milliseconds between result deliveries
+            """
+        super().__init__(daemon=True)
+        self.osa=osa
+        self.master=master
+        self.pollInterval=pollInterval
+        self.commands=queue.PriorityQueue()
+        self.results=queue.Queue()#(callback, value, command) for the Tk thread
+        self.counter=itertools.count()#Keeps FIFO order within a priority
+        self.lock=threading.Lock()
+        self.pending={}#Queued commands by key, for coalescing
+        self.running=None
+        self.stopping=False
+        self.master.after(self.pollInterval, self.poll)
+
+    def submit(self, name, func, *args, priority='interactive', key=None, callback=None, errback=None):
+        """submit:
+        Queues a command, or joins a queued command with the same key
+        INPUTS:
+        name (str): Name for messages
+        func (function): Called in the worker as func(osa, *args)
+        priority (str, default 'interactive'): 'urgent', 'interactive', 'data' or 'background'
+        key (str, default None): Coalescing key, None to always queue a new command
+        callback (function, default None): Called on the Tk thread with the result
+        errback (function, default None): Called on the Tk thread with the exception, None to print it
+        RETURNS:
+        The OSACommand
+        Throws exception if priority is invalid"""
+        if priority not in priorities:
+            raise ValueError(f'Priority of {priority} is invalid')
+        with self.lock:
+            command=self.pending.get(key) if key is not None else None
+            if command is not None and not command.cancelled.is_set():#Share the queued command
+                command.callbacks.append((callback, errback))
+                if priorities[priority]<priorities[command.priority]:#Raise its priority by queueing it again
+                    command.priority=priority
+                    self.commands.put((priorities[priority], next(self.counter), command))
+                return command
+            command=OSACommand(name, func, args, priority, key)
+            command.callbacks.append((callback, errback))
+            if key is not None:
+                self.pending[key]=command
+            self.commands.put((priorities[priority], next(self.counter), command))
+            return command
+
+    def cancel(self, command=None, key=None):
+        """cancel:
+        Cancels a command, or every queued and running command with a key;
+        a running sweep is stopped with AQ6380Controls.cancelSweep
+        INPUTS:
+        command (OSACommand, default None): The command
+        key (str, default None): Cancel commands with this key instead"""
+        with self.lock:
+            if key is not None:
+                command=self.pending.pop(key, None)
+                if command is not None:
+                    command.cancel()
+                running=self.running
+                if running is not None and running.key==key:
+                    running.cancel()
+                    self.osa.cancelSweep()
+                return
+            if command is None:
+                return
+            command.cancel()
+            if command.key is not None and self.pending.get(command.key) is command:
+                del self.pending[command.key]
+            if command is self.running:
+                self.osa.cancelSweep()
+
+    def cancelAll(self):
+        """cancelAll: Cancels every queued command and the running one"""
+        with self.lock:
+            while True:
+                try:
+                    self.commands.get_nowait()[2].cancel()
+                except queue.Empty:
+                    break
+            self.pending.clear()
+            if self.running is not None:
+                self.running.cancel()
+                self.osa.cancelSweep()
+
+    def queueDepth(self):
+        """queueDepth: RETURNS: The number of queued commands, including the running one"""
+        with self.lock:
+            return self.commands.qsize()+(1 if self.running is not None else 0)
+
+    def stop(self):
+        """stop: Cancels all commands and stops the worker thread"""
+        self.stopping=True
+        self.cancelAll()
+        self.commands.put((-1, next(self.counter), None))#Sentinel ahead of everything
+
+    def run(self):
+        """run: Worker thread; runs queued commands in priority order"""
+        while True:
+            (priority, count, command)=self.commands.get()
+            if command is None:
+                return
+            with self.lock:
+                if command.key is not None and self.pending.get(command.key) is command:
+                    del self.pending[command.key]#Later requests queue a new command
+                if command.cancelled.is_set() or command.state!='queued':#Cancelled or already run at higher priority
+                    continue
+                command.state='running'
+                self.running=command
+                self.osa.clearCancel()#Drop cancels meant for earlier commands; later ones reach this one
+            try:
+                value=command.func(self.osa, *command.args)
+            except Exception as e:
+                command.state='cancelled' if command.cancelled.is_set() else 'failed'
+                if command.state=='failed':
+                    for (callback, errback) in command.callbacks:
+                        self.results.put((errback, e, command))
+            else:
+                command.state='cancelled' if command.cancelled.is_set() else 'done'
+                if command.state=='done':
+                    for (callback, errback) in command.callbacks:
+                        self.results.put((callback, value, command))
+            finally:
+                with self.lock:
+                    self.running=None
+
+    def poll(self):
+        """poll: Calls the callbacks of finished commands on the Tk thread and schedules the next poll"""
+        while True:
+            try:
+                (func, value, command)=self.results.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if func is not None:
+                    func(value)
+                elif isinstance(value, Exception):
+                    print(f'{command.name} error: {value}')
+            except Exception as e:
+                print(f'{command.name} callback error: {e}')
+        if not self.stopping:
+            self.master.after(self.pollInterval, self.poll)
@@ -0,0 +1,163 @@
+"""OSAZoom.py:
+Adaptive coarse to fine acquisition around detected peaks
+A fast coarse sweep (rapid sensitivity, wide resolution) of the whole range finds the
+regions of interest around each peak; only those regions are then swept at the fine
+resolution and sensitivity. The result is one trace with fine samples in the regions and
+coarse samples elsewhere, plus the peak wavelength, power and -3 dB width of each region
+from its fine sweep. Peaks and widths match a full fine sweep as long as every channel
+stands out of the coarse noise floor, at the cost of a few narrow sweeps instead of one
+wide sweep at the slowest settings.
+Depends on AQ6380Controls, OSAAnalysis, OSAExport and OSAFleet libraries
+Depends on pyvisa, pyvisa-py, numpy
+To get dependencies,
+pip install pyvisa
+pip install pyvisa-py
+pip install numpy
+To run: python OSAZoom.py start stop or py OSAZoom.py start stop depending on system
+    Example: "python OSAZoom.py 1520 1570 --address 192.168.1.177 --fine-resolution 0.005 --output zoom.npz"
+"""
+import argparse
+import time
+import numpy as np
+from AQ6380Controls import AQ6380Controls, resolutions, fixedSensitivities
+from OSAAnalysis import findPeaks, spectralWidth, noiseFloor
+from OSAExport import saveTrace
+from OSAFleet import acquire
+
+defaultCoarse={'sensitivity':'RAPID3', 'resolution':'0.1'}#Settings of the survey sweep
+defaultFine={'sensitivity':'HIGH1', 'resolution':'0.005'}#Settings of the region sweeps
+
+def findRegions(xvals, yvals, start=None, stop=None, threshold=None, margin=15.0, minSpan=0.5, widthFactor=3.0,
+                level=20.0, maxRegions=None):
+    """findRegions:
+    Finds the wavelength ranges around the peaks of a coarse trace that need a fine sweep
+    INPUTS:
+    xvals, yvals (numpy array): The coarse trace in nm and dBm
+    start, stop (float, default None): Limits for the regions in nm, None for the trace edges
+    threshold (float, default None): Minimum peak power in dBm, None for the median level plus margin
+    margin (float, default 15.0): dB above the median level for the default threshold; clears the
+        noise spikes of a rapid sweep
+    minSpan (float, default 0.5): Smallest region span in nm
+    widthFactor (float, default 3.0): Region span as a multiple of the peak width at level
+    level (float, default 20.0): dB below each peak for its width
+    maxRegions (int, default None): Keep the regions of the strongest peaks only, None for all
+    RETURNS:
+    A list of dicts with 'start', 'stop' (nm) and 'peaks' (coarse peak wavelengths in nm), in wavelength order;
+    overlapping regions are merged"""
+    xvals=np.asarray(xvals, dtype=np.float64)
+    yvals=np.asarray(yvals, dtype=np.float64)
+    start=float(xvals[0]) if start is None else float(start)
+    stop=float(xvals[-1]) if stop is None else float(stop)
+    if threshold is None:
+        threshold=noiseFloor(yvals, 50)+margin
+    regions=[]
+    for idx in findPeaks(xvals, yvals, threshold, minSeparation=minSpan/2, maxPeaks=maxRegions):
+        (width, left, right)=spectralWidth(xvals, yvals, idx, level)
+        half=max(minSpan, widthFactor*width)/2
+        peakx=float(xvals[idx])
+        regions.append({'start':max(start, peakx-half), 'stop':min(stop, peakx+half), 'peaks':[peakx]})
+    regions.sort(key=lambda region: region['start'])
+    merged=[]
+    for region in regions:
+        if merged and region['start']<=merged[-1]['stop']:#Overlaps the previous region
+            merged[-1]['stop']=max(merged[-1]['stop'], region['stop'])
+            merged[-1]['peaks'].append(region['peaks'][0])
+        else:
+            merged.append(region)
+    return merged
+
+def mergeTraces(coarse, fines, regions):
+    """mergeTraces:
+    Replaces the coarse samples inside each region with the fine samples
+    INPUTS:
+    coarse (tuple): (xvals, yvals) coarse trace
+    fines (list of tuple): (xvals, yvals) fine trace of each region
+    regions (list of dict): The regions with 'start' and 'stop' in nm
+    RETURNS:
+    (xvals, yvals) numpy arrays in wavelength order; the wavelength step differs between regions"""
+    (xvals, yvals)=(np.asarray(coarse[0], dtype=np.float64), np.asarray(coarse[1], dtype=np.float64))
+    keep=np.ones(len(xvals), dtype=bool)
+    for (region, (finex, finey)) in zip(regions, fines):
+        if len(finex):#Drop coarse samples covered by the fine sweep
+            keep&=(xvals<finex[0])|(xvals>finex[-1])
+    xparts=[xvals[keep]]+[np.asarray(finex, dtype=np.float64) for (finex, finey) in fines]
+    yparts=[yvals[keep]]+[np.asarray(finey, dtype=np.float64) for (finex, finey) in fines]
+    (xvals, yvals)=(np.concatenate(xparts), np.concatenate(yparts))
+    order=np.argsort(xvals, kind='stable')
+    return (xvals[order], yvals[order])
+
+def zoomSweep(osa, start, stop, coarse=None, fine=None, **regionOptions):
+    """zoomSweep:
+    Sweeps a range coarsely, then sweeps the regions around its peaks finely
+    INPUTS:
+    osa (AQ6380Controls): A connected OSA
+    start, stop (float): The range in nm
+    coarse (dict, default None): configure settings of the survey sweep, None for defaultCoarse
+    fine (dict, default None): configure settings of the region sweeps, None for defaultFine
+    regionOptions: Options of findRegions (threshold, margin, minSpan, widthFactor, level, maxRegions)
+    RETURNS:
+    (xvals, yvals, info) where info is a dict with
+        'coarse': settings, 'points' and 'elapsed' (seconds) of the survey sweep
+        'regions': a list of dicts with 'start', 'stop', 'peaks' (coarse peak wavelengths), 'points',
+            'elapsed', and 'peakWavelength' (nm), 'peakPower' (dBm) and 'width' (-3 dB, nm) from the fine sweep
+        'fine': settings of the region sweeps
+        'elapsed': total seconds
+    Throws exception if the range is invalid or a sweep fails"""
+    (start, stop)=(float(start), float(stop))
+    if stop<=start:
+        raise ValueError(f'Zoom range {start}-{stop} nm is invalid')
+    coarse=dict(defaultCoarse if coarse is None else coarse)
+    fine=dict(defaultFine if fine is None else fine)
+    t0=time.perf_counter()
+    (coarsex, coarsey)=acquire(osa, round((start+stop)/2, 6), round(stop-start, 6), **coarse)
+    t1=time.perf_counter()
+    regions=findRegions(coarsex, coarsey, start, stop, **regionOptions)
+    fines=[]
+    for region in regions:
+        t2=time.perf_counter()
+        (finex, finey)=acquire(osa, round((region['start']+region['stop'])/2, 6), round(region['stop']-region['start'], 6), **fine)
+        region['points']=len(finex)
+        region['elapsed']=time.perf_counter()-t2
+        if len(finey):
+            peak=int(np.argmax(finey))
+            region['peakWavelength']=float(finex[peak])
+            region['peakPower']=float(finey[peak])
+            region['width']=spectralWidth(finex, finey, peak, 3.0)[0]
+        fines.append((finex, finey))
+    (xvals, yvals)=mergeTraces((coarsex, coarsey), fines, regions)
+    info={'coarse':dict(coarse, points=len(coarsex), elapsed=t1-t0), 'fine':fine, 'regions':regions,
+          'elapsed':time.perf_counter()-t0}
+    return (xvals, yvals, info)
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Coarse sweep, then fine sweeps around the peaks found')
+    parser.add_argument('start', type=float, help='Start wavelength (nm)')
+    parser.add_argument('stop', type=float, help='Stop wavelength (nm)')
+    parser.add_argument('--address', default='192.168.1.177', help='OSA address')
+    parser.add_argument('--port', default='10001', help='OSA port')
+    parser.add_argument('--coarse-resolution', default=defaultCoarse['resolution'], choices=resolutions, help='Survey resolution (nm)')
+    parser.add_argument('--coarse-sensitivity', default=defaultCoarse['sensitivity'], choices=fixedSensitivities, help='Survey sensitivity')
+    parser.add_argument('--fine-resolution', default=defaultFine['resolution'], choices=resolutions, help='Region resolution (nm)')
+    parser.add_argument('--fine-sensitivity', default=defaultFine['sensitivity'], choices=fixedSensitivities, help='Region sensitivity')
+    parser.add_argument('--threshold', type=float, default=None, help='Minimum peak power (dBm); default 15 dB above the median level')
+    parser.add_argument('--min-span', type=float, default=0.5, help='Smallest region span (nm)')
+    parser.add_argument('--max-regions', type=int, default=None, help='Refine the strongest peaks only')
+    parser.add_argument('--output', default=None, help='Merged trace file (.csv, .npy, .npz or .aqb)')
+    args=parser.parse_args()
+    osa=AQ6380Controls(args.address, port=args.port)
+    osa.open()
+    try:
+        (xvals, yvals, info)=zoomSweep(osa, args.start, args.stop,
+                                       {'sensitivity':args.coarse_sensitivity, 'resolution':args.coarse_resolution},
+                                       {'sensitivity':args.fine_sensitivity, 'resolution':args.fine_resolution},
+                                       threshold=args.threshold, minSpan=args.min_span, maxRegions=args.max_regions)
+    finally:
+        osa.close()
+    print(f"Coarse: {info['coarse']['points']} points in {info['coarse']['elapsed']:.3f} s")
+    for region in info['regions']:
+        print(f"{region['start']:.4f}-{region['stop']:.4f} nm: {region['points']} points in {region['elapsed']:.3f} s, "
+              f"peak {region.get('peakWavelength', float('nan')):.4f} nm {region.get('peakPower', float('nan')):.3f} dBm, "
+              f"-3 dB width {region.get('width', float('nan')):.4f} nm")
+    print(f"{len(xvals)} points in {info['elapsed']:.3f} s")
+    if args.output:
+        saveTrace(args.output, xvals, yvals)
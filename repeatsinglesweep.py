@@ -4,28 +4,100 @@ raw SCPI commands to/from the OSA
 Depends on AQ6380Controls library
 Depends on pyvisa
 Depends on pyvisa-py as visa interface
+Depends on numpy
 To get dependencies,
 pip install pyvisa
 pip install pyvisa-py
+pip install numpy
 To run: python repeatsinglesweep.py or py repeatsinglesweep.py depending on system
 """
+import time
 from AQ6380Controls import AQ6380Controls
+from OSAAnalysis import analyzeTrace
+from OSATraceWriter import TraceWriter
+from OSASweepModel import SweepTimeModel, autoConfigure
 osaaddr='192.168.1.177'#Change to whatever the OSA's ip address is
-filename='tracedata.csv'#Change to the desired file name to save trace to
+osaport='10001'#OSA port; the OSABroker.py port (i.e. '10101') shares one connection with other tools
+filename='tracedata.csv'#Change to the desired file name to save trace to; in overwrite mode .npy, .npz and .aqb also work (see OSAExport.py)
+csvprecision=None#Decimals for wavelength and amplitude in CSV files, i.e. (4, 3), None for full precision
+writemode='overwrite'#'overwrite' keeps only the latest trace, 'append' keeps all traces in one file, 'rotate' starts numbered files,
+                     #'archive' appends to a binary sweep archive named after filename (see OSAArchive.py)
+rotatebytes=100_000_000#Start a new file after this many bytes in rotate mode, None for no size limit
+rotateseconds=None#Start a new file after this many seconds in rotate mode, None for no time limit
+queuesize=8#Traces that can wait to be saved while the OSA sweeps
+droppolicy='block'#When the queue is full: 'block' waits for the disk, 'dropNewest' or 'dropOldest' discard a trace
+statsinterval=10#Seconds between stats lines
+pipelined=True#Download each trace while the next sweep runs (see AQ6380Controls.pipelinedSweeps)
+traceformat='REAL64'#Trace transfer format: ASCII, REAL64 or REAL32
+analyzesweeps=True#Print peak, width and SMSR of every sweep from the downloaded trace
+verifyinterval=100#Check the cached wavelength axis against a full download every N sweeps, 0 to never check
+automargin=None#dB between the peak and the noise floor; picks the fastest sensitivity that meets it at startup, None to keep the sensitivity
+sweepmodelfile='sweepmodel.json'#Sweep times learned for automargin; updated on exit (see OSASweepModel.py)
+maxfailures=3#Stop after this many sweeps in a row fail or time out; failed sweeps are not saved
 
-if __name__=='__main__':
-    osa=AQ6380Controls(osaaddr)
-    osa.open()#Open connection to OSA
-    #Any other startup code (i.e. setting sensitivity or span) should be put here
+def singleSweeps(osa, maxFailures=maxfailures):
+    """singleSweeps:
+    Sweeps repeatedly with singleSweep and downloads each trace
+    A failed or timed out sweep is skipped, so the trace of an earlier sweep is never saved again
+    INPUTS:
+    osa (AQ6380Controls): The connected OSA
+    maxFailures (int, default maxfailures): Failed sweeps in a row before giving up
+    RETURNS:
+    A generator of (xvals, yvals) traces
+    Throws RuntimeError after maxFailures failed sweeps in a row"""
+    failures=0
     while True:
-        osa.singleSweep()#Single Sweep; waits for end "1"
-        (xvals, yvals)=osa.getTraceVals()#Get trace
-        with open(filename, 'w') as fp:#Save trace to file
-            #Open file
-            for idx in range(len(xvals)):
-                #Save CSV line by line
-                fp.write(f'{xvals[idx]},{yvals[idx]}\n')
-        print("Trace complete")
+        if osa.singleSweep():#Single Sweep; waits for the end of the sweep
+            failures=0
+            yield osa.getTraceVals()
+            continue
+        failures+=1
+        print(f'Sweep failed ({failures} in a row); trace not saved')
+        if failures>=maxFailures:
+            raise RuntimeError(f'{failures} sweeps in a row failed')
 
-        
-        
\ No newline at end of file
+if __name__=='__main__':
+    osa=AQ6380Controls(osaaddr, port=osaport, traceFormat=traceformat)
+    osa.xAxisVerifyInterval=verifyinterval
+    osa.sweepModel=SweepTimeModel.load(sweepmodelfile)
+    writer=TraceWriter(filename, writemode, queuesize, droppolicy, rotatebytes, rotateseconds, csvprecision)#Saves traces in background
+    writer.start()
+    laststats=time.perf_counter()
+    try:
+        osa.open()#Open connection to OSA
+        #Any other startup code (i.e. setting sensitivity or span) should be put here
+        if automargin is not None:#Needs span and resolution set with osa.configure above
+            choice=autoConfigure(osa, osa.sweepModel, automargin)
+            print(f"Sensitivity {choice['sensitivity']} {choice['speed']}: noise floor {choice['floor']} dBm for a {choice['signal']:.3f} dBm peak"
+                  f"{'' if choice['met'] else f' does not meet the {automargin} dB margin'}")
+        if pipelined:
+            traces=osa.pipelinedSweeps()
+        else:
+            traces=singleSweeps(osa)
+        for (xvals, yvals) in traces:
+            writer.put(xvals, yvals, settings=osa.settings)#Queue trace for saving; OSA sweeps again while it is written
+            if analyzesweeps:#Local analysis; no extra OSA round trips
+                result=analyzeTrace(xvals, yvals, resolution=osa.settings.get('resolution'))
+                print(f"Peak {result['peakWavelength']:.4f} nm {result['peakPower']:.3f} dBm, "
+                      f"-3 dB width {result['width'][3.0]:.4f} nm, SMSR {result['smsr']} dB")
+            if pipelined:
+                timing=osa.lastPipelineTiming
+                print(f"Trace complete: sweep {timing.get('sweep', 0):.3f} s, download {timing.get('download', 0):.3f} s "
+                      f"({timing.get('hidden', 0):.3f} s hidden by sweep), cycle {timing.get('cycle', 0):.3f} s")
+            else:
+                timing=osa.lastSweepTiming
+                print(f"Trace complete: configure {timing.get('configure', 0):.3f} s, sweep {timing.get('sweep', 0):.3f} s, "
+                      f"poll {timing.get('poll', 0):.3f} s in {timing.get('polls', 0)} queries")
+            if time.perf_counter()-laststats>=statsinterval:
+                print(writer.statsLine())
+                laststats=time.perf_counter()
+    except KeyboardInterrupt:
+        print('Stopping')
+    except RuntimeError as e:#Sweeps keep failing
+        print(f'Stopping: {e}')
+    finally:#Also on errors, i.e. a sweep timeout or a failed sign in
+        print('Saving queued traces')
+        writer.close()
+        print(writer.statsLine())
+        osa.sweepModel.save(sweepmodelfile)
+        osa.close()
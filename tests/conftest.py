@@ -0,0 +1,46 @@
+"""conftest.py:
+Shared fixtures for the test suite; the OSA is OSASimulator on a free local port
+Depends on pytest, numpy; pyvisa and pyvisa-py for the 'pyvisa' transport tests only
+To run: python -m pytest tests from the repository directory
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))#Modules live at the top level
+
+from OSASimulator import startSimulator
+from AQ6380Controls import AQ6380Controls
+
+simTimeScale=0.01#Simulated sweeps take 1% of the instrument's time
+
+def transportParams():
+    """transportParams: RETURNS: pytest params of the transports, 'pyvisa' skipped if it is not installed"""
+    try:
+        import pyvisa
+        import pyvisa_py
+        skip=()
+    except ImportError:
+        skip=(pytest.mark.skip(reason='pyvisa and pyvisa-py are not installed'),)
+    return ['socket', pytest.param('pyvisa', marks=skip)]
+
+@pytest.fixture(scope='module')
+def simulator():
+    """simulator: A running simulator with the synthetic spectrum, stopped after the module"""
+    server=startSimulator(timeScale=simTimeScale)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(params=transportParams())
+def transport(request):
+    """transport: The name of each transport in turn"""
+    return request.param
+
+@pytest.fixture
+def osa(simulator, transport):
+    """osa: An open AQ6380Controls on the simulator over each transport"""
+    controls=AQ6380Controls('127.0.0.1', str(simulator.server_address[1]), transport=transport)
+    controls.open()
+    yield controls
+    controls.close()
@@ -0,0 +1,89 @@
+"""test_analysis.py:
+Tests of the OSAAnalysis spectral analysis on synthetic traces and test1.csv
+"""
+import os
+import numpy as np
+import pytest
+from OSAAnalysis import (dBmToMw, mwToDbm, findPeaks, spectralWidth, centroid, bandPower, smsr, osnr,
+                         analyzeTrace, analyzeFile)
+
+testcsv=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test1.csv')
+
+def laserTrace(sidePower=-30.0, floor=-60.0):
+    """laserTrace:
+    A 0 dBm Gaussian line at 1550 nm with a 0.1 nm FWHM, a side mode 1 nm above it and a flat floor
+    RETURNS:
+    (xvals, yvals) with a 0.001 nm step"""
+    xvals=np.round(np.linspace(1545, 1555, 10001), 4)
+    sigma=0.1/(2*np.sqrt(2*np.log(2)))
+    power=np.exp(-(xvals-1550)**2/(2*sigma**2))+dBmToMw(sidePower)*np.exp(-(xvals-1551)**2/(2*sigma**2))
+    return (xvals, mwToDbm(power+dBmToMw(floor)))
+
+def testDbmConversion():
+    assert dBmToMw(0)==pytest.approx(1.0)
+    assert dBmToMw(-30)==pytest.approx(1e-3)
+    np.testing.assert_allclose(mwToDbm(dBmToMw([-20.0, 3.0])), [-20.0, 3.0])
+    assert mwToDbm(0.0)==-210.0
+
+def testFindPeaks():
+    (xvals, yvals)=laserTrace()
+    peaks=findPeaks(xvals, yvals)
+    assert list(xvals[peaks])==[1550.0, 1551.0]#Strongest first
+    assert list(xvals[findPeaks(xvals, yvals, threshold=-10)])==[1550.0]
+    assert len(findPeaks(xvals, yvals, minSeparation=2.0))==1
+    assert len(findPeaks(xvals, yvals, maxPeaks=1))==1
+
+def testSpectralWidth():
+    (xvals, yvals)=laserTrace()
+    (width, left, right)=spectralWidth(xvals, yvals)
+    assert width==pytest.approx(0.1, abs=2e-3)
+    assert (left+right)/2==pytest.approx(1550.0, abs=1e-3)
+    assert spectralWidth(xvals, yvals, level=20.0)[0]>width
+
+def testCentroid():
+    (xvals, yvals)=laserTrace(sidePower=-200)
+    assert centroid(xvals, yvals, level=20.0)==pytest.approx(1550.0, abs=1e-4)
+
+def testSmsr():
+    (xvals, yvals)=laserTrace(sidePower=-30)
+    (ratio, wavelength, power)=smsr(xvals, yvals)
+    assert ratio==pytest.approx(30.0, abs=0.1)
+    assert wavelength==pytest.approx(1551.0)
+    assert smsr(*laserTrace(sidePower=-200))==(None, None, None)
+
+def testSmsrIgnoresSkirtRipple():
+    (xvals, yvals)=laserTrace(sidePower=-35)
+    skirt=np.abs(xvals-1550.05)<0.01
+    yvals=yvals+np.where(skirt, 0.5*np.sin(np.arange(len(xvals))), 0.0)#Ripple inside the -20 dB width
+    assert smsr(xvals, yvals)[1]==pytest.approx(1551.0)
+
+def testOsnr():
+    (xvals, yvals)=laserTrace(sidePower=-200, floor=-40)
+    (ratio, noise)=osnr(xvals, yvals)
+    assert noise==pytest.approx(-40.0, abs=0.01)
+    assert ratio==pytest.approx(40.0, abs=0.01)
+    assert osnr(xvals, yvals, resolution=0.02)[0]==pytest.approx(40+10*np.log10(0.2), abs=0.01)
+
+def testBandPower():
+    xvals=np.linspace(1550, 1551, 101)#0.01 nm step
+    yvals=np.full(len(xvals), -10.0)#-10 dBm in each 0.1 nm resolution bandwidth
+    assert bandPower(xvals, yvals, resolution=0.1)==pytest.approx(-10+10*np.log10(101*0.01/0.1))
+    assert bandPower(xvals, yvals, 1550.0, 1550.5, resolution=0.1)==pytest.approx(-10+10*np.log10(51*0.01/0.1))
+    with pytest.raises(ValueError):
+        bandPower(xvals, yvals)
+
+def testAnalyzeTrace():
+    (xvals, yvals)=laserTrace()
+    result=analyzeTrace(xvals, yvals)
+    assert result['peakWavelength']==1550.0 and result['peakPower']==pytest.approx(0.0, abs=1e-3)
+    assert result['width'][3.0]==pytest.approx(0.1, abs=2e-3)
+    assert result['smsr']==pytest.approx(30.0, abs=0.1)
+    assert result['totalPower'] is None#Unknown without the resolution
+    assert [peak['wavelength'] for peak in result['peaks']]==[1550.0, 1551.0]
+    assert analyzeTrace(xvals, yvals, resolution=0.02)['totalPower']==pytest.approx(bandPower(xvals, yvals, resolution=0.02))
+
+def testAnalyzeFile():
+    result=analyzeFile(testcsv, resolution=0.02)
+    assert result['peakWavelength']==pytest.approx(1608.734)
+    assert result['peakPower']==pytest.approx(5.722, abs=1e-3)
+    assert result['totalPower']<result['peakPower']+3
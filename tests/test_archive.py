@@ -0,0 +1,124 @@
+"""test_archive.py:
+Tests of the OSAArchive sweep archive and the OSATraceWriter archive mode
+"""
+import numpy as np
+import pytest
+from OSAArchive import SweepArchive, archiveFiles
+from OSATraceWriter import TraceWriter
+
+def makeTrace(points, offset=0.0):
+    """makeTrace: RETURNS: An evenly spaced (xvals, yvals) trace of points samples"""
+    xvals=np.linspace(1549.0, 1551.0, points)
+    return (xvals, -40+offset+np.arange(points)%7)
+
+def testAppendAndRead(tmp_path):
+    archive=SweepArchive(str(tmp_path/'run'), 'a')
+    for sweep in range(3):
+        archive.append(*makeTrace(101, sweep), timestamp=1000.0+sweep, settings={'center':1550.0, 'span':2.0, 'sensitivity':'MID'})
+        assert len(archive)==sweep+1#New sweeps are readable right away
+    (xvals, yvals)=archive.getSweep(-1)
+    np.testing.assert_allclose(xvals, makeTrace(101)[0])
+    np.testing.assert_array_equal(yvals, makeTrace(101, 2)[1])
+    assert archive.getSweeps().shape==(3, 101)
+    np.testing.assert_array_equal(archive.find(startTime=1000.5, sensitivity='MID'), [1, 2])
+    archive.close()
+    reader=SweepArchive(str(tmp_path/'run'))
+    assert len(reader)==3 and reader.points==101
+    with pytest.raises(ValueError):
+        reader.append(*makeTrace(101))
+    reader.close()
+
+def testPointCountMismatch(tmp_path):
+    archive=SweepArchive(str(tmp_path/'run'), 'a')
+    archive.append(*makeTrace(101))
+    with pytest.raises(ValueError, match='101'):
+        archive.append(*makeTrace(201))
+    archive.close()
+
+def testRepairDropsIncompleteSweep(tmp_path):
+    archive=SweepArchive(str(tmp_path/'run'), 'a')
+    archive.append(*makeTrace(101))
+    archive.append(*makeTrace(101, 1))
+    archive.close()
+    (dataFile, indexFile)=archiveFiles(str(tmp_path/'run'))
+    with open(dataFile, 'ab') as fp:#Block written, index record not: the writer was killed
+        fp.write(np.zeros(150, dtype='<f4').tobytes())
+    archive=SweepArchive(str(tmp_path/'run'), 'a')
+    assert len(archive)==2
+    archive.append(*makeTrace(101, 2))
+    assert len(archive)==3
+    np.testing.assert_array_equal(archive.getSweep(2)[1], makeTrace(101, 2)[1])
+    archive.close()
+
+def testMissingArchive(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        SweepArchive(str(tmp_path/'missing'))
+
+def testAppendDoesNotRemap(tmp_path, monkeypatch):
+    archive=SweepArchive(str(tmp_path/'run'), 'a')
+    archive.append(*makeTrace(101))
+    archive.getSweep(0)
+    maps=[]
+    memmap=np.memmap
+    monkeypatch.setattr(np, 'memmap', lambda *args, **kwargs: maps.append(args[0]) or memmap(*args, **kwargs))
+    for sweep in range(10):
+        archive.append(*makeTrace(101, sweep))
+    assert maps==[] and len(archive)==11
+    np.testing.assert_array_equal(archive.getSweep(-1)[1], makeTrace(101, 9)[1])
+    assert len(maps)==2#Index and data mapped once for all new sweeps
+    archive.getSweeps()
+    assert len(maps)==2
+    archive.close()
+
+def testReaderSeesAppendsAfterRefresh(tmp_path):
+    writer=SweepArchive(str(tmp_path/'run'), 'a')
+    writer.append(*makeTrace(101))
+    reader=SweepArchive(str(tmp_path/'run'))
+    writer.append(*makeTrace(101, 1))
+    assert len(reader)==1
+    reader.refresh()
+    assert len(reader)==2
+    np.testing.assert_array_equal(reader.getSweep(1)[1], makeTrace(101, 1)[1])
+    np.testing.assert_array_equal(reader.index['points'], [101, 101])
+    writer.close()
+    reader.close()
+
+def testStoreX(tmp_path):
+    archive=SweepArchive(str(tmp_path/'run'), 'a', dtype='f8', storeX=True)
+    xvals=np.sort(np.random.default_rng(1).uniform(1549, 1551, 50))#Uneven axis
+    archive.append(xvals, np.arange(50.0))
+    (x, y)=archive.getSweep(0)
+    np.testing.assert_array_equal(x, xvals)
+    np.testing.assert_array_equal(y, np.arange(50.0))
+    archive.close()
+
+def testIterSweeps(tmp_path):
+    archive=SweepArchive(str(tmp_path/'run'), 'a')
+    for sweep in range(5):
+        archive.append(*makeTrace(11, sweep), timestamp=float(sweep))
+    chunks=list(archive.iterSweeps(chunk=2))
+    assert [first for (first, records, data) in chunks]==[0, 2, 4]
+    assert np.concatenate([records['timestamp'] for (first, records, data) in chunks]).tolist()==[0.0, 1.0, 2.0, 3.0, 4.0]
+    archive.close()
+
+def testCsvExportImport(tmp_path):
+    archive=SweepArchive(str(tmp_path/'run'), 'a')
+    archive.append(*makeTrace(101, 1), settings={'center':1550.0, 'span':2.0})
+    archive.exportCsv(0, str(tmp_path/'sweep.csv'))
+    archive.importCsv(str(tmp_path/'sweep.csv'), timestamp=5.0)
+    np.testing.assert_allclose(archive.getSweep(1)[1], archive.getSweep(0)[1])
+    assert archive.index['center'][1]==pytest.approx(1550.0)
+    archive.close()
+
+def testTraceWriterStartsNewArchive(tmp_path):
+    writer=TraceWriter(str(tmp_path/'run.csv'), 'archive')
+    writer.start()
+    for trace in [makeTrace(101), makeTrace(201), makeTrace(201, 1)]:
+        writer.put(*trace)
+    writer.close()
+    assert writer.stats()['written']==3 and writer.stats()['errors']==0
+    (first, second)=(SweepArchive(str(tmp_path/'run')), SweepArchive(str(tmp_path/'run_0001')))
+    assert (len(first), first.points)==(1, 101)
+    assert (len(second), second.points)==(2, 201)
+    first.close()
+    second.close()
@@ -0,0 +1,88 @@
+"""test_batch.py:
+Tests of the OSABatch trace summaries, file discovery and summary table
+"""
+import csv
+import io
+import os
+import numpy as np
+import pytest
+from OSAAnalysis import bandPower
+from OSAExport import saveTrace
+from OSABatch import (findTraceFiles, parseBand, summaryColumns, summarizeTrace, batchSummaries, writeSummary)
+
+def lineTrace(center=1550.0, power=0.0):
+    """lineTrace: RETURNS: (xvals, yvals) of a 0.1 nm wide Gaussian line on a -60 dBm floor, 1540-1560 nm in 0.01 nm steps"""
+    xvals=np.round(np.linspace(1540, 1560, 2001), 4)
+    sigma=0.1/(2*np.sqrt(2*np.log(2)))
+    linear=10**(power/10)*np.exp(-(xvals-center)**2/(2*sigma**2))+1e-6
+    return (xvals, 10*np.log10(linear))
+
+@pytest.fixture
+def traces(tmp_path):
+    """traces: A directory of three trace files, a bad file, another format and a sub directory"""
+    for (idx, center) in enumerate((1545.0, 1550.0, 1555.0)):
+        saveTrace(str(tmp_path/f'trace{idx}.csv'), *lineTrace(center, -idx))
+    (tmp_path/'bad.csv').write_text('wavelength,power\n1550,abc\n')
+    saveTrace(str(tmp_path/'other.npy'), *lineTrace())
+    (tmp_path/'sub').mkdir()
+    saveTrace(str(tmp_path/'sub'/'deep.csv'), *lineTrace())
+    return tmp_path
+
+def testParseBand():
+    assert parseBand('1530:1565')==(1530.0, 1565.0)
+    for text in ('1530', '1565:1530', '1530:abc'):
+        with pytest.raises(ValueError):
+            parseBand(text)
+
+def testFindTraceFiles(traces):
+    names=[os.path.relpath(name, traces) for name in findTraceFiles([str(traces)])]
+    assert names==['bad.csv', 'trace0.csv', 'trace1.csv', 'trace2.csv']
+    names=[os.path.relpath(name, traces) for name in findTraceFiles([str(traces)], recursive=True)]
+    assert names[-1]==os.path.join('sub', 'deep.csv')
+    assert list(findTraceFiles([str(traces)], '*.npy'))==[str(traces/'other.npy')]
+    assert list(findTraceFiles(['missing.csv']))==['missing.csv']#Files are taken as they are
+
+def testSummaryColumns():
+    assert summaryColumns((3.0, 0.5), [(1530.0, 1565.0)])==['file', 'points', 'start', 'stop', 'peakWavelength', 'peakPower',
+                                                            'width3dB', 'width0.5dB', 'totalPower', 'band1530_1565', 'error']
+
+def testSummarizeTrace():
+    (xvals, yvals)=lineTrace()
+    bands=[(1545.0, 1555.0), (1600.0, 1610.0)]
+    row=summarizeTrace(xvals, yvals, bands=bands, resolution=0.1)
+    assert set(row)==set(summaryColumns(bands=bands))-{'file', 'error'}
+    assert (row['points'], row['start'], row['stop'])==(2001, 1540.0, 1560.0)
+    assert row['peakWavelength']==1550.0 and row['peakPower']==pytest.approx(0.0, abs=1e-3)
+    assert row['width3dB']==pytest.approx(0.1, abs=0.01) and row['width20dB']>row['width3dB']
+    assert row['totalPower']==pytest.approx(bandPower(xvals, yvals, resolution=0.1))
+    assert row['band1545_1555']==pytest.approx(bandPower(xvals, yvals, 1545.0, 1555.0, 0.1))
+    assert row['band1600_1610'] is None#Outside the trace
+    with pytest.raises(ValueError):
+        summarizeTrace([], [])
+
+def testSummarizeTraceWithoutResolution():
+    row=summarizeTrace(*lineTrace(), bands=[(1545.0, 1555.0)])
+    assert row['totalPower'] is None and row['band1545_1555'] is None#Unknown without the resolution bandwidth
+    assert row['peakPower']==pytest.approx(0.0, abs=1e-3)
+
+@pytest.mark.parametrize('workers', [0, 2])
+def testBatchSummaries(traces, workers):
+    filenames=list(findTraceFiles([str(traces)], recursive=True))
+    rows=list(batchSummaries(iter(filenames), workers, chunkSize=2, resolution=0.1))
+    assert [row['file'] for row in rows]==filenames#In file order
+    bad=rows[0]
+    assert bad['error'].startswith('ValueError') and 'peakPower' not in bad
+    assert [row['peakWavelength'] for row in rows[1:4]]==[1545.0, 1550.0, 1555.0]
+    assert all(row['totalPower'] is not None for row in rows[1:])
+
+def testWriteSummary(traces):
+    columns=summaryColumns(bands=[(1545.0, 1555.0)])
+    rows=batchSummaries(findTraceFiles([str(traces)]), 0)
+    progress=[]
+    fp=io.StringIO()
+    assert writeSummary(fp, rows, columns, lambda files, errors: progress.append((files, errors)))==(4, 1)
+    assert progress[-1]==(4, 1)
+    table=list(csv.DictReader(io.StringIO(fp.getvalue())))
+    assert list(table[0])==columns
+    assert table[1]['peakWavelength']=='1545.000000' and table[1]['totalPower']==''
+    assert table[0]['error'] and table[0]['peakWavelength']==''
@@ -0,0 +1,100 @@
+"""test_broker.py:
+Tests of OSABroker data formats, caching and sweep tracking against the simulator
+"""
+import numpy as np
+import pytest
+import OSABroker
+from OSABroker import startBroker, stopBroker, isCacheable, sweepState, sweepCompleted
+from AQ6380Controls import AQ6380Controls, decodeBinaryTrace
+from OSATransport import createTransport
+
+@pytest.fixture
+def broker(simulator):
+    """broker: A broker on the simulator"""
+    server=startBroker('127.0.0.1', str(simulator.server_address[1]), keepalive=0)
+    yield server
+    stopBroker(server)
+
+def brokerClient(broker, traceFormat='REAL64'):
+    """brokerClient: RETURNS: An open AQ6380Controls on the broker"""
+    client=AQ6380Controls('127.0.0.1', str(broker.server_address[1]), traceFormat=traceFormat, transport='socket')
+    client.open()
+    return client
+
+def testIsCacheable():
+    assert isCacheable([':trac:y? tra'])
+    assert isCacheable([':calc:cat swth', ':calc', ':calc:data?'])
+    assert not isCacheable([':calc:data?'])#Analysis selected in another message
+    assert not isCacheable([':init'])
+    assert not isCacheable([':trac:y? tra', ':stat:oper:even?'])
+    assert not isCacheable([':sens:wav:cent 1550nm'])
+
+def testSweepState():
+    assert sweepState([':init:smode 1', '*cls', ':init'], False, False)==(True, False)
+    assert sweepState([':init:smode 2', ':init'], False, False)==(True, True)
+    assert sweepState([':init:smode rep'], False, False)==(False, True)
+    assert sweepState([':abor'], True, True)==(False, False)
+    assert sweepState([':trac:y? tra'], True, False)==(True, False)
+
+def testSweepCompleted():
+    assert sweepCompleted(['*opc?'], [True], b'1\n')
+    assert sweepCompleted([':trac:snum? tra', ':stat:oper:even?'], [True, True], b'10001;1\n')
+    assert not sweepCompleted([':stat:oper:even?'], [True], b'0\n')
+    assert not sweepCompleted([':trac:y? tra'], [True], b'1\n')
+
+def testSharedTraceInMixedFormats(broker):
+    (binary, ascii)=(brokerClient(broker, 'REAL64'), brokerClient(broker, 'ASCII'))
+    try:
+        binary.configure(center=1550, span=2)
+        assert binary.singleSweep()
+        (x, y)=binary.getTraceVals()
+        (xa, ya)=ascii.getTraceVals()
+        np.testing.assert_allclose(x, xa, atol=1e-4)
+        np.testing.assert_allclose(y, ya, atol=1e-3)
+        hits=broker.instrument.snapshot()['hits']
+        np.testing.assert_array_equal(binary.getTraceVals()[1], y)
+        assert broker.instrument.snapshot()['hits']>hits
+    finally:
+        binary.close()
+        ascii.close()
+
+def testFormatPerQuery(broker):
+    link=createTransport('socket')
+    link.open('127.0.0.1', str(broker.server_address[1]))
+    try:
+        link.query('open "anonymous"')
+        link.query('aaa')
+        link.write(':sens:wav:span 2nm;:init:smode 1;*CLS;:init')
+        link.query('*OPC?')
+        (replies, received)=link.queryBlocks(':form:data real,64;:trac:x? TRA,1,1;:form:data ascii;:trac:x? TRA,1,1', 2)
+        assert decodeBinaryTrace(replies[0])[0]==pytest.approx(float(replies[1]))
+        (data, received)=link.queryBlock(':trac:x? TRA,1,1')#Client's format is still ascii
+        assert isinstance(data, str)
+    finally:
+        link.close()
+
+def testNoCacheInRepeatMode(broker):
+    client=brokerClient(broker)
+    try:
+        client.configure(span=2)
+        client.write(':init:smode 2;:init')#Repeat sweep; traces change without commands
+        hits=broker.instrument.snapshot()['hits']
+        client.getTraceVals()
+        client.getTraceVals()
+        assert broker.instrument.snapshot()['hits']==hits
+        client.abortSweep()
+    finally:
+        client.close()
+
+def testCacheTTL(broker, monkeypatch):
+    client=brokerClient(broker)
+    try:
+        client.configure(span=2)
+        assert client.singleSweep()
+        monkeypatch.setattr(OSABroker, 'cacheTTL', 0.0)
+        hits=broker.instrument.snapshot()['hits']
+        client.query(':sens:wav:span?')
+        client.query(':sens:wav:span?')
+        assert broker.instrument.snapshot()['hits']==hits
+    finally:
+        client.close()
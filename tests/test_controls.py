@@ -0,0 +1,231 @@
+"""test_controls.py:
+Tests of AQ6380Controls sweeps, settings and trace downloads against the simulator
+"""
+import threading
+import numpy as np
+import pytest
+from AQ6380Controls import traceFormats
+
+@pytest.fixture
+def swept(osa):
+    """swept: The osa after one sweep over a 2 nm span"""
+    osa.configure(center=1550, span=2)
+    assert osa.singleSweep()
+    return osa
+
+def asciiTrace(osa, trace='TRA'):
+    """asciiTrace: RETURNS: (xvals, yvals) of a trace downloaded in ASCII, x in nm"""
+    osa.write(':form:data ascii')
+    xvals=np.array([float(value) for value in osa.query(f':trac:x? {trace}').split(',')])*1e9
+    yvals=np.array([float(value) for value in osa.query(f':trac:y? {trace}').split(',')])
+    osa.instrumentFormat=None#Session format was changed behind the OSA object
+    return (xvals, yvals)
+
+@pytest.mark.parametrize('fmt', traceFormats)
+def testGetTraceVals(swept, fmt):
+    swept.setTraceFormat(fmt)
+    (xvals, yvals)=swept.getTraceVals()
+    (x, y)=asciiTrace(swept)
+    assert len(xvals)==len(yvals)==len(x)
+    np.testing.assert_allclose(xvals, x, atol=1e-4)
+    np.testing.assert_allclose(yvals, y, atol=1e-3 if fmt!='REAL32' else 1e-4*np.max(np.abs(y)))
+    assert xvals[0]==pytest.approx(1549.0) and xvals[-1]==pytest.approx(1551.0)
+
+def testSetTraceFormatInvalid(osa):
+    with pytest.raises(ValueError):
+        osa.setTraceFormat('REAL16')
+
+def testXAxisCached(swept, monkeypatch):
+    xaxis=swept.getXAxis()
+    downloads=[]
+    getTraceData=swept.getTraceData
+    monkeypatch.setattr(swept, 'getTraceData', lambda axis, *args, **kwargs: downloads.append(axis) or getTraceData(axis, *args, **kwargs))
+    assert swept.singleSweep()
+    (xvals, yvals)=swept.getTraceVals()
+    assert xvals is xaxis
+    assert downloads==['y']
+    assert not xvals.flags.writeable
+
+def testXAxisFollowsSettings(swept):
+    xaxis=swept.getXAxis()
+    swept.configure(span=4)
+    assert swept.singleSweep()
+    (xvals, yvals)=swept.getTraceVals()
+    assert xvals is not xaxis and len(xvals)==len(yvals)
+    assert xvals[0]==pytest.approx(1548.0) and xvals[-1]==pytest.approx(1552.0)
+
+def testXAxisPointsChangedBehindCache(swept):
+    swept.getTraceVals()
+    swept.write(':sens:wav:span 3nm;:init:smode 1;*CLS;:init')#Behind the shadow copy, like the front panel
+    swept.query('*OPC?')
+    (xvals, yvals)=swept.getTraceVals()
+    assert len(xvals)==len(yvals)
+    assert xvals[-1]-xvals[0]==pytest.approx(3.0)
+
+@pytest.mark.parametrize('fmt', traceFormats)
+def testVerifyXAxis(swept, fmt):
+    swept.setTraceFormat(fmt)
+    swept.getXAxis()
+    assert swept.verifyXAxis()
+
+@pytest.mark.parametrize('mode', ['poll', 'opc'])
+def testSingleSweep(osa, mode):
+    osa.completionMode=mode
+    osa.configure(center=1550, span=2)
+    assert osa.singleSweep()
+    timing=osa.lastSweepTiming
+    assert timing['polls']>=1 and timing['sweep']>0 and timing['total']>=timing['sweep']
+    assert osa.lastSweepDuration==pytest.approx(timing['sweep'])
+    assert not osa.inSweep
+
+def testSingleSweepTimeout(osa):
+    osa.configure(span=40, sensitivity='HIGH3')#About 0.15 s simulated
+    assert not osa.singleSweep(timeout=0.01)
+    assert not osa.inSweep
+    assert osa.singleSweep()#Aborted sweep leaves the OSA usable
+
+def testWaitForSweepInvalidMode(osa):
+    with pytest.raises(ValueError):
+        osa.waitForSweep(mode='busy')
+
+def testConfigureSkipsUnchangedSettings(osa):
+    assert osa.configure(center=1550, span=2)>0
+    assert osa.configure(center=1550.0, span='2')==0
+    assert osa.setSpan(2)==0
+    assert osa.settings=={'center':1550.0, 'span':2.0}
+
+def testSettingsUnchangedWhenWriteFails(osa, monkeypatch):
+    osa.configure(span=2)
+    def failingWrite(cmd):
+        raise OSError('link down')
+    monkeypatch.setattr(osa.osa, 'write', failingWrite)
+    with pytest.raises(OSError):
+        osa.setSpan(5)
+    with pytest.raises(OSError):
+        osa.configure(center=1560, span=5)
+    assert osa.settings=={'span':2.0}
+
+@pytest.mark.parametrize('resolution', ['0.03', 'fine', 0.3])
+def testInvalidResolution(osa, resolution):
+    with pytest.raises(ValueError):
+        osa.configure(resolution=resolution)
+    with pytest.raises(ValueError):
+        osa.setResolution(resolution)
+    assert 'resolution' not in osa.settings
+
+def testResolutionAsFloat(osa):
+    osa.setResolution(0.05)
+    assert osa.getResolution()==pytest.approx(0.05)
+    assert osa.settings['resolution']==0.05
+
+def testResyncSettings(osa):
+    osa.write(':sens:wav:cent 1551nm;:sens:wav:span 3nm')#Behind the shadow copy
+    settings=osa.resyncSettings()
+    assert settings['center']==1551.0 and settings['span']==3.0
+    assert osa.configure(center=1551, span=3)==0
+
+def testSendSCPIQueryKeepsShadow(osa):
+    osa.configure(center=1550, span=2)
+    assert float(osa.sendSCPI(':sens:wav:span?'))==pytest.approx(2e-9)
+    assert osa.settings=={'center':1550.0, 'span':2.0}
+    osa.sendSCPI(':sens:wav:span 3nm')
+    assert osa.settings=={}
+    assert osa.configure(span=2)>0
+
+def testPipelinedSweeps(swept):
+    assert list(swept.pipelinedSweeps(0))==[]
+    traces=list(swept.pipelinedSweeps(3))
+    assert len(traces)==3
+    for (xvals, yvals) in traces:
+        assert len(xvals)==len(yvals)==len(traces[0][0])
+    timing=swept.lastPipelineTiming
+    assert set(timing)=={'sweep', 'download', 'wait', 'cycle', 'hidden'}
+    assert not swept.inSweep
+
+@pytest.mark.parametrize('attribute', ['WRIT', 'MAX'])
+def testPipelinedSweepsRestoreTrace(swept, attribute):
+    swept.write(f':trac:attr:TRB {attribute}')
+    sweeps=swept.pipelinedSweeps()
+    next(sweeps)
+    assert swept.query(':trac:attr:TRB?').strip()=='FIX'
+    sweeps.close()#Stopped early
+    assert swept.query(':trac:attr:TRB?').strip()==attribute
+    list(swept.pipelinedSweeps(2))
+    assert swept.query(':trac:attr:TRB?').strip()==attribute
+
+def testPipelinedSweepsCancelFirstSweep(swept):
+    swept.configure(span=40, sensitivity='HIGH3')#About 0.15 s simulated
+    swept.write(':trac:attr:TRB WRIT')
+    sweeps=swept.pipelinedSweeps(2)
+    timer=threading.Timer(0.05, swept.cancelSweep)
+    timer.start()
+    with pytest.raises(InterruptedError):
+        next(sweeps)
+    timer.join()
+    assert not swept.inSweep
+    assert swept.query(':trac:attr:TRB?').strip()=='WRIT'
+
+def testSingleSweepAnalysis(swept):
+    result=swept.analyze(['peak'])
+    (xvals, yvals)=swept.getTraceVals()
+    assert result.peakWavelength==pytest.approx(xvals[np.argmax(yvals)], abs=1e-3)
+    assert result.peakPower==pytest.approx(np.max(yvals), abs=1e-2)
+    assert result.width is None#Not requested
+
+def testAnalysisOneQuery(swept, monkeypatch):
+    queries=[]
+    query=swept.query
+    monkeypatch.setattr(swept, 'query', lambda cmd: queries.append(cmd) or query(cmd))
+    result=swept.analyze(['peak', 'width', 'power', 'smsr'])
+    assert len(queries)==1 and queries[0].count(':calc:data?')==4
+    assert result.widthCenter==pytest.approx(result.peakWavelength, abs=0.05)
+    assert result.width>0 and result.smsr>0 and result.power>=result.peakPower
+    assert set(result.asDict())>={'peakWavelength', 'width', 'power', 'smsr', 'modeOffset'}
+    assert swept.getPeakPower()==result.peakPower and swept.getPeakWavelength()==result.peakWavelength
+    assert len(queries)==1#Cached for this sweep
+    assert swept.singleSweep()
+    swept.analyze(['peak'])
+    assert sum(':calc:data?' in cmd for cmd in queries)==2#A new sweep is analyzed again
+
+def testAnalyzeInvalidCategory(swept):
+    with pytest.raises(ValueError):
+        swept.analyze(['osnr'])
+
+@pytest.mark.parametrize('fmt', traceFormats)
+def testGetTraces(swept, fmt):
+    swept.setTraceFormat(fmt)
+    swept.write(':trac:copy TRA,TRB')
+    swept.configure(center=1550.5)#TRC recorded on another axis
+    assert swept.singleSweep()
+    swept.write(':trac:copy TRA,TRC')
+    swept.configure(center=1550)
+    assert swept.singleSweep()
+    (xvals, yvals)=swept.getTraces(['TRA', 'TRB', 'TRC', 'TRD'])
+    assert yvals.shape==(4, len(xvals))
+    np.testing.assert_allclose(xvals, swept.getTraceVals()[0], atol=1e-4)
+    assert not np.isnan(yvals[0]).any() and not np.isnan(yvals[1]).any()
+    inside=xvals>=1549.5
+    assert np.isnan(yvals[2][~inside]).all() and not np.isnan(yvals[2][inside]).any()
+    assert np.isnan(yvals[3]).all()#Empty trace
+
+def testGetTracesRoundTrips(swept, monkeypatch):
+    swept.write(':trac:copy TRA,TRB')
+    sent=[]
+    for name in ('query', 'queryBinary', 'queryBlocks'):
+        method=getattr(swept, name)
+        monkeypatch.setattr(swept, name, lambda *args, method=method: sent.append(args[0]) or method(*args))
+    (xvals, yvals)=swept.getTraces(['TRA', 'TRB'])
+    assert len(sent)==2#Sample counts, then every download at once
+    np.testing.assert_array_equal(yvals[0], yvals[1])
+
+def testGetTracesInvalid(swept):
+    with pytest.raises(ValueError):
+        swept.getTraces(['TRA', 'TRZ'])
+
+def testGetTracesFollowsPanelChange(swept):
+    swept.getTraceVals()#Caches the axis
+    swept.write(':sens:wav:cent 1551nm')#Behind the shadow copy, like the front panel
+    swept.write(':init:smode 1;*CLS;:init')
+    swept.query('*OPC?')
+    (xvals, yvals)=swept.getTraces(['TRA'])
+    assert xvals[0]==pytest.approx(1550.0, abs=1e-4) and xvals[-1]==pytest.approx(1552.0, abs=1e-4)
@@ -0,0 +1,71 @@
+"""test_fleet.py:
+Tests of OSAFleet against two simulators and an address nobody listens on
+"""
+import pytest
+from OSASimulator import startSimulator
+from OSAFleet import OSAFleet, splitAddress
+from conftest import simTimeScale
+
+pytest.importorskip('pyvisa_py', reason='OSAFleet connects with the default pyvisa transport')
+
+deadAddress='127.0.0.1:1'#Connection refused
+
+@pytest.fixture
+def station(simulator):
+    """station: (fleet, healthy addresses, openAll result) for a fleet of two simulators and one OSA that fails to open"""
+    second=startSimulator(timeScale=simTimeScale)
+    addresses=[f'127.0.0.1:{server.server_address[1]}' for server in (simulator, second)]
+    fleet=OSAFleet(addresses+[deadAddress])
+    opened=fleet.openAll()
+    yield (fleet, addresses, opened)
+    fleet.closeAll()
+    second.shutdown()
+    second.server_close()
+
+def testSplitAddress():
+    assert splitAddress('192.168.1.177')==('192.168.1.177', '10001')
+    assert splitAddress('192.168.1.177:10101')==('192.168.1.177', '10101')
+    assert splitAddress(' 10.0.0.1 ', 5000)==('10.0.0.1', '5000')
+
+def testOpenAll(station):
+    (fleet, healthy, opened)=station
+    assert {address for (address, error) in opened.items() if error is None}==set(healthy)
+    assert isinstance(opened[deadAddress], OSError)
+    assert fleet.available()==healthy
+    health=fleet.health()
+    assert not health[deadAddress]['healthy'] and health[deadAddress]['errors']==1
+    assert all(health[address]['healthy'] and health[address]['connected'] for address in healthy)
+
+def testAcquireAllSkipsUnhealthy(station):
+    (fleet, healthy, opened)=station
+    results=list(fleet.acquireAll(center=1550, span=2))
+    assert sorted(r['address'] for r in results)==sorted(healthy)
+    for r in results:
+        assert r['error'] is None
+        (xvals, yvals)=r['result']
+        assert len(xvals)==len(yvals)>0
+        assert xvals[0]==pytest.approx(1549.0)
+    health=fleet.health()
+    assert all(health[address]['jobs']==2 and health[address]['meanLatency']>0 for address in healthy)
+    assert all(health[address]['lastSweepTiming']['sweep']>0 for address in healthy)
+
+def testRunAllReportsErrors(station):
+    (fleet, healthy, opened)=station
+    def failing(osa):
+        raise RuntimeError('job failed')
+    results=list(fleet.runAll(failing))
+    assert all(isinstance(r['error'], RuntimeError) and r['result'] is None for r in results)
+    assert all(fleet.health()[address]['lastError']=='job failed' for address in healthy)
+
+def testRunAllAddresses(station):
+    (fleet, healthy, opened)=station
+    address=healthy[1]
+    results=list(fleet.runAll(lambda osa: osa.query('*IDN?'), addresses=[address]))
+    assert [r['address'] for r in results]==[address]
+    assert results[0]['result'].startswith('YOKOGAWA')
+
+def testReopenFailed(station):
+    (fleet, healthy, opened)=station
+    errors=fleet.openAll([deadAddress])
+    assert list(errors)==[deadAddress] and errors[deadAddress] is not None
+    assert deadAddress not in fleet.available()
@@ -0,0 +1,87 @@
+"""test_instrumentation.py:
+Tests of the OSAInstrumentation histograms and hooks, and of instrumented AQ6380Controls sessions
+"""
+import json
+import pytest
+from OSAInstrumentation import (commandMnemonic, bucketIndex, bucketEdge, bucketCount, LatencyHistogram,
+                                Instrumentation, JsonLinesHook)
+
+def testCommandMnemonic():
+    assert commandMnemonic(':form:data real,64;:trac:y? TRA')==':form:data;:trac:y?'
+    assert commandMnemonic(' :SENS:WAV:CENT 1550nm ')==':sens:wav:cent'
+    assert commandMnemonic('*IDN?;')=='*idn?'
+
+def testBuckets():
+    assert bucketIndex(0.0)==0 and bucketIndex(1e9)==bucketCount-1
+    for seconds in (2e-6, 3.3e-3, 0.5, 30.0):
+        idx=bucketIndex(seconds)
+        assert seconds<=bucketEdge(idx)
+        assert idx==0 or seconds>bucketEdge(idx-1)
+
+def testLatencyHistogram():
+    histogram=LatencyHistogram()
+    assert histogram.snapshot()['min']==0.0 and histogram.percentile(50)==0.0
+    for ms in range(1, 101):
+        histogram.record(ms/1000, bytesOut=10, bytesIn=100, error=ms==100)
+    stats=histogram.snapshot()
+    assert (stats['count'], stats['errors'], stats['bytesOut'], stats['bytesIn'])==(100, 1, 1000, 10000)
+    assert stats['min']==0.001 and stats['max']==0.1
+    assert stats['mean']==pytest.approx(0.0505)
+    assert 0.05<=stats['p50']<=0.05*10**(1/8)#Upper edge of the bucket holding the median
+    assert stats['p99']<=stats['max']
+    assert sum(stats['buckets'].values())==100
+
+def testInstrumentationHooks(tmp_path):
+    instrumentation=Instrumentation(source='osa1')
+    events=[]
+    hook=instrumentation.addHook(events.append)
+    def failing(event):
+        raise RuntimeError('hook failed')
+    instrumentation.addHook(failing)#Errors of one hook do not stop the others or the record
+    jsonl=instrumentation.addHook(JsonLinesHook(str(tmp_path/'trace.jsonl')))
+    instrumentation.recordCommand('query', '*IDN?', 0.002, 6, 40)
+    instrumentation.record('trace', 'TRA', 0.01, points=1001)
+    jsonl.close()
+    assert [(e['kind'], e['name'], e['source']) for e in events]==[('query', '*idn?', 'osa1'), ('trace', 'TRA', 'osa1')]
+    assert events[0]['bytesOut']==6 and events[1]['points']==1001
+    with open(tmp_path/'trace.jsonl') as fp:
+        assert [json.loads(line)['name'] for line in fp]==['*idn?', 'TRA']
+    instrumentation.removeHook(hook)
+    instrumentation.record('trace', 'TRA', 0.01)
+    assert len(events)==2
+
+def testSnapshotResetReport():
+    instrumentation=Instrumentation()
+    instrumentation.recordCommand('query', ':sens:wav:cent?', 0.001)
+    instrumentation.recordCommand('query', ':sens:wav:cent?', 0.003)
+    instrumentation.record('sweep', 'MID', 2.0)
+    snapshot=instrumentation.snapshot()
+    assert snapshot['query'][':sens:wav:cent?']['count']==2
+    lines=instrumentation.report().splitlines()
+    assert lines[0].startswith('kind') and lines[1].startswith('sweep')#Slowest total first
+    assert instrumentation.reset()['sweep']['MID']['count']==1
+    assert set(instrumentation.snapshot())=={'since'}
+
+def testInstrumentedOSA(osa):
+    assert osa.instrumentation is None
+    instrumentation=osa.enableInstrumentation()
+    osa.query('*IDN?')
+    osa.configure(center=1550, span=2)
+    assert osa.singleSweep()
+    (xvals, yvals)=osa.getTraceVals()
+    snapshot=instrumentation.snapshot()
+    assert snapshot['query']['*idn?']['count']==1 and snapshot['query']['*idn?']['bytesIn']>0
+    assert 'write' in snapshot
+    assert snapshot['sweep'] and all(stats['total']>0 for stats in snapshot['sweep'].values())
+    assert snapshot['trace']['TRA']['count']==1
+    assert sum(stats['bytesIn'] for stats in snapshot['binary'].values())>8*len(yvals)#REAL64 trace download
+    assert osa.disableInstrumentation() is instrumentation and osa.instrumentation is None
+    osa.query('*IDN?')
+    assert instrumentation.snapshot()['query']['*idn?']['count']==1#Not recorded once disabled
+
+def testSharedInstrumentation(osa):
+    shared=Instrumentation()
+    assert osa.enableInstrumentation(shared) is shared
+    osa.query('*IDN?')
+    osa.disableInstrumentation()
+    assert shared.snapshot()['query']['*idn?']['count']==1
@@ -0,0 +1,82 @@
+"""test_parse.py:
+Tests of the trace parsers and decoders of AQ6380Controls and OSAExport
+"""
+import numpy as np
+import pytest
+from AQ6380Controls import parseBlockHeader, parseAsciiTrace, decodeBinaryTrace, traceFormatTypes, parseAnalysis
+from OSAExport import parseCsv, formatCsv, encodeBinary, decodeBinary
+
+def testParseBlockHeader():
+    assert parseBlockHeader(b'#18abcdefgh')==(3, 8)
+    assert parseBlockHeader(b'#41600')==(6, 1600)
+
+@pytest.mark.parametrize('data', [b'', b'#', b'x18abcdefgh', b'#40'])
+def testParseBlockHeaderInvalid(data):
+    with pytest.raises(ValueError):
+        parseBlockHeader(data)
+
+def testParseBlockHeaderIndefinite():
+    with pytest.raises(ValueError, match='Indefinite'):
+        parseBlockHeader(b'#0abc')
+
+def testParseAsciiTrace():
+    values=parseAsciiTrace('+1.60300000E-06,+1.60300100E-06,-7.250\r\n')
+    np.testing.assert_array_equal(values, [1.603e-06, 1.603001e-06, -7.25])
+    np.testing.assert_array_equal(parseAsciiTrace(b'1,2,3\n'), [1.0, 2.0, 3.0])
+
+@pytest.mark.parametrize('fmt', ['REAL64', 'REAL32'])
+def testDecodeBinaryTrace(fmt):
+    values=np.array([-60.5, -3.25, 0.0, 1.5])
+    decoded=decodeBinaryTrace(values.astype(traceFormatTypes[fmt]).tobytes(), fmt)
+    assert decoded.dtype==np.float64
+    np.testing.assert_array_equal(decoded, values)
+
+def testParseAnalysis():
+    result=parseAnalysis('+1.60800000E-06,-10.000;+2.500', ['peak', 'power'])
+    assert result['peak']['peakWavelength']==pytest.approx(1608.0)
+    assert result['peak']['peakPower']==pytest.approx(-10.0)
+    assert result['power']['power']==pytest.approx(2.5)
+    with pytest.raises(ValueError):
+        parseAnalysis('+1.60800000E-06,-10.000', ['peak', 'power'])
+    with pytest.raises(ValueError):
+        parseAnalysis('+1.60800000E-06;+2.500', ['peak', 'power'])#Too few peak fields
+
+def testParseCsv():
+    (xvals, yvals)=parseCsv('wavelength,power\n# comment\n\n1550.0,-10.5\n 1550.1,-11\n# sweep 2\n1550.2,-1.2e1\n')
+    np.testing.assert_array_equal(xvals, [1550.0, 1550.1, 1550.2])
+    np.testing.assert_array_equal(yvals, [-10.5, -11.0, -12.0])
+
+def testParseCsvEmpty():
+    (xvals, yvals)=parseCsv('wavelength,power\n')
+    assert len(xvals)==0 and len(yvals)==0
+    assert len(parseCsv('')[0])==0
+
+def testParseCsvNonFinite():
+    (xvals, yvals)=parseCsv('nan,1\n1,2\n-inf,inf\n')#Not headers
+    assert len(xvals)==3
+    assert np.isnan(xvals[0]) and xvals[2]==-np.inf and yvals[2]==np.inf
+
+@pytest.mark.parametrize('text', ['1550.0,-10.5\n1550.1\n', '1550.0,-10.5,3\n', '1550.0,abc\n',
+                                  '1550.0,-10.5\nwavelength,power\n1550.1,-11\n'])
+def testParseCsvInvalid(text):
+    with pytest.raises(ValueError):
+        parseCsv(text)
+
+def testCsvRoundTrip():
+    xvals=np.linspace(1500, 1600, 1001)
+    yvals=-40+10*np.sin(xvals)
+    (x, y)=parseCsv(formatCsv(xvals, yvals))
+    np.testing.assert_array_equal(x, xvals)
+    np.testing.assert_array_equal(y, yvals)
+
+@pytest.mark.parametrize('compress', [False, True])
+def testBinaryRoundTrip(compress):
+    xvals=np.linspace(1500, 1600, 1001)
+    yvals=-40+10*np.sin(xvals)
+    (x, y)=decodeBinary(encodeBinary(xvals, yvals, 'f8', compress))
+    np.testing.assert_allclose(x, xvals, rtol=0, atol=1e-9)
+    np.testing.assert_array_equal(y, yvals)
+    xvals[10]+=0.01#Uneven axis is stored as it is
+    (x, y)=decodeBinary(encodeBinary(xvals, yvals, 'f4', compress))
+    np.testing.assert_array_equal(x, xvals)
+    np.testing.assert_array_equal(y, yvals.astype(np.float32))
@@ -0,0 +1,123 @@
+"""test_plan.py:
+Tests of the OSAPlan cost model, point ordering, checkpoints and plan runs on the simulator
+"""
+import json
+import os
+import pytest
+from OSAExport import loadTrace
+from OSAPlan import (normalizePoint, inheritSettings, loadPlan, CostModel, orderPlan, runPlan,
+                     defaultSweepTime, loadCheckpoint)
+from OSASweepModel import SweepTimeModel
+
+def changes(points, order):
+    """changes: RETURNS: The number of sensitivity changes of points run in order"""
+    sensitivities=[points[idx]['sensitivity'] for idx in order]
+    return sum(a!=b for (a, b) in zip(sensitivities, sensitivities[1:]))
+
+def testNormalizePoint():
+    point=normalizePoint({'center':'1550', 'span':2, 'resolution':'0.020', 'sensitivity':' high1',
+                          'speed':'x2', 'name':'a', 'stop':''})
+    assert point=={'center':1550.0, 'span':2.0, 'resolution':'0.02', 'sensitivity':'HIGH1', 'speed':'2x', 'name':'a'}
+    assert normalizePoint({'resolution':0.02})==normalizePoint({'resolution':'0.02'})
+    with pytest.raises(ValueError):
+        normalizePoint({'wavelength':1550})
+
+def testInheritSettings():
+    points=inheritSettings([{'center':1550.0}, {'span':5.0}, {'center':1560.0, 'sensitivity':'MID'}],
+                           {'span':2.0, 'sensitivity':'NORM', 'stop':1})
+    assert points==[{'center':1550.0, 'span':2.0, 'sensitivity':'NORM'},
+                    {'center':1550.0, 'span':5.0, 'sensitivity':'NORM'},
+                    {'center':1560.0, 'span':5.0, 'sensitivity':'MID'}]
+
+@pytest.mark.parametrize('fmt', ['json', 'csv'])
+def testLoadPlan(tmp_path, fmt):
+    filename=str(tmp_path/f'plan.{fmt}')
+    with open(filename, 'w') as fp:
+        if fmt=='json':
+            json.dump([{'center':1550, 'span':2, 'sensitivity':'norm'}, {'center':1551}], fp)
+        else:
+            fp.write('center,span,sensitivity\n1550,2,norm\n1551,,\n')
+    assert loadPlan(filename)==[{'center':1550.0, 'span':2.0, 'sensitivity':'NORM'},
+                                {'center':1551.0, 'span':2.0, 'sensitivity':'NORM'}]
+
+def testTransitionCost():
+    model=CostModel()
+    point={'center':1550.0, 'sensitivity':'RAPID1'}
+    assert model.transitionCost(point, point)==0.0
+    assert model.transitionCost(point, dict(point, center=1551.0))==pytest.approx(0.1)
+    assert model.transitionCost(point, dict(point, sensitivity='RAPID2'))==pytest.approx(3.0)
+    assert model.transitionCost(point, dict(point, sensitivity='HIGH1'))==pytest.approx(13.0)#Family change too
+    assert model.transitionCost(None, point)==pytest.approx(13.1)
+
+def testSweepTimeFromSweepModel():
+    model=CostModel()
+    point={'span':10.0, 'resolution':'0.02', 'sensitivity':'NORM', 'speed':'1x'}
+    assert model.sweepTime(point)==defaultSweepTime
+    model.sweepModel.observe(point, 2.0)
+    assert model.sweepTime(point)==pytest.approx(2.0)
+    assert model.sweepTime(dict(point, sensitivity='MID'))==pytest.approx(5.0)#Scaled by the typical time ratio
+
+def testSaveLoad(tmp_path):
+    model=CostModel({'center':0.2})
+    model.sweepModel.observe({'span':10.0, 'resolution':0.02, 'sensitivity':'NORM', 'speed':'1x'}, 2.0)
+    filename=str(tmp_path/'model.json')
+    model.save(filename)
+    loaded=CostModel.load(filename)
+    assert loaded.changeCosts==model.changeCosts and loaded.changeCosts['center']==0.2
+    assert isinstance(loaded.sweepModel, SweepTimeModel) and loaded.sweepModel.fits==model.sweepModel.fits
+
+def testOrderPlan():
+    sensitivities=['HIGH1', 'RAPID1', 'NORM', 'RAPID2', 'HIGH1', 'RAPID1', 'NORM', 'RAPID2']
+    points=[{'center':1550.0+idx, 'span':2.0, 'sensitivity':sensitivity} for (idx, sensitivity) in enumerate(sensitivities)]
+    model=CostModel()
+    order=orderPlan(points, model)
+    assert sorted(order)==list(range(len(points)))
+    assert changes(points, order)==3#One change per sensitivity
+    families=[points[idx]['sensitivity'].startswith('RAPID') for idx in order]
+    assert sum(a!=b for (a, b) in zip(families, families[1:]))==1#One family change
+    assert model.estimate([points[idx] for idx in order])[1]<model.estimate(points)[1]
+
+def testOrderPlanKeepsCheapPlanOrder():
+    points=[{'center':1550.0+idx, 'sensitivity':'NORM'} for idx in range(4)]
+    assert orderPlan(points, CostModel())==[0, 1, 2, 3]
+
+def planPoints():
+    """planPoints: RETURNS: A plan of four points in two sensitivities, in plan order"""
+    return [normalizePoint(point) for point in [{'center':1550, 'sensitivity':'MID', 'name':'a'}, {'center':1551, 'sensitivity':'NORM', 'name':'b'},
+                                                {'center':1552, 'sensitivity':'MID', 'name':'c'}, {'center':1553, 'sensitivity':'NORM', 'name':'d'}]]
+
+def testRunPlan(osa, tmp_path):
+    osa.configure(center=1550, span=2, resolution='0.02')
+    osa.write(':sens:wav:span 5nm')#Behind the shadow copy
+    model=CostModel()
+    result=runPlan(osa, planPoints(), str(tmp_path), model=model)
+    assert (result['points'], result['skipped'])==(4, 0)
+    assert changes(planPoints(), result['order'])==1
+    assert set(result)>={'estimated', 'actual', 'estimatedChange', 'actualChange'}
+    assert result['actualChange']<=result['actual']
+    for name in 'abcd':
+        (xvals, yvals)=loadTrace(str(tmp_path/f'{name}.csv'))
+        assert xvals[-1]-xvals[0]==pytest.approx(5.0)#The left out span is the OSA's
+    assert osa.settings['span']==5.0
+    assert osa.sweepModel is None#Detached after the run
+    assert sum(fit['n'] for fit in model.sweepModel.fits.values())==4#Learned from every sweep
+    assert model.sweepTime(dict(planPoints()[0], span=5.0, resolution='0.02'))!=defaultSweepTime
+
+def testRunPlanResume(osa, tmp_path, monkeypatch):
+    checkpoint=str(tmp_path/'plan.checkpoint.json')
+    sweeps=[]
+    singleSweep=osa.singleSweep
+    def failThird():
+        sweeps.append(1)
+        return len(sweeps)!=3 and singleSweep()
+    monkeypatch.setattr(osa, 'singleSweep', failThird)
+    with pytest.raises(RuntimeError):
+        runPlan(osa, planPoints(), str(tmp_path), checkpoint, reorder=False)
+    assert sorted(loadCheckpoint(checkpoint, planPoints()))==['0', '1']
+    assert sorted(os.listdir(tmp_path))==['a.csv', 'b.csv', 'plan.checkpoint.json']
+    result=runPlan(osa, planPoints(), str(tmp_path), checkpoint, reorder=False)
+    assert (result['points'], result['skipped'])==(2, 2)
+    assert sorted(result['results'])==['0', '1', '2', '3']
+    assert len(sweeps)==5
+    with pytest.raises(ValueError):
+        runPlan(osa, planPoints()[:2], str(tmp_path), checkpoint)#Checkpoint of another plan
@@ -0,0 +1,37 @@
+"""test_plot.py:
+Tests of the OSAPlot min/max decimation; the Tk plot itself needs a display and is not tested here
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip('tkinter')
+from OSAPlot import minMaxDecimate
+
+def testShortTraceUnchanged():
+    xvals=np.arange(20.0)
+    yvals=np.sin(xvals)
+    (x, y)=minMaxDecimate(xvals, yvals, 10)
+    assert x is xvals and y is yvals
+
+def testBucketMinMax():
+    xvals=np.arange(12.0)
+    yvals=np.array([0, 5, -1, 2, 9, 3, -4, 1, 7, 8, 6, -2], dtype=float)
+    (x, y)=minMaxDecimate(xvals, yvals, 3)#Buckets of 4 points
+    np.testing.assert_array_equal(x, [1, 2, 4, 6, 9, 11])#Two points per bucket, in trace order
+    np.testing.assert_array_equal(y, [5, -1, 9, -4, 8, -2])
+
+def testUnevenBuckets():
+    xvals=np.arange(10001.0)
+    yvals=np.random.default_rng(1).normal(-60, 1, len(xvals))
+    (x, y)=minMaxDecimate(xvals, yvals, 640)
+    assert len(x)==len(y)<=2*640
+    assert np.all(np.diff(x)>=0)
+    assert y.max()==yvals.max() and y.min()==yvals.min()
+    assert x[-1]<=xvals[-1]
+
+def testPeakKept():
+    xvals=np.linspace(1545, 1555, 100001)
+    yvals=np.full(len(xvals), -70.0)
+    yvals[50000]=0.0#A one point peak
+    (x, y)=minMaxDecimate(xvals, yvals, 500)
+    assert y.max()==0.0 and x[np.argmax(y)]==xvals[50000]
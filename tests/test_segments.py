@@ -0,0 +1,105 @@
+"""test_segments.py:
+Tests of the OSASegments tiling and stitching, and of segmented sweeps on the simulator
+"""
+import numpy as np
+import pytest
+from OSASimulator import startSimulator
+from OSAFleet import OSAFleet
+from OSASegments import planSegments, segmentWeights, stitchSegments, segmentedSweep
+from conftest import simTimeScale
+
+def tileTrace(start, stop, step=0.01, power=lambda x: -30-(x-1550)**2):
+    """tileTrace: RETURNS: (xvals, yvals) of a smooth spectrum sampled from start to stop"""
+    xvals=np.linspace(start, stop, int(round((stop-start)/step))+1)
+    return (xvals, power(xvals))
+
+def testPlanSegments():
+    plan=planSegments(1520, 1620, 4, overlap=2)
+    assert len(plan)==4
+    spans={span for (center, span) in plan}
+    assert len(spans)==1 and spans.pop()==pytest.approx(26.5)
+    assert plan[0][0]-plan[0][1]/2==pytest.approx(1520)
+    assert plan[-1][0]+plan[-1][1]/2==pytest.approx(1620)
+    for ((center, span), (nextcenter, nextspan)) in zip(plan, plan[1:]):
+        assert (center+span/2)-(nextcenter-nextspan/2)==pytest.approx(2)
+    assert planSegments(1520, 1620, 1)==[(1570.0, 100.0)]
+
+@pytest.mark.parametrize('args', [(1620, 1520, 2), (1520, 1620, 0), (1520, 1620, 2, 100)])
+def testPlanSegmentsInvalid(args):
+    with pytest.raises(ValueError):
+        planSegments(*args)
+
+@pytest.mark.parametrize('method', ['blend', 'cut'])
+def testSegmentWeights(method):
+    grid=np.linspace(0, 10, 101)
+    weights=segmentWeights(grid, [(0, 6), (4, 10)], method)
+    np.testing.assert_allclose(weights.sum(axis=0), 1.0)#Every point is covered exactly once in total
+    assert weights[0, 0]==1 and weights[1, 0]==0
+    assert weights[0, -1]==0 and weights[1, -1]==1
+    if method=='blend':
+        assert weights[0, 50]==pytest.approx(0.5)
+    else:
+        assert set(np.unique(weights))=={0.0, 1.0}
+        assert weights[0, 49]==1 and weights[1, 50]==1#Cut at the middle of the overlap
+
+@pytest.mark.parametrize('method', ['blend', 'cut'])
+def testStitchSegments(method):
+    tiles=[tileTrace(1545, 1551), tileTrace(1549, 1555, 0.02)]
+    (xvals, yvals)=stitchSegments(tiles[::-1], method=method)#Any order
+    assert xvals[0]==pytest.approx(1545) and xvals[-1]==pytest.approx(1555)
+    assert np.diff(xvals)==pytest.approx(0.01)#The finest step
+    np.testing.assert_allclose(yvals, -30-(xvals-1550)**2, atol=1e-3)
+
+def testStitchSegmentsGap():
+    (xvals, yvals)=stitchSegments([tileTrace(1545, 1548), tileTrace(1550, 1553)], step=0.1)
+    gap=(xvals>1548.05)&(xvals<1549.95)
+    assert np.isnan(yvals[gap]).all() and np.isfinite(yvals[~gap]).all()
+
+def testStitchSegmentsInvalid():
+    with pytest.raises(ValueError):
+        stitchSegments([tileTrace(1545, 1548)], method='average')
+    with pytest.raises(ValueError):
+        stitchSegments([])
+
+def checkStitched(xvals, yvals, tiles, segments):
+    """checkStitched: Checks a segmented sweep of 1549-1553 nm, which holds the 1550.12 and 1551.72 nm channels"""
+    assert len(tiles)==segments
+    assert all(tile['points']>0 and tile['elapsed']>0 for tile in tiles)
+    assert xvals[0]==pytest.approx(1549) and xvals[-1]==pytest.approx(1553)
+    assert np.isfinite(yvals).all()
+    assert xvals[np.argmax(yvals)]==pytest.approx(1550.12, abs=0.05)
+    second=(xvals>1551.5)&(xvals<1552)
+    assert xvals[second][np.argmax(yvals[second])]==pytest.approx(1551.72, abs=0.05)
+
+def testSegmentedSweep(osa):
+    (xvals, yvals, tiles)=segmentedSweep(osa, 1549, 1553, segments=3, overlap=0.2)
+    checkStitched(xvals, yvals, tiles, 3)
+    assert all(tile['address'] is None for tile in tiles)
+
+@pytest.fixture
+def fleet(simulator):
+    """fleet: An open OSAFleet of two simulators and one address that fails to open"""
+    pytest.importorskip('pyvisa_py', reason='OSAFleet connects with the default pyvisa transport')
+    second=startSimulator(timeScale=simTimeScale)
+    fleet=OSAFleet([f'127.0.0.1:{server.server_address[1]}' for server in (simulator, second)]+['127.0.0.1:1'])
+    fleet.openAll()
+    yield fleet
+    fleet.closeAll()
+    second.shutdown()
+    second.server_close()
+
+def testSegmentedSweepFleet(fleet):
+    (xvals, yvals, tiles)=segmentedSweep(fleet, 1549, 1553)#One tile per healthy OSA
+    checkStitched(xvals, yvals, tiles, 2)
+    assert {tile['address'] for tile in tiles}==set(fleet.available())
+    (xvals, yvals, tiles)=segmentedSweep(fleet, 1549, 1553, segments=4, method='cut')
+    checkStitched(xvals, yvals, tiles, 4)
+
+def testSegmentedSweepNoOSA():
+    fleet=OSAFleet(['127.0.0.1:1'])
+    fleet.openAll()
+    try:
+        with pytest.raises(RuntimeError):
+            segmentedSweep(fleet, 1549, 1553)
+    finally:
+        fleet.closeAll()
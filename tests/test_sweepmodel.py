@@ -0,0 +1,89 @@
+"""test_sweepmodel.py:
+Tests of the OSASweepModel sweep time fits and the fastest sensitivity selection
+"""
+import pytest
+from AQ6380Controls import dBmFromSensitivity
+from OSASweepModel import SweepTimeModel, candidateSettings, chooseSensitivity, autoConfigure, timeFactor
+
+def sweepSettings(span, sensitivity='NORM', speed='1x', resolution=0.02):
+    """sweepSettings: RETURNS: A settings dict as in AQ6380Controls.settings"""
+    return {'span':span, 'resolution':resolution, 'sensitivity':sensitivity, 'speed':speed}
+
+def testKey():
+    assert SweepTimeModel.key('norm', 'x2')=='NORM 2x'
+    assert SweepTimeModel.key('RAPID1', '2x')=='RAPID1 1x'#Rapid sensitivities have no 2x speed
+    assert SweepTimeModel.key('MID', None)=='MID 1x'
+
+def testObserveIncomplete():
+    model=SweepTimeModel()
+    assert not model.observe({'span':10.0}, 1.0)
+    assert not model.observe(sweepSettings(10.0, resolution=0), 1.0)
+    assert model.predict(sweepSettings(10.0)) is None#Nothing learned
+    assert model.predict({'span':10.0}) is None
+
+def testLinearFit():
+    model=SweepTimeModel()
+    for span in (2.0, 4.0, 6.0):
+        assert model.observe(sweepSettings(span), 1.0+0.01*span/0.02)#1 s plus 10 ms per resolution element
+    assert model.predict(sweepSettings(8.0))==pytest.approx(5.0)
+    assert model.predict(sweepSettings(8.0, resolution=0.04))==pytest.approx(3.0)
+
+def testSingleSpanScales():
+    model=SweepTimeModel()
+    model.observe(sweepSettings(10.0), 2.0)
+    model.observe(sweepSettings(10.0), 4.0)
+    assert model.predict(sweepSettings(20.0))==pytest.approx(6.0)#Proportional to the size
+
+def testUnsweptSettingsScaled():
+    model=SweepTimeModel()
+    model.observe(sweepSettings(10.0, 'NORM'), 2.0)
+    assert model.predict(sweepSettings(10.0, 'HIGH1'))==pytest.approx(2.0*timeFactor('HIGH1', '1x'))
+    assert model.predict(sweepSettings(10.0, 'NORM', '2x'))==pytest.approx(1.0)
+
+def testSaveLoad(tmp_path):
+    model=SweepTimeModel()
+    model.observe(sweepSettings(10.0, 'MID'), 3.0)
+    filename=str(tmp_path/'sweepmodel.json')
+    model.save(filename)
+    loaded=SweepTimeModel.load(filename)
+    assert loaded.fits==model.fits
+    assert loaded.predict(sweepSettings(10.0, 'MID'))==pytest.approx(3.0)
+    assert SweepTimeModel.load(str(tmp_path/'missing.json')).fits=={}
+
+def testCandidateSettings():
+    assert candidateSettings(['norm', 'RAPID1'])==[('NORM', '1x'), ('NORM', '2x'), ('RAPID1', '1x')]
+
+def testChooseSensitivity():
+    choice=chooseSensitivity(None, 0.0, 40.0, 10.0, 0.02)
+    assert choice['met'] and choice['floor']<=-40.0 and choice['predicted'] is None
+    for (sensitivity, speed) in candidateSettings():
+        if dBmFromSensitivity(sensitivity, speed)<=-40.0:
+            assert timeFactor(sensitivity, speed)>=timeFactor(choice['sensitivity'], choice['speed'])
+    weak=chooseSensitivity(None, -60.0, 40.0, 10.0, 0.02)
+    assert weak['floor']<choice['floor']#A weaker signal needs a lower noise floor
+
+def testChooseSensitivityMarginNotMet():
+    choice=chooseSensitivity(None, -80.0, 40.0, 10.0, 0.02)
+    assert not choice['met']
+    assert choice['floor']==min(dBmFromSensitivity(*pair) for pair in candidateSettings())
+
+def testChooseSensitivityUsesModel():
+    assert chooseSensitivity(None, 0.0, 40.0, 10.0, 0.02, ['RAPID1', 'RAPID2'])['sensitivity']=='RAPID1'
+    model=SweepTimeModel()
+    model.observe(sweepSettings(10.0, 'RAPID1'), 4.0)#Measured slower than RAPID2 on this OSA
+    model.observe(sweepSettings(10.0, 'RAPID2'), 1.0)
+    choice=chooseSensitivity(model, 0.0, 40.0, 10.0, 0.02, ['RAPID1', 'RAPID2'])
+    assert choice['sensitivity']=='RAPID2' and choice['predicted']==pytest.approx(1.0)
+
+def testAutoConfigure(osa):
+    with pytest.raises(ValueError):
+        autoConfigure(osa, None, 40.0)#Span and resolution unknown
+    model=SweepTimeModel()
+    osa.sweepModel=model#Every sweep teaches the model
+    osa.configure(center=1550.12, span=2, resolution='0.02')
+    choice=autoConfigure(osa, model, 40.0)
+    assert osa.sweepCount==1 and choice['signal']>-20#Probe sweep of the 0 dBm channel
+    assert osa.settings['sensitivity']==choice['sensitivity'] and choice['met']
+    assert sum(fit['n'] for fit in model.fits.values())==1
+    assert osa.singleSweep()
+    assert model.predict(osa.settings) is not None
@@ -0,0 +1,128 @@
+"""test_tracewriter.py:
+Tests of the OSATraceWriter modes and drop policies, and of the repeatsinglesweep sweep loop
+"""
+import os
+import threading
+import numpy as np
+import pytest
+from OSAExport import loadTrace
+from OSATraceWriter import TraceWriter
+from repeatsinglesweep import singleSweeps
+
+def makeTrace(points, offset=0.0):
+    """makeTrace: RETURNS: An evenly spaced (xvals, yvals) trace of points samples"""
+    xvals=np.linspace(1549.0, 1551.0, points)
+    return (xvals, -40+offset+np.arange(points)%7)
+
+def writeAll(writer, traces):
+    """writeAll: Writes traces with a started writer and closes it RETURNS: writer.stats()"""
+    writer.start()
+    for trace in traces:
+        writer.put(*trace)
+    writer.close()
+    return writer.stats()
+
+def testInvalidOptions(tmp_path):
+    with pytest.raises(ValueError):
+        TraceWriter(str(tmp_path/'run.csv'), 'replace')
+    with pytest.raises(ValueError):
+        TraceWriter(str(tmp_path/'run.csv'), dropPolicy='drop_newest')
+    with pytest.raises(ValueError):
+        TraceWriter(str(tmp_path/'run.txt'))#Unknown overwrite format
+
+@pytest.mark.parametrize('name', ['run.csv', 'run.npy', 'run.aqb'])
+def testOverwrite(tmp_path, name):
+    filename=str(tmp_path/name)
+    stats=writeAll(TraceWriter(filename), [makeTrace(11, sweep) for sweep in range(3)])
+    assert stats['written']==3 and stats['errors']==0 and stats['file']==filename
+    (xvals, yvals)=loadTrace(filename)
+    np.testing.assert_allclose(xvals, makeTrace(11)[0])
+    np.testing.assert_array_equal(yvals, makeTrace(11, 2)[1])#Only the latest trace
+    assert not os.path.exists(filename+'.tmp')
+
+def testAppend(tmp_path):
+    filename=str(tmp_path/'run.csv')
+    stats=writeAll(TraceWriter(filename, 'append'), [makeTrace(11, sweep) for sweep in range(4)])
+    data=np.loadtxt(filename, delimiter=',')
+    assert data.shape==(44, 2)
+    np.testing.assert_array_equal(data[33:, 1], makeTrace(11, 3)[1])
+    assert os.path.getsize(filename)==stats['bytesWritten']
+    with open(filename) as fp:
+        assert sum(line.startswith('# sweep ') for line in fp)==4
+
+def testRotateKeepsEarlierRuns(tmp_path):
+    filename=str(tmp_path/'run.csv')
+    writeAll(TraceWriter(filename, 'rotate', rotateBytes=1), [makeTrace(11) for sweep in range(2)])
+    assert sorted(os.listdir(tmp_path))==['run_0001.csv', 'run_0002.csv']
+    first=open(tmp_path/'run_0001.csv').read()
+    writer=TraceWriter(filename, 'rotate', rotateBytes=1)
+    writeAll(writer, [makeTrace(11, 1) for sweep in range(2)])#A restarted run
+    assert sorted(os.listdir(tmp_path))==['run_0001.csv', 'run_0002.csv', 'run_0003.csv', 'run_0004.csv']
+    assert open(tmp_path/'run_0001.csv').read()==first
+    assert writer.stats()['file']==str(tmp_path/'run_0004.csv')
+
+def testDropNewest(tmp_path):
+    writer=TraceWriter(str(tmp_path/'run.csv'), 'append', queueSize=2, dropPolicy='dropNewest')#Not started; the queue fills
+    assert [writer.put(*makeTrace(11, sweep)) for sweep in range(4)]==[True, True, False, False]
+    writer.start()
+    writer.close()
+    data=np.loadtxt(str(tmp_path/'run.csv'), delimiter=',')
+    np.testing.assert_array_equal(data[11:, 1], makeTrace(11, 1)[1])
+    stats=writer.stats()
+    assert (stats['received'], stats['written'], stats['dropped'])==(4, 2, 2)
+
+def testDropOldest(tmp_path):
+    writer=TraceWriter(str(tmp_path/'run.csv'), 'append', queueSize=2, dropPolicy='dropOldest')
+    assert all(writer.put(*makeTrace(11, sweep)) for sweep in range(4))
+    assert writer.stats()['queueDepth']==2
+    writer.start()
+    writer.close()
+    data=np.loadtxt(str(tmp_path/'run.csv'), delimiter=',')
+    np.testing.assert_array_equal(data[:11, 1], makeTrace(11, 2)[1])#The two newest traces
+    np.testing.assert_array_equal(data[11:, 1], makeTrace(11, 3)[1])
+    assert writer.stats()['dropped']==2
+
+def testCloseTimeout(tmp_path, monkeypatch):
+    writer=TraceWriter(str(tmp_path/'run.csv'), 'append')
+    release=threading.Event()
+    writeTrace=writer.writeTrace
+    monkeypatch.setattr(writer, 'writeTrace', lambda *item: release.wait() and writeTrace(*item))
+    writer.start()
+    writer.put(*makeTrace(11))
+    with pytest.raises(TimeoutError):
+        writer.close(timeout=0.05)
+    release.set()
+    writer.close()
+    assert writer.stats()['written']==1
+    assert np.loadtxt(str(tmp_path/'run.csv'), delimiter=',').shape==(11, 2)
+
+def testStatsLine(tmp_path):
+    writer=TraceWriter(str(tmp_path/'run.csv'))
+    writeAll(writer, [makeTrace(11)])
+    assert '1 written, 0 dropped' in writer.statsLine()
+
+class FlakyOSA:
+    """class FlakyOSA:
+        Stands in for AQ6380Controls with a list of singleSweep results"""
+    def __init__(self, results):
+        self.results=list(results)
+        self.downloads=0
+    def singleSweep(self):
+        return self.results.pop(0)
+    def getTraceVals(self):
+        self.downloads+=1
+        return makeTrace(11, self.downloads)
+
+def testSingleSweepsSkipsFailedSweeps():
+    osa=FlakyOSA([True, False, True, False, False, True])
+    traces=singleSweeps(osa)
+    assert [next(traces)[1][0] for sweep in range(3)]==[-39.0, -38.0, -37.0]
+    assert osa.downloads==3#Nothing downloaded for the failed sweeps
+
+def testSingleSweepsStopsAfterFailures():
+    osa=FlakyOSA([True, False, False, False])
+    traces=singleSweeps(osa, maxFailures=3)
+    next(traces)
+    with pytest.raises(RuntimeError):
+        next(traces)
+    assert osa.downloads==1
@@ -0,0 +1,122 @@
+"""test_transport.py:
+Tests of the OSATransport backends against the simulator and a server with fixed replies
+"""
+import socketserver
+import threading
+import numpy as np
+import pytest
+from AQ6380Controls import parseAsciiTrace, decodeBinaryTrace
+from OSATransport import createTransport
+
+@pytest.fixture
+def link(simulator, transport):
+    """link: A signed in transport on the simulator with one finished sweep in TRA"""
+    connection=createTransport(transport)
+    connection.open('127.0.0.1', str(simulator.server_address[1]), timeout=5000)
+    assert 'AUTHENTICATE' in connection.query('open "anonymous"')
+    assert connection.query('aaa').strip()=='ready'
+    connection.write(':sens:wav:span 2nm;:init:smode 1;*CLS;:init')
+    assert connection.query('*OPC?').strip()=='1'
+    yield connection
+    connection.close()
+
+def testCreateTransportInvalid():
+    with pytest.raises(ValueError):
+        createTransport('serial')
+
+def testQuery(link):
+    assert link.query('*IDN?').strip().startswith('YOKOGAWA')
+    assert float(link.query(':sens:wav:span?'))==pytest.approx(2e-9)
+
+@pytest.mark.parametrize('fmt', ['REAL64', 'REAL32'])
+def testQueryBlock(link, fmt):
+    link.write(':form:data real,64' if fmt=='REAL64' else ':form:data real,32')
+    (data, received)=link.queryBlock(':trac:y? TRA')
+    points=int(link.query(':trac:snum? TRA'))
+    yvals=decodeBinaryTrace(data, fmt)
+    assert len(yvals)==points
+    assert received>=len(data)+3
+    link.write(':form:data ascii')
+    np.testing.assert_allclose(yvals, parseAsciiTrace(link.query(':trac:y? TRA')), atol=1e-3)
+
+def testQueryBlockAscii(link):
+    link.write(':form:data ascii')
+    (data, received)=link.queryBlock(':trac:x? TRA')
+    assert isinstance(data, str)
+    xvals=parseAsciiTrace(data)
+    assert len(xvals)==int(link.query(':trac:snum? TRA'))
+    assert xvals[-1]-xvals[0]==pytest.approx(2e-9)
+
+def testQueryBlocks(link):
+    link.write(':form:data real,64')
+    (replies, received)=link.queryBlocks(':trac:y? TRA;:trac:x? TRA,1,1;:trac:x? TRA,2,2', 3)
+    assert len(replies)==3
+    assert received==sum(2+len(str(len(reply)))+len(reply)+1 for reply in replies)#'#N', length, data and separator
+    (first, second)=(decodeBinaryTrace(replies[1])[0], decodeBinaryTrace(replies[2])[0])
+    assert len(decodeBinaryTrace(replies[0]))==int(link.query(':trac:snum? TRA'))
+    assert second>first
+    assert link.query('*IDN?').strip().startswith('YOKOGAWA')#Nothing left unread
+
+def testQueryBlocksAscii(link):
+    link.write(':form:data ascii')
+    (replies, received)=link.queryBlocks(':trac:x? TRA,1,1;:trac:snum? TRA', 2)
+    assert all(isinstance(reply, str) for reply in replies)
+    assert float(replies[0])==pytest.approx(float(link.query(':sens:wav:star?')))
+    assert int(replies[1])==int(link.query(':trac:snum? TRA'))
+
+def testQueryBlocksMixed(link):
+    link.write(':form:data real,64')
+    (replies, received)=link.queryBlocks(':trac:x? TRA,1,1;*IDN?', 2)
+    assert len(decodeBinaryTrace(replies[0]))==1
+    assert replies[1].strip().startswith('YOKOGAWA')
+
+def testTimeout(link):
+    link.timeout=1234
+    assert link.timeout==1234
+
+class CannedHandler(socketserver.StreamRequestHandler):
+    """class CannedHandler:
+        Answers each command line with its raw reply from the server's replies dict"""
+    def handle(self):
+        for line in self.rfile:
+            reply=self.server.replies.get(line.strip().decode('ascii'))
+            if reply is not None:
+                self.wfile.write(reply)
+                self.wfile.flush()
+
+@pytest.fixture
+def canned(transport):
+    """canned: A transport connected to a server with fixed raw replies"""
+    server=socketserver.ThreadingTCPServer(('127.0.0.1', 0), CannedHandler)
+    server.daemon_threads=True
+    server.replies={'one?':b'1\n', 'empty?':b'\n', 'crlf?':b'+1.5,-2\r\n', 'blockcrlf?':b'#14abcd\r\n',
+                    'blocks?':b'#12ab;#13cde\r\n', 'short?':b'#12ab\n', 'check?':b'ok\n'}
+    thread=threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    connection=createTransport(transport)
+    connection.open('127.0.0.1', str(server.server_address[1]), timeout=5000)
+    connection.timeout=1000
+    yield connection
+    connection.close()
+    server.shutdown()
+    server.server_close()
+
+@pytest.mark.parametrize(('cmd', 'reply'), [('one?', '1'), ('empty?', ''), ('crlf?', '+1.5,-2')])
+def testQueryBlockShortAscii(canned, cmd, reply):
+    assert canned.queryBlock(cmd)[0]==reply
+    assert canned.query('check?')=='ok'#Nothing left unread and nothing read ahead
+
+def testQueryBlockCrlf(canned):
+    (data, received)=canned.queryBlock('blockcrlf?')
+    assert bytes(data)==b'abcd'
+    assert canned.query('check?')=='ok'
+
+def testQueryBlocksCrlf(canned):
+    (replies, received)=canned.queryBlocks('blocks?', 2)
+    assert [bytes(reply) for reply in replies]==[b'ab', b'cde']
+    assert canned.query('check?')=='ok'
+
+def testQueryBlocksShortLine(canned):
+    (replies, received)=canned.queryBlocks('short?', 2)#One reply instead of two ends the line
+    assert [bytes(reply) for reply in replies]==[b'ab']
+    assert canned.query('check?')=='ok'
@@ -0,0 +1,185 @@
+"""test_worker.py:
+Tests of the OSAWorker command queue: coalescing, priorities and cancellation
+"""
+import threading
+import time
+import pytest
+from OSAWorker import OSAWorker
+
+class DummyMaster:
+    """class DummyMaster:
+        Stands in for the Tk widget; results are delivered by calling worker.poll directly"""
+    def after(self, ms, func):
+        pass
+
+class DummyOSA:
+    """class DummyOSA:
+        Records the cancel requests the worker makes"""
+    def __init__(self):
+        self.cancels=0
+        self.clears=0
+    def cancelSweep(self):
+        self.cancels+=1
+    def clearCancel(self):
+        self.clears+=1
+
+@pytest.fixture
+def worker():
+    """worker: A started OSAWorker on a DummyOSA"""
+    worker=OSAWorker(DummyOSA(), DummyMaster())
+    worker.start()
+    yield worker
+    worker.stop()
+    worker.join(1)
+
+def block(worker):
+    """block: Occupies the worker until the returned event is set RETURNS: (started, release) events"""
+    (started, release)=(threading.Event(), threading.Event())
+    worker.submit('block', lambda osa: started.set() or release.wait(5), priority='urgent')
+    assert started.wait(1)
+    return (started, release)
+
+def finish(worker, *commands):
+    """finish: Waits for commands to leave the worker and delivers their results"""
+    deadline=time.monotonic()+2
+    while any(command.state in ('queued', 'running') and not command.cancelled.is_set() for command in commands):
+        assert time.monotonic()<deadline
+        time.sleep(0.005)
+    while worker.queueDepth() and time.monotonic()<deadline:
+        time.sleep(0.005)
+    worker.poll()
+
+def testInvalidPriority(worker):
+    with pytest.raises(ValueError):
+        worker.submit('bad', lambda osa: None, priority='soon')
+
+def testResultsAndErrors(worker):
+    (values, errors)=([], [])
+    def failing(osa):
+        raise RuntimeError('no trace')
+    good=worker.submit('add', lambda osa, a, b: a+b, 2, 3, callback=values.append)
+    bad=worker.submit('fail', failing, errback=errors.append)
+    finish(worker, good, bad)
+    assert values==[5] and good.state=='done'
+    assert [str(e) for e in errors]==['no trace'] and bad.state=='failed'
+
+def testCoalescing(worker):
+    (started, release)=block(worker)
+    calls=[]
+    received=[]
+    first=worker.submit('trace', lambda osa: calls.append(1) or 'trace', priority='data', key='trace', callback=received.append)
+    second=worker.submit('trace', lambda osa: calls.append(2) or 'other', priority='data', key='trace',
+                         callback=lambda value: received.append(value.upper()))
+    assert second is first
+    assert worker.queueDepth()==2#The blocking command and one download
+    release.set()
+    finish(worker, first)
+    assert calls==[1]
+    assert received==['trace', 'TRACE']
+    third=worker.submit('trace', lambda osa: 'new', priority='data', key='trace', callback=received.append)
+    assert third is not first#The earlier command has run
+    finish(worker, third)
+    assert received[-1]=='new'
+
+def testPriorityOrder(worker):
+    (started, release)=block(worker)
+    order=[]
+    commands=[worker.submit(name, lambda osa, name=name: order.append(name), priority=name)
+              for name in ('background', 'data', 'interactive', 'urgent')]
+    release.set()
+    finish(worker, *commands)
+    assert order==['urgent', 'interactive', 'data', 'background']
+
+def testCoalescingRaisesPriority(worker):
+    (started, release)=block(worker)
+    order=[]
+    keyed=worker.submit('step', lambda osa: order.append('step'), priority='background', key='step')
+    other=worker.submit('sweep', lambda osa: order.append('sweep'), priority='interactive')
+    assert worker.submit('step', lambda osa: None, priority='urgent', key='step') is keyed
+    release.set()
+    finish(worker, keyed, other)
+    assert order==['step', 'sweep']#Run once, at the raised priority
+
+def testCancelQueued(worker):
+    (started, release)=block(worker)
+    ran=[]
+    command=worker.submit('sweep', lambda osa: ran.append(1), key='sweep')
+    worker.cancel(command)
+    assert command.cancelled.is_set()
+    later=worker.submit('sweep', lambda osa: ran.append(2), key='sweep')
+    assert later is not command#A cancelled command is not joined
+    release.set()
+    finish(worker, later)
+    assert ran==[2]
+    assert worker.osa.cancels==0#Nothing was running
+
+def testCancelRunning(worker):
+    (started, release)=(threading.Event(), threading.Event())
+    received=[]
+    command=worker.submit('sweep', lambda osa: started.set() or release.wait(5), key='sweep', callback=received.append)
+    assert started.wait(1)
+    worker.cancel(key='sweep')
+    assert worker.osa.cancels==1
+    release.set()
+    finish(worker, command)
+    assert command.state=='cancelled' and received==[]
+
+def testCancelAll(worker):
+    (started, release)=block(worker)
+    ran=[]
+    commands=[worker.submit(f'job{i}', lambda osa, i=i: ran.append(i), priority='data', key=f'job{i}') for i in range(3)]
+    worker.cancelAll()
+    assert all(command.cancelled.is_set() for command in commands)
+    assert worker.osa.cancels==1#The blocking command was running
+    release.set()
+    finish(worker)
+    assert ran==[]
+
+def testStop():
+    worker=OSAWorker(DummyOSA(), DummyMaster())
+    worker.start()
+    ran=[]
+    worker.submit('job', lambda osa: ran.append(1))
+    finish(worker)
+    worker.stop()
+    worker.join(1)
+    assert not worker.is_alive()
+    assert ran==[1]
+
+def testClearsStaleCancel(osa):
+    worker=OSAWorker(osa, DummyMaster())
+    osa.configure(center=1550, span=2)
+    osa.cancelSweep()#Meant for an earlier command
+    worker.start()
+    try:
+        results=[]
+        command=worker.submit('sweep', lambda osa: osa.singleSweep(), callback=results.append)
+        finish(worker, command)
+        assert results==[True]
+    finally:
+        worker.stop()
+        worker.join(1)
+
+def testCancelRunningSweep(osa):
+    osa.configure(span=40, sensitivity='HIGH3')#About 0.15 s simulated
+    worker=OSAWorker(osa, DummyMaster())
+    worker.start()
+    try:
+        results=[]
+        command=worker.submit('sweep', lambda osa: osa.singleSweep(), key='sweep', callback=results.append)
+        time.sleep(0.05)
+        worker.cancel(command)
+        finish(worker, command)
+        assert command.state=='cancelled' and results==[]
+        assert not osa.inSweep
+        again=worker.submit('sweep', lambda osa: osa.singleSweep(), key='sweep', callback=results.append)
+        finish(worker, again)
+        assert results==[True]
+    finally:
+        worker.stop()
+        worker.join(1)
+
+def testCancelBeforeSweep(osa):
+    osa.cancelSweep()
+    assert not osa.singleSweep()
+    assert osa.singleSweep()#Request was consumed
@@ -0,0 +1,68 @@
+"""test_zoom.py:
+Tests of the OSAZoom region search and trace merging, and of zoom sweeps on the simulator
+"""
+import numpy as np
+import pytest
+from OSAAnalysis import dBmToMw, mwToDbm
+from OSAZoom import findRegions, mergeTraces, zoomSweep
+
+def channelTrace(channels, step=0.01, floor=-70.0):
+    """channelTrace:
+    A 1540-1560 nm trace of lorentzian channels with a 0.05 nm FWHM on a flat floor
+    INPUTS:
+    channels (list of (wavelength, power)): The channels in nm and dBm
+    RETURNS:
+    (xvals, yvals)"""
+    xvals=np.round(np.arange(1540, 1560+step/2, step), 6)
+    linear=np.full(len(xvals), dBmToMw(floor))
+    for (center, power) in channels:
+        linear+=dBmToMw(power)/(1+((xvals-center)/0.025)**2)
+    return (xvals, mwToDbm(linear))
+
+def testFindRegions():
+    trace=channelTrace([(1545.0, 0.0), (1552.0, -10.0)])
+    regions=findRegions(*trace)
+    assert [region['peaks'] for region in regions]==[[1545.0], [1552.0]]
+    for region in regions:
+        assert region['stop']-region['start']==pytest.approx(3*0.05*np.sqrt(99), abs=0.02)#3 times the -20 dB width
+        assert region['start']<region['peaks'][0]<region['stop']
+    assert [region['peaks'] for region in findRegions(*trace, threshold=-5.0)]==[[1545.0]]
+    wide=findRegions(*trace, minSpan=4.0)[0]
+    assert wide['stop']-wide['start']==pytest.approx(4.0)
+    assert [region['peaks'] for region in findRegions(*trace, maxRegions=1)]==[[1545.0]]
+
+def testFindRegionsMergesAndClips():
+    trace=channelTrace([(1545.0, 0.0), (1545.4, -3.0), (1559.9, -5.0)])
+    regions=findRegions(*trace, start=1541.0, stop=1559.95)
+    assert len(regions)==2
+    assert sorted(regions[0]['peaks'])==[1545.0, 1545.4]#Overlapping regions are merged
+    assert regions[0]['start']<1544.5 and regions[0]['stop']>1545.9#Covers both channels
+    assert regions[1]['stop']==1559.95#Clipped to the range
+
+def testFindRegionsNone():
+    assert findRegions(*channelTrace([]))==[]
+
+def testMergeTraces():
+    coarse=(np.arange(0.0, 10.1, 1.0), np.zeros(11))
+    fines=[(np.arange(2.0, 4.01, 0.5), np.ones(5)), (np.array([]), np.array([]))]
+    (xvals, yvals)=mergeTraces(coarse, fines, [{'start':2.0, 'stop':4.0}, {'start':7.0, 'stop':8.0}])
+    np.testing.assert_array_equal(xvals, [0, 1, 2, 2.5, 3, 3.5, 4, 5, 6, 7, 8, 9, 10])
+    np.testing.assert_array_equal(yvals, [0, 0, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0])#Coarse kept where a sweep is empty
+
+def testZoomSweep(osa):
+    (xvals, yvals, info)=zoomSweep(osa, 1545, 1560, margin=20.0)
+    regions=info['regions']
+    assert [round(region['peaks'][0]) for region in regions]==[1550, 1552]#The 1550.12 and 1551.72 nm channels
+    for (region, center, power) in zip(regions, (1550.12, 1551.72), (0.0, -3.0)):
+        assert region['peakWavelength']==pytest.approx(center, abs=0.005)
+        assert region['peakPower']==pytest.approx(power, abs=3.0)
+        assert 0<region['width']<0.1
+        assert region['points']>0
+    assert info['coarse']['sensitivity']=='RAPID3' and info['fine']['resolution']=='0.005'
+    assert np.all(np.diff(xvals)>=0)
+    assert len(xvals)==len(yvals)>info['coarse']['points']
+    assert osa.settings['resolution']==pytest.approx(0.005)#Last sweep was a fine one
+
+def testZoomSweepInvalidRange(osa):
+    with pytest.raises(ValueError):
+        zoomSweep(osa, 1560, 1545)